@@ -0,0 +1,17 @@
+-- Migration: one attendance row per student, routine and day
+-- Lets the backend record a whole class with a single idempotent upsert
+-- (ON CONFLICT (student_id, routine_id, date) DO UPDATE). Re-submitting a
+-- session overwrites its rows instead of duplicating them.
+
+-- 1. Drop duplicates left by repeated submissions, keeping the latest row
+-- (rows stamped in the same instant are ordered by id, so exactly one survives)
+DELETE FROM attendance_logs a
+USING attendance_logs b
+WHERE a.student_id = b.student_id
+  AND a.routine_id = b.routine_id
+  AND a.date = b.date
+  AND (a."timestamp", a.id) < (b."timestamp", b.id);
+
+-- 2. Conflict target for the upsert
+CREATE UNIQUE INDEX IF NOT EXISTS attendance_logs_student_routine_date_key
+ON attendance_logs (student_id, routine_id, date);
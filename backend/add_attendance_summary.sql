@@ -0,0 +1,102 @@
+-- Migration: incrementally maintained attendance aggregates
+-- attendance_summary keeps one counter row per (student, routine), updated by a
+-- trigger on every attendance_logs insert/update/delete. Per-student,
+-- per-subject and per-routine figures are sums over these rows, so their cost
+-- depends on the number of students and routines, not on the log history.
+-- Served by GET /api/analytics/attendance.
+
+-- 1. Counter table
+CREATE TABLE IF NOT EXISTS attendance_summary (
+    student_id UUID NOT NULL,
+    routine_id UUID,
+    course_catalog_id UUID,
+    section_id UUID,
+    present INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    last_date DATE,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    -- routine_id is nullable on attendance_logs; treat NULL as one routine
+    CONSTRAINT attendance_summary_student_routine_key UNIQUE NULLS NOT DISTINCT (student_id, routine_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_attendance_summary_section ON attendance_summary(section_id);
+CREATE INDEX IF NOT EXISTS idx_attendance_summary_course ON attendance_summary(course_catalog_id);
+CREATE INDEX IF NOT EXISTS idx_attendance_summary_routine ON attendance_summary(routine_id);
+
+-- 2. Apply each log change as a delta
+CREATE OR REPLACE FUNCTION bump_attendance_summary(
+    p_student UUID, p_routine UUID, p_course UUID, p_section UUID,
+    p_date DATE, p_present INTEGER, p_total INTEGER
+) RETURNS void AS $$
+BEGIN
+    INSERT INTO attendance_summary AS s
+        (student_id, routine_id, course_catalog_id, section_id, present, total, last_date)
+    VALUES (p_student, p_routine, p_course, p_section, p_present, p_total, p_date)
+    ON CONFLICT ON CONSTRAINT attendance_summary_student_routine_key DO UPDATE
+    SET present = s.present + EXCLUDED.present,
+        total = s.total + EXCLUDED.total,
+        course_catalog_id = COALESCE(EXCLUDED.course_catalog_id, s.course_catalog_id),
+        section_id = COALESCE(EXCLUDED.section_id, s.section_id),
+        -- Not moved back on delete; only used as "last seen"
+        last_date = GREATEST(s.last_date, EXCLUDED.last_date),
+        updated_at = now();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_attendance_summary()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_attendance_summary(
+            OLD.student_id, OLD.routine_id, OLD.course_catalog_id, OLD.section_id, NULL,
+            -(OLD.status = 'present')::INTEGER, -1
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_attendance_summary(
+            NEW.student_id, NEW.routine_id, NEW.course_catalog_id, NEW.section_id, NEW.date,
+            (NEW.status = 'present')::INTEGER, 1
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_attendance_summary ON attendance_logs;
+CREATE TRIGGER trg_attendance_summary
+AFTER INSERT OR UPDATE OR DELETE ON attendance_logs
+FOR EACH ROW EXECUTE FUNCTION track_attendance_summary();
+
+-- 3. Backfill from the existing history (one-off)
+TRUNCATE attendance_summary;
+INSERT INTO attendance_summary (student_id, routine_id, course_catalog_id, section_id, present, total, last_date)
+SELECT student_id, routine_id, MAX(course_catalog_id::text)::UUID, MAX(section_id::text)::UUID,
+       COUNT(*) FILTER (WHERE status = 'present'), COUNT(*), MAX(date)
+FROM attendance_logs
+GROUP BY student_id, routine_id;
+
+-- 4. Aggregates read by the backend
+CREATE OR REPLACE VIEW attendance_by_student AS
+SELECT student_id, section_id,
+       SUM(present)::INTEGER AS present, SUM(total)::INTEGER AS total,
+       ROUND(100.0 * SUM(present) / NULLIF(SUM(total), 0), 1) AS percentage,
+       MAX(last_date) AS last_date
+FROM attendance_summary
+GROUP BY student_id, section_id;
+
+CREATE OR REPLACE VIEW attendance_by_subject AS
+SELECT student_id, section_id, course_catalog_id,
+       SUM(present)::INTEGER AS present, SUM(total)::INTEGER AS total,
+       ROUND(100.0 * SUM(present) / NULLIF(SUM(total), 0), 1) AS percentage,
+       MAX(last_date) AS last_date
+FROM attendance_summary
+GROUP BY student_id, section_id, course_catalog_id;
+
+CREATE OR REPLACE VIEW attendance_by_routine AS
+SELECT routine_id, section_id, course_catalog_id,
+       COUNT(*)::INTEGER AS students,
+       SUM(present)::INTEGER AS present, SUM(total)::INTEGER AS total,
+       ROUND(100.0 * SUM(present) / NULLIF(SUM(total), 0), 1) AS percentage,
+       MAX(last_date) AS last_date
+FROM attendance_summary
+GROUP BY routine_id, section_id, course_catalog_id;
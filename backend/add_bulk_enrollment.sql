@@ -0,0 +1,22 @@
+-- Migration for bulk face enrollment (/api/face/enroll/bulk)
+-- Writes many students' embeddings in one statement instead of one UPDATE
+-- per student. The backend sends batches of {"id": ..., "embedding": "[...]"}.
+
+CREATE OR REPLACE FUNCTION set_face_embeddings(payload jsonb)
+RETURNS integer AS $$
+DECLARE
+    updated integer;
+BEGIN
+    UPDATE students AS s
+    SET face_embedding = p.embedding::vector,
+        face_registered = true
+    FROM jsonb_to_recordset(payload) AS p(id uuid, embedding text)
+    WHERE s.id = p.id;
+
+    GET DIAGNOSTICS updated = ROW_COUNT;
+    RETURN updated;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Roll numbers are looked up in batches
+CREATE INDEX IF NOT EXISTS idx_students_student_id ON students(student_id);
@@ -0,0 +1,44 @@
+-- Migration to support incremental (delta) FAISS index sync
+-- The backend keeps the highest students.updated_at it has indexed and only
+-- fetches rows changed after it. Deleted students are recorded in
+-- student_deletions so they can be dropped from the index too.
+
+-- 1. Track when a student row (including face_embedding) last changed
+ALTER TABLE students
+ADD COLUMN IF NOT EXISTS updated_at timestamptz DEFAULT now() NOT NULL;
+
+CREATE OR REPLACE FUNCTION set_students_updated_at()
+RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_students_updated_at ON students;
+CREATE TRIGGER trg_students_updated_at
+BEFORE UPDATE ON students
+FOR EACH ROW EXECUTE FUNCTION set_students_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_students_updated_at ON students(updated_at);
+
+-- 2. Tombstones for deleted students
+CREATE TABLE IF NOT EXISTS student_deletions (
+    student_id uuid NOT NULL,
+    deleted_at timestamptz DEFAULT now() NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_student_deletions_deleted_at ON student_deletions(deleted_at);
+
+CREATE OR REPLACE FUNCTION log_student_deletion()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO student_deletions (student_id) VALUES (OLD.id);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_students_deleted ON students;
+CREATE TRIGGER trg_students_deleted
+AFTER DELETE ON students
+FOR EACH ROW EXECUTE FUNCTION log_student_deletion();
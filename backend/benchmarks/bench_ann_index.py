@@ -0,0 +1,83 @@
+import sys
+import os
+import time
+import tempfile
+import numpy as np
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.vector_search import VectorSearch, select_engine
+
+DIMENSION = 512
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+NUM_QUERIES = 200
+K = 10
+# (engine, [search params to sweep])
+SWEEPS = [
+    ("flat", [{}]),
+    ("hnsw", [{"ef_search": 16}, {"ef_search": 64}, {"ef_search": 256}]),
+    ("ivf_flat", [{"nprobe": 4}, {"nprobe": 16}, {"nprobe": 64}]),
+    ("ivf_pq", [{"nprobe": 4}, {"nprobe": 16}, {"nprobe": 64}]),
+]
+
+
+def make_gallery(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, DIMENSION)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_queries(gallery, seed=1):
+    # Re-captures of enrolled faces: gallery vectors plus noise, renormalized
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, gallery.shape[0], NUM_QUERIES)
+    queries = gallery[picks] + 0.05 * rng.standard_normal((NUM_QUERIES, DIMENSION)).astype('float32')
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries
+
+
+def build(engine, gallery, workdir):
+    vs = VectorSearch(
+        snapshot_dir=os.path.join(workdir, engine),
+        engine=engine,
+    )
+    start = time.perf_counter()
+    vs.rebuild_index({str(i): gallery[i] for i in range(gallery.shape[0])})
+    return vs, time.perf_counter() - start
+
+
+def recall_at(truth, found, k):
+    hits = [len(set(t[:k]) & set(f[:k])) / k for t, f in zip(truth, found)]
+    return float(np.mean(hits))
+
+
+if __name__ == "__main__":
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+
+    for n in [s for s in SIZES if s <= max_size]:
+        gallery = make_gallery(n)
+        queries = make_queries(gallery)
+        print(f"\n=== {n:,} vectors (auto policy -> {select_engine(n)}) ===")
+
+        with tempfile.TemporaryDirectory() as workdir:
+            truth = None
+            for engine, params_list in SWEEPS:
+                vs, build_time = build(engine, gallery, workdir)
+                if vs.engine != engine:
+                    print(f"{engine:>9}: skipped (fell back to {vs.engine})")
+                    continue
+
+                for params in params_list:
+                    vs.set_search_params(**params)
+                    start = time.perf_counter()
+                    _, ids = vs.search_batch(queries, k=K)
+                    elapsed = time.perf_counter() - start
+
+                    if truth is None:
+                        truth = ids
+                    label = ", ".join(f"{k}={v}" for k, v in params.items()) or "exact"
+                    print(f"{engine:>9} [{label:>14}]: build {build_time:7.2f} s  "
+                          f"search {elapsed / NUM_QUERIES * 1000:7.3f} ms/query  "
+                          f"recall@1 {recall_at(truth, ids, 1):.3f}  recall@{K} {recall_at(truth, ids, K):.3f}")
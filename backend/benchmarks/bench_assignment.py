@@ -0,0 +1,54 @@
+import sys
+import os
+import time
+import numpy as np
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.assignment import assign_faces
+
+FACE_COUNTS = [10, 60, 150, 300]
+TOP_K = [1, 5, 10]
+THRESHOLD = 1.6
+REPEATS = 20
+
+
+def make_candidates(n, k, roster=None, seed=0):
+    """
+    Synthetic top-k search results for `n` faces against a class roster:
+    each face's true student is usually first, with classmates behind it.
+    """
+    rng = np.random.default_rng(seed)
+    roster = roster or int(n * 1.2)
+    truth = rng.permutation(roster)[:n]
+    distances = np.sort(rng.uniform(0.3, 1.9, (n, k)).astype('float32'), axis=1)
+    student_ids = []
+    for i in range(n):
+        # Look-alikes are other students in the same photo
+        others = [t for t in rng.choice(truth, size=k, replace=False) if t != truth[i]]
+        row = [f"s{truth[i]}"] + [f"s{o}" for o in others[:k - 1]]
+        # About one face in five ranks a classmate first
+        if k > 1 and rng.random() < 0.2:
+            row[0], row[1] = row[1], row[0]
+        student_ids.append(row)
+    return distances, student_ids
+
+
+def time_assignment(n, k):
+    distances, student_ids = make_candidates(n, k)
+    assign_faces(distances, student_ids, THRESHOLD)  # warm-up
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        assigned, _ = assign_faces(distances, student_ids, THRESHOLD)
+    elapsed = (time.perf_counter() - start) / REPEATS
+    duplicates_k1 = n - len(set(row[0] for row in student_ids))
+    return elapsed, duplicates_k1, len([a for a in assigned if a is not None])
+
+
+if __name__ == "__main__":
+    print(f"{'faces':>6} {'k':>4} | {'assign ms':>10} {'k=1 dup ids':>12} {'assigned':>9}")
+    for n in FACE_COUNTS:
+        for k in TOP_K:
+            elapsed, duplicates, assigned = time_assignment(n, k)
+            print(f"{n:>6} {k:>4} | {elapsed * 1000:10.3f} {duplicates:>12} {assigned:>9}")
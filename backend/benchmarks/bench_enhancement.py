@@ -0,0 +1,65 @@
+import sys
+import os
+import time
+import cv2
+import numpy as np
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.image_enhancement import enhancer
+
+REPEATS = 5
+
+
+def dark_image(width, height, seed=0):
+    # Smooth gradient plus texture, scaled down to a dim classroom level
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(10, 60, width, dtype=np.float32)[None, :, None]
+    texture = rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+    return np.clip(gradient + texture, 0, 255).astype(np.uint8)
+
+
+def timeit(fn, *args):
+    fn(*args)  # warm-up
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn(*args)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+
+def hsv_brightness(img):
+    return np.mean(cv2.cvtColor(img, cv2.COLOR_BGR2HSV)[:, :, 2])
+
+
+def rebuilt_gamma(img, gamma=1.5):
+    inv_gamma = 1.0 / gamma
+    table = np.array([((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
+    return cv2.LUT(img, table)
+
+
+def reference_retinex(img):
+    # The original per-channel float64 MSRCR path
+    b, g, r = cv2.split(img)
+    return cv2.merge((enhancer.automated_msrcr(b), enhancer.automated_msrcr(g), enhancer.automated_msrcr(r)))
+
+
+def report(name, before, after):
+    print(f"{name:<34} {before:10.2f} ms -> {after:9.2f} ms  ({before / max(after, 1e-6):6.1f}x)")
+
+
+if __name__ == "__main__":
+    for width, height in [(1920, 1080), (4000, 3000)]:
+        img = dark_image(width, height)
+        print(f"\n=== {width}x{height} ===")
+        report("brightness (HSV -> downsampled)", timeit(hsv_brightness, img), timeit(enhancer.estimate_brightness, img))
+        report("gamma (rebuilt LUT -> cached)", timeit(rebuilt_gamma, img), timeit(enhancer.apply_gamma, img))
+        print(f"{'clahe':<34} {timeit(enhancer.apply_clahe, img):10.2f} ms")
+
+    # The reference Retinex takes seconds per frame at full HD, so compare there only
+    img = dark_image(1920, 1080)
+    print("\n=== Retinex 1920x1080 ===")
+    report("retinex (float64 -> float32 pyramid)", timeit(reference_retinex, img), timeit(enhancer.fast_retinex, img))
+
+    crops = [dark_image(112, 112, seed=i) for i in range(30)]
+    print(f"{'retinex face ROIs (30 x 112px)':<34} {timeit(enhancer.enhance_crops, crops):10.2f} ms")
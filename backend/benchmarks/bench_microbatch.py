@@ -0,0 +1,74 @@
+import sys
+import os
+import glob
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.face_logic import face_service
+
+DEBUG_IMAGES = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'debug_images'))
+CONCURRENCY = [1, 4, 8, 16]
+REQUESTS_PER_CLIENT = 10
+
+
+def load_images(paths):
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def run_load(images, concurrency):
+    """
+    Fire `concurrency` clients, each sending REQUESTS_PER_CLIENT uploads back to back.
+    Returns (requests/sec, p50 ms, p99 ms).
+    """
+    def client(offset):
+        latencies = []
+        for i in range(REQUESTS_PER_CLIENT):
+            image_bytes = images[(offset + i) % len(images)]
+            start = time.perf_counter()
+            face_service.get_embeddings_batch(image_bytes)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([l for r in results for l in r]) * 1000
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(DEBUG_IMAGES, '*.jpg')))
+    if not paths:
+        print("❌ No images found. Pass image paths as arguments.")
+        sys.exit(1)
+    if not face_service.load():
+        print("❌ InsightFace not initialized.")
+        sys.exit(1)
+
+    images = load_images(paths)
+    batcher = face_service.batcher
+    print(f"Loaded {len(images)} images. Batch window: {batcher.window * 1000 if batcher else 0:.0f} ms")
+
+    modes = [("per-request", None)]
+    if batcher is not None:
+        modes.append(("micro-batch", batcher))
+
+    for name, mode_batcher in modes:
+        face_service.batcher = mode_batcher
+        face_service.get_embeddings_batch(images[0])  # warm-up
+        print(f"\n--- {name} ---")
+        for concurrency in CONCURRENCY:
+            rps, p50, p99 = run_load(images, concurrency)
+            print(f"concurrency {concurrency:>3}: {rps:7.2f} req/s  p50 {p50:8.1f} ms  p99 {p99:8.1f} ms")
+
+    face_service.batcher = batcher
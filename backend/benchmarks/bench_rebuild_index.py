@@ -0,0 +1,58 @@
+import sys
+import os
+import time
+import tempfile
+import numpy as np
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.vector_search import VectorSearch
+
+SIZES = [1000, 5000, 10000, 20000]
+# The per-student path rewrites the whole index on every add, so keep it small
+LEGACY_SIZES = [250, 500, 1000, 2000]
+
+
+def make_embeddings(n, dimension=512, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dimension)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return {f"student_{i}": vectors[i].tolist() for i in range(n)}
+
+
+def fresh_index(workdir):
+    return VectorSearch(snapshot_dir=workdir)
+
+
+def bench_bulk(n):
+    embeddings = make_embeddings(n)
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = fresh_index(workdir)
+        start = time.perf_counter()
+        vs.rebuild_index(embeddings)
+        return time.perf_counter() - start
+
+
+def bench_legacy(n):
+    embeddings = make_embeddings(n)
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = fresh_index(workdir)
+        start = time.perf_counter()
+        vs.index.reset()
+        vs.id_mapping = {}
+        for student_id, emb_list in embeddings.items():
+            vs.add_vector(student_id, np.array(emb_list).astype('float32'))
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print("--- Bulk rebuild_index (single write) ---")
+    for n in SIZES:
+        elapsed = bench_bulk(n)
+        print(f"{n:>7} students: {elapsed * 1000:9.1f} ms  ({elapsed / n * 1e6:7.2f} us/student)")
+
+    print("\n--- Legacy per-student add_vector (write per add) ---")
+    for n in LEGACY_SIZES:
+        elapsed = bench_legacy(n)
+        print(f"{n:>7} students: {elapsed * 1000:9.1f} ms  ({elapsed / n * 1e6:7.2f} us/student)")
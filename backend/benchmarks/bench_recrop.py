@@ -0,0 +1,102 @@
+import sys
+import os
+import glob
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.config import settings
+from services.face_logic import face_service, choose_det_size
+from bench_stages import face_tile, DEBUG_IMAGES
+
+# Camera resolutions (width, height) of a classroom group photo
+CAMERAS = [(4000, 3000), (6000, 4000), (8000, 6000)]
+STUDENTS = 40
+REPEATS = 3
+
+
+def classroom_photo(tile, width, height, students=STUDENTS):
+    """
+    `students` faces in rows across a wide shot: each face is about 1/28 of the
+    width, so it is well under RECOG_MIN_FACE_PX once the photo is decoded reduced.
+    """
+    face = max(32, width // 28)
+    cols = 8
+    rows = int(np.ceil(students / cols))
+    canvas = np.full((height, width, 3), 127, dtype=np.uint8)
+    resized = cv2.resize(tile, (face, face))
+    x_step, y_step = width // (cols + 1), height // (rows + 1)
+    for i in range(students):
+        r, c = divmod(i, cols)
+        x, y = (c + 1) * x_step - face // 2, (r + 1) * y_step - face // 2
+        canvas[y:y + face, x:x + face] = resized
+    return cv2.imencode('.jpg', canvas, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def measure(fn):
+    """
+    Mean ms over REPEATS and peak traced memory (MB) of one run.
+    """
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn()
+    elapsed = (time.perf_counter() - start) / REPEATS * 1000
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def recrop(image_bytes, full_resolution=False):
+    """
+    Decode reduced, detect, then align every face as the pipeline does.
+    With `full_resolution`, re-crops come from a full decode of the original
+    (the previous behavior) instead of the budgeted finer decode.
+    Returns (decode scale used for the re-crops or None, faces found).
+    """
+    img, factor, full_loader = face_service._load_image(image_bytes)
+    h, w = img.shape[:2]
+    faces = face_service._detect(img, choose_det_size(w, h, STUDENTS))
+    used = {}
+
+    def loader(scale=1):
+        if full_resolution:
+            finer, actual = face_service._decode_image(image_bytes), 1
+        else:
+            finer, actual = full_loader(scale)
+        used["scale"] = actual if finer is not None else None
+        return finer, actual
+
+    if faces:
+        face_service._align(img, faces, factor=factor, full_loader=loader)
+    return used.get("scale"), len(faces)
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(DEBUG_IMAGES, '*.jpg')))
+    if not face_service.load():
+        print("❌ InsightFace not initialized.")
+        sys.exit(1)
+
+    tile = next((t for t in map(face_tile, paths) if t is not None), None)
+    if tile is None:
+        print("❌ No face found in the sample images. Pass image paths as arguments.")
+        sys.exit(1)
+
+    print(f"{STUDENTS} students, RECOG_MIN_FACE_PX={settings.RECOG_MIN_FACE_PX}, "
+          f"RECOG_MAX_DECODE_MP={settings.RECOG_MAX_DECODE_MP}")
+    print(f"{'camera':>10} {'faces':>6} | {'full-res ms':>11} {'peak MB':>8} | "
+          f"{'scaled ms':>10} {'peak MB':>8} {'scale':>6}")
+    for width, height in CAMERAS:
+        image_bytes = classroom_photo(tile, width, height)
+        full_ms, full_peak = measure(lambda: recrop(image_bytes, full_resolution=True))
+        scaled_ms, scaled_peak = measure(lambda: recrop(image_bytes))
+        scale, found = recrop(image_bytes)
+        print(f"{width * height / 1e6:>8.0f}MP {found:>6} | {full_ms:11.1f} {full_peak:8.1f} | "
+              f"{scaled_ms:10.1f} {scaled_peak:8.1f} {('1/' + str(scale)) if scale else '-':>6}")
@@ -0,0 +1,110 @@
+import sys
+import os
+import glob
+import time
+import cv2
+import numpy as np
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from insightface.app import FaceAnalysis
+from core.config import settings
+from services.face_logic import face_service
+from services.image_enhancement import enhancer
+
+DEBUG_IMAGES = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'debug_images'))
+FACE_COUNTS = [1, 10, 60]
+CELL = 160
+REPEATS = 5
+
+
+def face_tile(image_path):
+    """
+    Crop the largest face of a sample photo (with margin) to use as a tile.
+    """
+    img = cv2.imread(image_path)
+    faces = face_service._detect(img)
+    if not faces:
+        return None
+    x1, y1, x2, y2 = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1])).bbox.astype(int)
+    pad = int(0.4 * (x2 - x1))
+    h, w = img.shape[:2]
+    crop = img[max(0, y1 - pad):min(h, y2 + pad), max(0, x1 - pad):min(w, x2 + pad)]
+    return cv2.resize(crop, (CELL, CELL))
+
+
+def group_image(tile, n):
+    """
+    Lay `n` copies of the tile out on a grid to imitate a classroom photo.
+    """
+    cols = int(np.ceil(np.sqrt(n)))
+    rows = int(np.ceil(n / cols))
+    canvas = np.full((rows * CELL, cols * CELL, 3), 127, dtype=np.uint8)
+    for i in range(n):
+        r, c = divmod(i, cols)
+        canvas[r * CELL:(r + 1) * CELL, c * CELL:(c + 1) * CELL] = tile
+    return cv2.imencode('.jpg', canvas)[1].tobytes()
+
+
+def time_stages(image_bytes):
+    timings = {}
+
+    start = time.perf_counter()
+    img = face_service._decode_image(image_bytes)
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    img = enhancer.enhance_if_needed(img)
+    timings["enhance"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    faces = face_service._detect(img)
+    timings["detect"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if faces:
+        face_service._embed(img, faces)
+    timings["embed"] = time.perf_counter() - start
+
+    return timings, len(faces)
+
+
+def time_full_pack(app, image_bytes):
+    img = enhancer.enhance_if_needed(face_service._decode_image(image_bytes))
+    start = time.perf_counter()
+    app.get(img)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(DEBUG_IMAGES, '*.jpg')))
+    if not face_service.load():
+        print("❌ InsightFace not initialized.")
+        sys.exit(1)
+    # Time the per-request ArcFace pass, not the cross-request batch window
+    face_service.batcher = None
+
+    tile = next((t for t in map(face_tile, paths) if t is not None), None)
+    if tile is None:
+        print("❌ No face found in the sample images. Pass image paths as arguments.")
+        sys.exit(1)
+
+    # All five buffalo_l models, as FaceAnalysis loads them by default
+    full_pack = FaceAnalysis(name=settings.FACE_MODEL, providers=['CPUExecutionProvider'])
+    full_pack.prepare(ctx_id=0, det_size=(640, 640))
+
+    print(f"Modules: {settings.FACE_MODULES}")
+    print(f"{'faces':>6} {'found':>6} | {'decode':>8} {'enhance':>8} {'detect':>8} {'embed':>8} | "
+          f"{'total':>8} {'ms/face':>8} | {'det+rec ms/face':>16} {'all-modules ms/face':>20}")
+    for n in FACE_COUNTS:
+        image_bytes = group_image(tile, n)
+        runs = [time_stages(image_bytes) for _ in range(REPEATS)]
+        found = runs[-1][1]
+        avg = {stage: np.mean([r[0][stage] for r in runs]) * 1000 for stage in runs[0][0]}
+        total = sum(avg.values())
+        full = np.mean([time_full_pack(full_pack, image_bytes) for _ in range(REPEATS)]) * 1000
+
+        per_face = max(found, 1)
+        print(f"{n:>6} {found:>6} | {avg['decode']:8.1f} {avg['enhance']:8.1f} {avg['detect']:8.1f} {avg['embed']:8.1f} | "
+              f"{total:8.1f} {total / per_face:8.2f} | {(avg['detect'] + avg['embed']) / per_face:16.2f} {full / per_face:20.2f}")
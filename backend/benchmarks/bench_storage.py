@@ -0,0 +1,76 @@
+import sys
+import os
+import time
+import tempfile
+import faiss
+import numpy as np
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.config import settings
+from services.vector_search import VectorSearch, STORAGES
+
+DIMENSION = 512
+SIZES = [20_000, 100_000, 500_000]
+NUM_QUERIES = 200
+K = 10
+RERANK_FACTORS = [1, 4, 10]
+
+
+def make_gallery(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, DIMENSION)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_queries(gallery, seed=1):
+    # Re-captures of enrolled faces: gallery vectors plus noise, renormalized
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, gallery.shape[0], NUM_QUERIES)
+    queries = gallery[picks] + 0.05 * rng.standard_normal((NUM_QUERIES, DIMENSION)).astype('float32')
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries
+
+
+def index_bytes(index):
+    return len(faiss.serialize_index(index)) if index is not None else 0
+
+
+def recall_at(truth, found, k):
+    hits = [len(set(t[:k]) & set(f[:k])) / k for t, f in zip(truth, found)]
+    return float(np.mean(hits))
+
+
+if __name__ == "__main__":
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+
+    for n in [s for s in SIZES if s <= max_size]:
+        gallery = make_gallery(n)
+        queries = make_queries(gallery)
+        embeddings = {str(i): gallery[i] for i in range(n)}
+        print(f"\n=== {n:,} vectors, flat engine ===")
+        print(f"{'storage':>8} {'rerank':>7} | {'index MB':>9} {'exact MB':>9} {'B/vector':>9} | "
+              f"{'ms/query':>9} {'recall@1':>9} {'recall@10':>10}")
+
+        with tempfile.TemporaryDirectory() as workdir:
+            truth = None
+            for storage in STORAGES:
+                vs = VectorSearch(snapshot_dir=os.path.join(workdir, storage), engine="flat", storage=storage)
+                vs.rebuild_index(embeddings, save=False)
+                in_memory = index_bytes(vs.index)
+                # The exact copies stay in the mmapped snapshot; only reranked rows are paged in
+                exact = index_bytes(vs.exact)
+
+                for factor in (RERANK_FACTORS if vs.exact is not None else [1]):
+                    settings.INDEX_RERANK = factor
+                    start = time.perf_counter()
+                    _, ids = vs.search_batch(queries, k=K)
+                    elapsed = time.perf_counter() - start
+                    if truth is None:
+                        truth = ids
+
+                    print(f"{storage:>8} {factor if vs.exact is not None else '-':>7} | "
+                          f"{in_memory / 2**20:9.1f} {exact / 2**20:9.1f} {in_memory / n:9.0f} | "
+                          f"{elapsed / NUM_QUERIES * 1000:9.3f} {recall_at(truth, ids, 1):9.3f} {recall_at(truth, ids, K):10.3f}")
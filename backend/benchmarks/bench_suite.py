@@ -0,0 +1,598 @@
+import sys
+import os
+import argparse
+import atexit
+import glob
+import json
+import platform
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# End-to-end benchmark with JSON baselines:
+#   python benchmarks/bench_suite.py --save          record a baseline on this machine
+#   python benchmarks/bench_suite.py                 compare against it, exit 1 on regression
+# Runs offline: Supabase is replaced by an in-memory stub and the app is driven
+# through FastAPI's in-process TestClient.
+
+# Fresh snapshot and no result cache, so every run measures the same cold work
+WORKDIR = tempfile.mkdtemp(prefix="attendu-bench-")
+atexit.register(shutil.rmtree, WORKDIR, True)
+os.environ["INDEX_SNAPSHOT_DIR"] = os.path.join(WORKDIR, "snapshot")
+os.environ["RESULT_CACHE_ENTRIES"] = "0"
+os.environ["SERVER_TIMING"] = "false"
+
+# Adjust path to find backend modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.testclient import TestClient
+from core.config import settings
+from core.database import SupabaseDB
+from services.face_logic import face_service, extract_faces
+from services.metrics import run_timed
+from services.vector_search import VectorSearch, vector_search
+from services.index_sync import index_sync
+from bench_stages import face_tile, group_image, DEBUG_IMAGES
+
+DIMENSION = 512
+GALLERY_SIZES = [1_000, 10_000, 100_000]
+FACE_COUNTS = [1, 10, 30, 60]
+CONCURRENCY = [1, 4, 8]
+NUM_QUERIES = 200
+REPEATS = 10
+REQUESTS_PER_CLIENT = 10
+SECTION_SIZE = 60
+# Delta sync: students in the table, rows changed between syncs, and a small page
+# size so the keyset (or_) pagination is exercised
+SYNC_STUDENTS = 5_000
+SYNC_CHANGED = 200
+SYNC_PAGE_SIZE = 64
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Latency stats compared against the baseline; differences under NOISE_MS never fail
+COMPARED = ("p50_ms", "p99_ms")
+NOISE_MS = 0.5
+
+
+class StubResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+# PostgREST comparison operators, as used in filters and or_() expressions
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+}
+
+
+def compare_value(row, column, op, value):
+    current = row.get(column)
+    if op == "is":
+        return (current is None) == (str(value) == "null")
+    if current is None:
+        return False
+    # or_() values arrive as text; compare them as the row's type
+    if isinstance(current, (int, float)) and isinstance(value, str):
+        value = type(current)(value)
+    elif isinstance(value, str) and not isinstance(current, str):
+        current = str(current)
+    return OPERATORS[op](current, value)
+
+
+def split_top_level(expression):
+    """
+    Split a PostgREST logic expression on the commas outside parentheses and quotes.
+    """
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(expression):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(expression[start:i])
+            start = i + 1
+    parts.append(expression[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+
+def parse_logic(expression, combine=any):
+    """
+    Predicate for an or_() expression such as 'a.gt."x",and(a.eq."x",id.gt.5)'.
+    """
+    tests = []
+    for term in split_top_level(expression):
+        for name, inner in (("and(", all), ("or(", any)):
+            if term.startswith(name) and term.endswith(")"):
+                tests.append(parse_logic(term[len(name):-1], inner))
+                break
+        else:
+            column, op, value = term.split(".", 2)
+            tests.append(lambda row, c=column, o=op, v=value.strip('"'): compare_value(row, c, o, v))
+    return lambda row: combine(test(row) for test in tests)
+
+
+class StubQuery:
+    """
+    The subset of the supabase-py query builder the backend uses, over in-memory rows.
+    """
+    def __init__(self, tables, name):
+        self.rows = tables.setdefault(name, [])
+        self.filters = []
+        self.orders = []
+        self.window = None
+        self.count = None
+        self.write = None
+        self.negate = False
+
+    def select(self, columns="*", count=None):
+        self.count = count
+        return self
+
+    @property
+    def not_(self):
+        self.negate = True
+        return self
+
+    def _filter(self, test):
+        negate, self.negate = self.negate, False
+        self.filters.append((lambda row: not test(row)) if negate else test)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(lambda row: str(row.get(column)) == str(value))
+
+    def gt(self, column, value):
+        return self._filter(lambda row: compare_value(row, column, "gt", value))
+
+    def gte(self, column, value):
+        return self._filter(lambda row: compare_value(row, column, "gte", value))
+
+    def in_(self, column, values):
+        values = {str(v) for v in values}
+        return self._filter(lambda row: str(row.get(column)) in values)
+
+    def is_(self, column, value):
+        return self._filter(lambda row: (row.get(column) is None) == (value == "null"))
+
+    def or_(self, expression):
+        return self._filter(parse_logic(expression))
+
+    def order(self, column, desc=False, nullsfirst=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self.window = (0, n)
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end - start + 1)
+        return self
+
+    def upsert(self, rows, on_conflict="id", ignore_duplicates=False):
+        kind = "insert_missing" if ignore_duplicates else "upsert"
+        self.write = (kind, rows if isinstance(rows, list) else [rows], on_conflict.split(","))
+        return self
+
+    def insert(self, rows):
+        self.write = ("insert", rows if isinstance(rows, list) else [rows], None)
+        return self
+
+    def update(self, values):
+        self.write = ("update", values, None)
+        return self
+
+    def execute(self):
+        selected = [row for row in self.rows if all(test(row) for test in self.filters)]
+        if self.write is not None:
+            return self._apply_write(selected)
+
+        count = len(selected) if self.count else None
+        for column, desc in reversed(self.orders):
+            selected.sort(key=lambda row: (row.get(column) is None, row.get(column) if row.get(column) is not None else 0), reverse=desc)
+        if self.window is not None:
+            start, size = self.window
+            selected = selected[start:start + size]
+        return StubResponse([dict(row) for row in selected], count)
+
+    def _apply_write(self, selected):
+        kind, payload, keys = self.write
+        if kind == "update":
+            for row in selected:
+                row.update(payload)
+            return StubResponse([dict(row) for row in selected])
+        for new in payload:
+            existing = None
+            if kind != "insert":
+                existing = next((row for row in self.rows if all(str(row.get(k)) == str(new.get(k)) for k in keys)), None)
+            if existing is None:
+                self.rows.append(dict(new))
+            elif kind == "upsert":
+                existing.update(new)
+        return StubResponse([dict(row) for row in payload])
+
+
+class StubRpc:
+    def __init__(self, run):
+        self.run = run
+
+    def execute(self):
+        return StubResponse(self.run())
+
+
+class StubSupabase:
+    def __init__(self):
+        self.tables = {}
+
+    def table(self, name):
+        return StubQuery(self.tables, name)
+
+    def rpc(self, name, params=None):
+        """
+        The database functions the backend calls (see the *.sql migrations).
+        Unknown functions fail like a missing one does in PostgREST.
+        """
+        if name == "set_face_embeddings":
+            return StubRpc(lambda: self._set_face_embeddings(params["payload"]))
+        raise Exception(f"Could not find the function public.{name} in the schema cache")
+
+    def _set_face_embeddings(self, payload):
+        students = {str(row["id"]): row for row in self.tables.get("students", [])}
+        updated = 0
+        for entry in payload:
+            row = students.get(str(entry["id"]))
+            if row is not None:
+                row.update({"face_embedding": entry["embedding"], "face_registered": True})
+                updated += 1
+        return updated
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+        "n": int(samples.size),
+    }
+
+
+def rss_mb():
+    """
+    (current, peak) resident set size of this process in MB.
+    """
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        current = peak
+    return current, peak
+
+
+def make_gallery(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, DIMENSION)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_queries(gallery, n, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, gallery.shape[0], n)
+    queries = gallery[picks] + 0.05 * rng.standard_normal((n, DIMENSION)).astype('float32')
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries
+
+
+def bench_search(results, sizes):
+    print(f"\n=== Vector search ({settings.INDEX_ENGINE} engine, {settings.INDEX_STORAGE} storage) ===")
+    print(f"{'vectors':>9} | {'build s':>8} | {'1 query p50':>12} {'p99':>8} | {'60 queries p50':>15} {'p99':>8}")
+    for n in sizes:
+        gallery = make_gallery(n)
+        queries = make_queries(gallery, NUM_QUERIES)
+        vs = VectorSearch(snapshot_dir=os.path.join(WORKDIR, f"search-{n}"))
+        start = time.perf_counter()
+        vs.rebuild_index({str(i): gallery[i] for i in range(n)}, save=False)
+        build = time.perf_counter() - start
+
+        vs.search(queries[0])  # warm-up
+        single = []
+        for query in queries:
+            start = time.perf_counter()
+            vs.search(query, k=1)
+            single.append((time.perf_counter() - start) * 1000)
+
+        # One classroom photo worth of faces per call
+        batch = []
+        for r in range(REPEATS):
+            chunk = queries[(r * SECTION_SIZE) % NUM_QUERIES:][:SECTION_SIZE]
+            start = time.perf_counter()
+            vs.search_batch(chunk, k=settings.RECOGNIZE_TOP_K)
+            batch.append((time.perf_counter() - start) * 1000)
+
+        results[f"search/{n}/single"] = percentiles(single)
+        results[f"search/{n}/batch"] = percentiles(batch)
+        results[f"search/{n}/build"] = {"seconds": build}
+        s, b = results[f"search/{n}/single"], results[f"search/{n}/batch"]
+        print(f"{n:>9,} | {build:8.2f} | {s['p50_ms']:9.3f} ms {s['p99_ms']:8.3f} | "
+              f"{b['p50_ms']:12.3f} ms {b['p99_ms']:8.3f}")
+
+
+def sample_images(tile):
+    """
+    Generated group photos of FACE_COUNTS faces plus the debug_images samples.
+    """
+    images = {f"group{n}": group_image(tile, n) for n in FACE_COUNTS}
+    for path in sorted(glob.glob(os.path.join(DEBUG_IMAGES, '*.jpg'))):
+        with open(path, "rb") as f:
+            images[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    return images
+
+
+def bench_stages(results, images):
+    print("\n=== Pipeline stages (ms, p50 over repeats) ===")
+    stages = ["decode", "enhance", "detect", "align", "embed"]
+    print(f"{'image':>22} {'faces':>6} | " + " ".join(f"{s:>8}" for s in stages) + f" | {'total':>8} {'p99':>8}")
+    for name, image_bytes in images.items():
+        extract_faces(image_bytes)  # warm-up
+        runs = [run_timed(extract_faces, image_bytes) for _ in range(REPEATS)]
+        faces = len(runs[-1][0])
+        totals = [sum(spans.values()) * 1000 for _, spans in runs]
+
+        entry = {"faces": faces, **percentiles(totals)}
+        for stage in stages:
+            entry[stage] = percentiles([spans.get(stage, 0.0) * 1000 for _, spans in runs])
+        results[f"stages/{name}"] = entry
+        print(f"{name:>22} {faces:>6} | " + " ".join(f"{entry[s]['p50_ms']:8.1f}" for s in stages) +
+              f" | {entry['p50_ms']:8.1f} {entry['p99_ms']:8.1f}")
+
+
+def seed_database(db, tile_embedding):
+    """
+    One section of SECTION_SIZE students (the first one is the face in the group
+    photos) and a routine for it.
+    """
+    section_id = str(uuid.UUID(int=1))
+    routine_id = str(uuid.UUID(int=2))
+    gallery = make_gallery(SECTION_SIZE, seed=5)
+    if tile_embedding is not None:
+        gallery[0] = tile_embedding
+    db.tables["students"] = [
+        {
+            "id": str(uuid.UUID(int=1000 + i)),
+            "section_id": section_id,
+            "student_id": f"ROLL-{i:04d}",
+            "face_embedding": "[" + ",".join(f"{v:.7g}" for v in gallery[i].tolist()) + "]",
+            "updated_at": "2024-01-01T00:00:00+00:00",
+        }
+        for i in range(SECTION_SIZE)
+    ]
+    db.tables["routines"] = [{
+        "id": routine_id, "section_id": section_id,
+        "teacher_id": str(uuid.UUID(int=3)), "course_catalog_id": str(uuid.UUID(int=4)),
+    }]
+    db.tables["student_deletions"] = []
+    return routine_id
+
+
+def bench_load(results, tile, image_bytes, levels):
+    print("\n=== Concurrent /api/face/recognize (in-process client, stubbed Supabase) ===")
+    db = StubSupabase()
+    SupabaseDB.client = db
+    tile_faces = extract_faces(group_image(tile, 1))
+    routine_id = seed_database(db, tile_faces[0]["embedding"] if tile_faces else None)
+
+    from main import app
+    with TestClient(app) as client:
+        # Startup warm-up and the stubbed sync run in the background
+        deadline = time.monotonic() + 300
+        while not client.get("/health/ready").json().get("ready") and time.monotonic() < deadline:
+            time.sleep(0.2)
+        client.post("/api/face/recognize", files={"image": ("warm.jpg", image_bytes, "image/jpeg")})
+
+        print(f"{'clients':>8} | {'req/s':>7} | {'p50 ms':>8} {'p99 ms':>8} | {'ok':>5} {'503':>5} {'other':>6}")
+        for clients in levels:
+            def session(worker):
+                samples = []
+                for i in range(REQUESTS_PER_CLIENT):
+                    start = time.perf_counter()
+                    response = client.post(
+                        "/api/face/recognize",
+                        files={"image": (f"c{worker}-{i}.jpg", image_bytes, "image/jpeg")},
+                        data={"routine_id": routine_id, "record": "true"},
+                    )
+                    samples.append(((time.perf_counter() - start) * 1000, response.status_code))
+                return samples
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                samples = [s for worker in pool.map(session, range(clients)) for s in worker]
+            elapsed = time.perf_counter() - start
+
+            ok = [ms for ms, status in samples if status == 200]
+            busy = sum(1 for _, status in samples if status == 503)
+            entry = {**percentiles(ok or [0.0]), "throughput_rps": len(ok) / elapsed,
+                     "rejected": busy, "errors": len(samples) - len(ok) - busy}
+            results[f"load/recognize/{clients}"] = entry
+            print(f"{clients:>8} | {entry['throughput_rps']:7.1f} | {entry['p50_ms']:8.1f} {entry['p99_ms']:8.1f} | "
+                  f"{len(ok):>5} {busy:>5} {entry['errors']:>6}")
+
+        logs = len(db.tables.get("attendance_logs", []))
+        print(f"📝 attendance_logs rows written through the stub: {logs}")
+
+
+def bench_sync(results):
+    print("\n=== Index sync (stubbed Supabase) ===")
+    db = StubSupabase()
+    SupabaseDB.client = db
+    gallery = make_gallery(SYNC_STUDENTS, seed=7)
+    db.tables["students"] = [
+        {
+            "id": str(uuid.UUID(int=10_000 + i)),
+            "section_id": str(uuid.UUID(int=1 + i % 50)),
+            "face_embedding": "[" + ",".join(f"{v:.7g}" for v in gallery[i].tolist()) + "]",
+            "updated_at": "2024-01-01T00:00:00+00:00",
+        }
+        for i in range(SYNC_STUDENTS)
+    ]
+    db.tables["student_deletions"] = []
+    students = db.tables["students"]
+
+    page_size, settings.SYNC_PAGE_SIZE = settings.SYNC_PAGE_SIZE, SYNC_PAGE_SIZE
+    try:
+        start = time.perf_counter()
+        index_sync.sync(full=True)
+        full = (time.perf_counter() - start) * 1000
+
+        rng = np.random.default_rng(8)
+        samples, mismatches, gone = [], 0, set()
+        for r in range(REPEATS):
+            # One bulk update stamps many rows alike; one embedding is cleared and one student deleted
+            stamp = f"2024-01-02T{r:02d}:00:00+00:00"
+            indexed = np.setdiff1d(np.arange(SYNC_STUDENTS), np.fromiter(gone, dtype=np.int64, count=len(gone)))
+            picks = rng.choice(indexed, SYNC_CHANGED + 2, replace=False)
+            gone.update(picks[-2:].tolist())
+            fresh = make_gallery(SYNC_CHANGED, seed=100 + r)
+            for row, vector in zip(picks[:SYNC_CHANGED], fresh):
+                students[row]["face_embedding"] = "[" + ",".join(f"{v:.7g}" for v in vector.tolist()) + "]"
+                students[row]["updated_at"] = stamp
+            students[picks[-2]].update({"face_embedding": None, "updated_at": stamp})
+            db.tables["student_deletions"].append({"student_id": students[picks[-1]]["id"], "deleted_at": stamp})
+
+            start = time.perf_counter()
+            result = index_sync.sync()
+            samples.append((time.perf_counter() - start) * 1000)
+            if result["mode"] != "delta" or result["upserted"] != SYNC_CHANGED or result["removed"] != 2:
+                mismatches += 1
+                print(f"⚠️ Unexpected delta sync result: {result}")
+    finally:
+        settings.SYNC_PAGE_SIZE = page_size
+
+    results["sync/full"] = {"ms": full}
+    results["sync/delta"] = percentiles(samples)
+    d = results["sync/delta"]
+    print(f"full sync of {SYNC_STUDENTS:,} students: {full:.1f} ms")
+    print(f"delta sync of {SYNC_CHANGED} changes + 2 removals: p50 {d['p50_ms']:.1f} ms, p99 {d['p99_ms']:.1f} ms"
+          f" ({vector_search.size:,} vectors, {mismatches} mismatched rounds)")
+
+
+def compare(current, baseline, tolerance, memory_tolerance):
+    """
+    Print every compared stat against the baseline; return the regressions.
+    """
+    regressions = []
+    print(f"\n=== Against baseline ({baseline['meta']['timestamp']}, tolerance {tolerance:.0%}) ===")
+    for key, entry in current["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        for stat in COMPARED:
+            if stat not in entry or stat not in base:
+                continue
+            now, before = entry[stat], base[stat]
+            regressed = now > before * (1 + tolerance) and now - before > NOISE_MS
+            change = (now - before) / before if before else 0.0
+            print(f"{'❌' if regressed else '✅'} {key:<32} {stat:<7} {before:10.3f} -> {now:10.3f} ms ({change:+.0%})")
+            if regressed:
+                regressions.append(f"{key} {stat}")
+
+    now, before = current["memory"]["peak_rss_mb"], baseline["memory"]["peak_rss_mb"]
+    regressed = now > before * (1 + memory_tolerance)
+    print(f"{'❌' if regressed else '✅'} {'peak RSS':<40} {before:10.1f} -> {now:10.1f} MB")
+    if regressed:
+        regressions.append("memory peak_rss_mb")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AttendU end-to-end benchmark and regression check")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON path")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--output", help="also write this run's results to a JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50/p99 slowdown (0.25 = 25%%)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.15, help="allowed peak RSS growth")
+    parser.add_argument("--quick", action="store_true", help="smaller galleries and load levels")
+    args = parser.parse_args()
+
+    if not face_service.load():
+        print("❌ InsightFace not initialized.")
+        sys.exit(1)
+
+    tile = next((t for t in map(face_tile, sorted(glob.glob(os.path.join(DEBUG_IMAGES, '*.jpg')))) if t is not None), None)
+    if tile is None:
+        # No usable sample: a blank tile still exercises decode, enhance and detect
+        tile = np.full((160, 160, 3), 127, dtype=np.uint8)
+        print("⚠️ No face found in debug_images; group images contain no faces.")
+
+    results = {}
+    memory = {"start_mb": rss_mb()[0]}
+    bench_search(results, GALLERY_SIZES[:2] if args.quick else GALLERY_SIZES)
+    memory["after_search_mb"] = rss_mb()[0]
+
+    # Stage timings per request, without the cross-request batch window
+    batcher, face_service.batcher = face_service.batcher, None
+    images = sample_images(tile)
+    bench_stages(results, images)
+    face_service.batcher = batcher
+    memory["after_stages_mb"] = rss_mb()[0]
+
+    bench_load(results, tile, images[f"group{FACE_COUNTS[-2]}"], CONCURRENCY[:2] if args.quick else CONCURRENCY)
+    memory["after_load_mb"] = rss_mb()[0]
+
+    bench_sync(results)
+    memory["after_sync_mb"], memory["peak_rss_mb"] = rss_mb()
+
+    current = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+            "settings": {
+                k: getattr(settings, k) for k in (
+                    "FACE_MODEL", "DETECT_MAX_SIZE", "ENHANCE_MODE", "INDEX_ENGINE", "INDEX_STORAGE",
+                    "INFERENCE_EXECUTOR", "INFERENCE_WORKERS", "FACE_MICROBATCH",
+                )
+            },
+        },
+        "results": results,
+        "memory": memory,
+    }
+    print(f"\n💾 Peak RSS {memory['peak_rss_mb']:.0f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.save or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"✅ Baseline written to {args.baseline}")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("quick") != args.quick:
+        print("⚠️ Baseline was recorded with a different --quick setting; only shared entries are compared.")
+    regressions = compare(current, baseline, args.tolerance, args.memory_tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n✅ No regressions.")
@@ -1,9 +1,142 @@
+import os
+from typing import List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Attendance System AI"
     SUPABASE_URL: str = ""
     SUPABASE_KEY: str = ""
+
+    # Add a Server-Timing header with per-stage durations to every response
+    SERVER_TIMING: bool = False
+
+    # InsightFace model pack; also stamped into index snapshots
+    FACE_MODEL: str = "buffalo_l"
+    # buffalo_l modules to load; attendance only needs SCRFD + ArcFace
+    FACE_MODULES: List[str] = ["detection", "recognition"]
+
+    # Large uploads are JPEG-decoded at 1/2, 1/4 or 1/8 scale while the long side stays >= this
+    DECODE_MIN_SIDE: int = 1600
+    # Upper bound for the adaptive SCRFD input size (long side, px)
+    DETECT_MAX_SIZE: int = 1280
+    # Faces smaller than this in the reduced image are re-cropped from a finer decode
+    RECOG_MIN_FACE_PX: int = 112
+    # Those re-crops decode at most this many megapixels, at a coarser DCT scale beyond it
+    RECOG_MAX_DECODE_MP: float = 12.0
+
+    # Low-light enhancement: gamma, clahe or retinex
+    ENHANCE_MODE: str = "gamma"
+    ENHANCE_GAMMA: float = 1.5
+    # Also enhance dark aligned face crops before ArcFace (Retinex on 112x112 ROIs)
+    ENHANCE_FACE_ROI: bool = False
+
+    # Cache of per-image extraction results, keyed by image hash + pipeline version (0 entries = off)
+    RESULT_CACHE_ENTRIES: int = 512
+    RESULT_CACHE_MB: int = 64
+    RESULT_CACHE_TTL: int = 600
+
+    # Inference worker pool ("thread" or "process")
+    INFERENCE_EXECUTOR: str = "thread"
+    INFERENCE_WORKERS: int = max(1, min(4, os.cpu_count() or 1))
+    # Requests allowed to wait for a free worker before we answer 503
+    INFERENCE_QUEUE_SIZE: int = 16
+    INFERENCE_RETRY_AFTER: int = 5
+
+    # Cross-request micro-batching of ArcFace crops
+    FACE_MICROBATCH: bool = True
+    FACE_BATCH_WINDOW_MS: float = 15.0
+    FACE_BATCH_MAX: int = 64
+
+    # L2 distance below which a face counts as a match (normalized ArcFace embeddings)
+    MATCH_THRESHOLD: float = 1.6
+
+    # Match each student to at most one face per photo, choosing among the top-k candidates.
+    # Opt-in (or per request with one_to_one=true): duplicate matches become unmatched faces.
+    RECOGNIZE_ONE_TO_ONE: bool = False
+    RECOGNIZE_TOP_K: int = 5
+
+    # Multi-image sessions: matches this close are final and are tracked instead of re-embedded
+    SESSION_CONFIDENT_DISTANCE: float = 1.0
+    SESSION_TRACK_IOU: float = 0.5
+    SESSION_MAX_FRAMES: int = 20
+    # Frames sampled per second of an uploaded video
+    SESSION_VIDEO_FPS: float = 2.0
+
+    # Section rosters used for absent rows are re-read after this many seconds
+    ATTENDANCE_ROSTER_TTL: int = 300
+
+    # Multi-template galleries: the index holds one centroid per student,
+    # the top GALLERY_SHORTLIST centroids are reranked on their own templates
+    GALLERY_MAX_TEMPLATES: int = 5
+    GALLERY_SHORTLIST: int = 10
+    # Learn templates from recognitions this close, and this far ahead of the runner-up.
+    # Off by default: it changes the stored gallery from ordinary recognize traffic.
+    GALLERY_LEARN: bool = False
+    GALLERY_LEARN_DISTANCE: float = 0.8
+    GALLERY_LEARN_MARGIN: float = 0.2
+    # Skip new templates nearly identical to a stored one (squared L2)
+    GALLERY_MIN_NOVELTY: float = 0.1
+    # Learned templates are buffered and applied to the index and snapshot at most this often (seconds)
+    GALLERY_SAVE_INTERVAL: int = 60
+
+    # Attendance analytics pages (see add_attendance_summary.sql), cached per process
+    ANALYTICS_CACHE_TTL: int = 60
+    ANALYTICS_CACHE_ENTRIES: int = 256
+    ANALYTICS_PAGE_SIZE: int = 50
+    ANALYTICS_MAX_PAGE_SIZE: int = 500
+
+    # Live streams (/ws/face/stream): detect on every Nth frame and track faces in between
+    STREAM_DETECT_EVERY: int = 3
+    STREAM_TRACK_IOU: float = 0.3
+    STREAM_MAX_MISSES: int = 3
+    # Agreeing matches needed to confirm a track that never matched confidently
+    STREAM_CONFIRM_HITS: int = 2
+    # Unknown faces are re-embedded at most this many times, then every STREAM_RETRY_FRAMES frames
+    STREAM_MAX_ATTEMPTS: int = 3
+    STREAM_RETRY_FRAMES: int = 30
+
+    # Bulk enrollment (/api/face/enroll/bulk): archive limits and per-photo quality checks
+    BULK_MAX_PHOTOS: int = 10000
+    BULK_MAX_PHOTO_MB: int = 10
+    # Uploads above this are refused (413); the archive is held in memory for the whole job
+    BULK_MAX_ARCHIVE_MB: int = 512
+    # Archives with more entries, or photos that would decompress to more, are refused
+    BULK_MAX_MEMBERS: int = 20000
+    BULK_MAX_UNCOMPRESSED_MB: int = 4096
+    BULK_MIN_DET_SCORE: float = 0.6
+    BULK_MIN_FACE_PX: int = 80
+    # Photos in flight at once; keep below the inference queue so live requests still get in
+    BULK_CONCURRENCY: int = 8
+    # Students written to Supabase per request
+    BULK_WRITE_BATCH: int = 500
+    # Finished jobs stay pollable this many seconds; at most BULK_MAX_JOBS are kept
+    BULK_JOB_TTL: int = 3600
+    BULK_MAX_JOBS: int = 100
+
+    # FAISS index engine: auto, flat, hnsw, ivf_flat or ivf_pq
+    INDEX_ENGINE: str = "auto"
+    INDEX_NPROBE: int = 16
+    INDEX_EF_SEARCH: int = 64
+    INDEX_HNSW_M: int = 32
+    INDEX_IVF_NLIST: int = 0  # 0 = pick from the number of vectors
+    INDEX_PQ_M: int = 64
+    # HNSW removals are tombstoned; the graph is rebuilt once this fraction of it is dead
+    INDEX_COMPACT_RATIO: float = 0.2
+
+    # Vector codes in the index: float32, fp16, int8 (scalar quantizer) or pq.
+    # Compressed modes keep exact float32 copies in the (mmapped) snapshot and
+    # rescore the top k * INDEX_RERANK candidates on them.
+    INDEX_STORAGE: str = "float32"
+    INDEX_RERANK: int = 4
+
+    # Versioned on-disk index snapshot, mmapped so workers share one copy
+    INDEX_SNAPSHOT_DIR: str = "faiss_snapshot"
+    INDEX_MMAP: bool = True
+
+    # Rows fetched per page when streaming embeddings from Supabase
+    SYNC_PAGE_SIZE: int = 1000
+    # Delta syncs re-read rows stamped this long before the watermark (late commits)
+    SYNC_OVERLAP_SECONDS: int = 60
     
     class Config:
         env_file = ".env"
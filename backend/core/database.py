@@ -1,8 +1,11 @@
+import threading
 from supabase import create_client, Client
 from core.config import settings
 
 class SupabaseDB:
+    # One client per process; its HTTP connection pool is reused by every request and background task
     client: Client = None
+    _lock = threading.Lock()
 
     @classmethod
     def get_client(cls) -> Client:
@@ -10,11 +13,13 @@ class SupabaseDB:
             if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
                 print("Warning: Supabase credentials not set. Database features will fail.")
                 return None
-            try:
-                cls.client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
-            except Exception as e:
-                print(f"Error connecting to Supabase: {e}")
-                return None
+            with cls._lock:
+                if cls.client is None:
+                    try:
+                        cls.client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+                    except Exception as e:
+                        print(f"Error connecting to Supabase: {e}")
+                        return None
         return cls.client
 
 supabase = SupabaseDB.get_client
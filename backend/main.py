@@ -1,17 +1,31 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from typing import List, Optional, Dict
-import json
+import asyncio
+import io
 import os
 import sys
+import time
+import zipfile
 import numpy as np
 from pydantic import BaseModel
 
 # Add current directory to sys.path
 sys.path.append(os.getcwd())
 
-from services.face_logic import face_service
+from services.face_logic import extract_embedding, extract_embeddings_batch, extract_face_boxes, load_models
 from services.vector_search import vector_search
+from services.inference_pool import inference_pool, InferenceQueueFull
+from services.index_sync import index_sync
+from services import metrics
+from services.result_cache import result_cache
+from services.attendance_writer import attendance_writer
+from services.assignment import assign_faces
+from services.attendance_session import AttendanceSession, StreamingSession, sample_video_frames
+from services.bulk_enrollment import bulk_enrollment
+from services.attendance_analytics import attendance_analytics
+from core.config import settings
 from core.database import supabase
 
 app = FastAPI(
@@ -28,6 +42,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """
+    Collect per-stage spans for the request, export them to /metrics and,
+    with SERVER_TIMING on, return them in a Server-Timing header.
+    """
+    start = time.perf_counter()
+    with metrics.collect_spans() as spans:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    metrics.observe_request(spans, route.path if route else "unmatched", response.status_code, elapsed)
+    if settings.SERVER_TIMING:
+        response.headers["Server-Timing"] = metrics.server_timing(spans, elapsed)
+    return response
+
 # --- Pydantic Models ---
 class MatchInfo(BaseModel):
     student_id: str
@@ -39,6 +70,30 @@ class RecognitionResponse(BaseModel):
     detected_faces: int
     matches: List[MatchInfo]
     message: str
+    attendance_queued: bool = False
+
+class SessionMatch(MatchInfo):
+    frames: List[int]
+
+class SessionResponse(BaseModel):
+    success: bool
+    frames_processed: int
+    frames_skipped: int
+    detected_faces: int
+    faces_embedded: int
+    faces_tracked: int
+    matches: List[SessionMatch]
+    message: str
+    attendance_queued: bool = False
+
+class FaceBox(BaseModel):
+    bbox: List[float]
+    score: float
+
+class DetectionResponse(BaseModel):
+    success: bool
+    detected_faces: int
+    faces: List[FaceBox]
 
 class RegisterResponse(BaseModel):
     success: bool
@@ -46,34 +101,120 @@ class RegisterResponse(BaseModel):
     message: str
 
 # --- Lifecycle ---
-@app.on_event("startup")
-async def startup_event():
-    print("🚀 Starting up... Syncing FAISS index with Database...")
+# Background warm-up progress, reported by /health/ready
+startup_state = {"started_at": None, "models": "pending", "index": "pending", "sync": "pending"}
+
+def _warm_up_models():
+    startup_state["models"] = "loading"
     try:
-        if supabase():
-            # Fetch all students with embeddings
-            # Note: This checks if 'face_embedding' is not null
-            response = supabase().table("students").select("id, face_embedding").not_.is_("face_embedding", "null").execute()
-            data = response.data
-            
-            if data:
-                embeddings_dict = {}
-                for record in data:
-                    s_id = str(record['id'])
-                    # Parse string vector if needed, supabase-py might return string or list
-                    emb = record['face_embedding']
-                    if isinstance(emb, str):
-                        emb = json.loads(emb)
-                    embeddings_dict[s_id] = emb
-                
-                vector_search.rebuild_index(embeddings_dict)
-                print(f"✅ Synced {len(embeddings_dict)} students from DB to FAISS.")
-            else:
-                print("⚠️ No students found in DB to sync.")
-        else:
-            print("⚠️ Supabase not configured, skipping sync.")
+        results = inference_pool.warm_up(load_models)
+        startup_state["models"] = "ready" if all(results) else "failed"
+    except Exception as e:
+        print(f"❌ Model warm-up failed: {e}")
+        startup_state["models"] = "failed"
+
+def _load_index_and_sync():
+    startup_state["index"] = "loading"
+    vector_search.ensure_loaded()
+    startup_state["index"] = "ready"
+
+    startup_state["sync"] = "running"
+    try:
+        # Reuses the on-disk index and only pulls changed students when possible
+        result = index_sync.sync()
+        startup_state["sync"] = "done" if result is not None else "skipped"
     except Exception as e:
         print(f"❌ Startup sync failed: {e}")
+        startup_state["sync"] = "failed"
+
+@app.on_event("startup")
+async def startup_event():
+    print("🚀 Starting up... Loading models and FAISS index in the background...")
+    startup_state["started_at"] = time.time()
+    loop = asyncio.get_running_loop()
+    # Not awaited: the server starts answering (e.g. /health) right away
+    loop.run_in_executor(None, _warm_up_models)
+    loop.run_in_executor(None, _load_index_and_sync)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    inference_pool.shutdown()
+    vector_search.flush()
+
+async def _infer(fn, *args):
+    """
+    Run an extraction on the inference pool and fold its stage spans into this request.
+    """
+    with metrics.span("inference"):
+        result, spans = await inference_pool.run(metrics.run_timed, fn, *args)
+    metrics.record_spans(spans)
+    return result
+
+async def _read_upload(upload: UploadFile) -> bytes:
+    with metrics.span("read"):
+        return await upload.read()
+
+def _queue_full_error(e):
+    print(f"⚠️ {e}")
+    return HTTPException(
+        status_code=503,
+        detail="Server busy processing other images. Please retry shortly.",
+        headers={"Retry-After": str(inference_pool.retry_after)}
+    )
+
+def _require_ready():
+    """
+    Refuse recognition until the models and the index are loaded; an empty
+    index would match nobody and, with record=true, mark the whole class absent.
+    """
+    state = _readiness()
+    if not state["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Warming up (models: {state['models']}, index: {state['index']}). Please retry shortly.",
+            headers={"Retry-After": str(inference_pool.retry_after)}
+        )
+
+def _resolve_section(section_id: Optional[str], routine_id: Optional[str]) -> Optional[str]:
+    """
+    Work out which section's roster to search. An explicit section_id wins;
+    otherwise the routine's section is looked up in the database (cached).
+    """
+    if section_id:
+        return section_id
+    if not routine_id:
+        return None
+    if not supabase():
+        raise HTTPException(status_code=503, detail="Database not configured; cannot resolve routine_id.")
+
+    routine = attendance_writer.get_routine(routine_id)
+    if not routine or not routine.get('section_id'):
+        raise HTTPException(status_code=404, detail=f"Routine {routine_id} not found or has no section.")
+    return str(routine['section_id'])
+
+def _queue_attendance(background_tasks: BackgroundTasks, record: bool, routine_id: Optional[str], matches, date: Optional[str]) -> bool:
+    """
+    Schedule the attendance_logs upsert to run after the response is sent.
+    """
+    if not record:
+        return False
+    background_tasks.add_task(attendance_writer.write, routine_id, matches, date)
+    return True
+
+def _learn_templates(student_ids, embeddings):
+    """
+    Add confidently recognized faces to their students' galleries (background task).
+    """
+    vector_search.learn_templates(student_ids, embeddings)
+    vector_search.flush(settings.GALLERY_SAVE_INTERVAL)
+
+def _upsert_face(student_id, embedding, section_id=None):
+    vector_search.ensure_loaded()
+    return vector_search.upsert_vector(student_id, embedding, section_id=section_id)
+
+def _remove_face(student_id):
+    vector_search.ensure_loaded()
+    return vector_search.remove_vector(student_id)
 
 # --- Endpoints ---
 
@@ -81,17 +222,65 @@ async def startup_event():
 async def root():
     return {
         "message": "AI Attendance Backend (InsightFace + FAISS)",
-        "vectors_loaded": vector_search.index.ntotal
+        "vectors_loaded": vector_search.size
+    }
+
+def _readiness():
+    started = startup_state["started_at"]
+    return {
+        # A failed sync still leaves a usable (cached) index, so it does not block readiness
+        "ready": startup_state["models"] == "ready" and startup_state["index"] == "ready",
+        "models": startup_state["models"],
+        "index": startup_state["index"],
+        "sync": startup_state["sync"],
+        "vectors": vector_search.size,
+        "uptime_s": round(time.time() - started, 1) if started else 0.0
     }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: stage latency histograms, faces per image,
+    index size, inference queue and sync duration.
+    """
+    stats = inference_pool.stats()
+    metrics.INDEX_VECTORS.set(vector_search.size)
+    metrics.INFERENCE_IN_FLIGHT.set(stats["in_flight"])
+    metrics.INFERENCE_QUEUE_DEPTH.set(stats["queue_depth"])
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/health/live")
+async def liveness_probe():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_probe():
+    state = _readiness()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content=state)
+    return state
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "engine": "insightface", "vectors": vector_search.index.ntotal}
+    return {
+        "status": "healthy",
+        "ready": _readiness()["ready"],
+        "engine": "insightface",
+        "vectors": vector_search.size,
+        "index_engine": vector_search.engine,
+        "templates": vector_search.template_count,
+        "inference": inference_pool.stats(),
+        "result_cache": result_cache.stats(),
+        "attendance": attendance_writer.last_write,
+        "analytics_cache": attendance_analytics.stats()
+    }
 
 @app.post("/api/face/register", response_model=RegisterResponse)
 async def register_face(
     image: UploadFile = File(...),
-    student_id: Optional[str] = Form(None)
+    student_id: Optional[str] = Form(None),
+    section_id: Optional[str] = Form(None)
 ):
     """
     Detect face and return 512-D embedding.
@@ -99,81 +288,350 @@ async def register_face(
     (assuming the caller will save to DB).
     """
     try:
-        image_bytes = await image.read()
-        embedding = face_service.get_embedding(image_bytes)
+        image_bytes = await _read_upload(image)
+        embedding = await result_cache.get_or_compute(
+            "embedding", image_bytes, lambda: _infer(extract_embedding, image_bytes)
+        )
         
         if embedding is None:
             raise HTTPException(status_code=400, detail="No face detected. Ensure good lighting and clear face.")
             
         embedding_list = embedding.tolist()
         
-        # If ID provided, update cache immediately
+        # If ID provided, update cache immediately (the snapshot write is off the event loop)
         if student_id:
-            vector_search.add_vector(student_id, embedding)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, _upsert_face, student_id, embedding, section_id)
         
         return {
             "success": True,
             "embedding": embedding_list,
             "message": "Face processed successfully"
         }
+    except InferenceQueueFull as e:
+        raise _queue_full_error(e)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/face/enroll/bulk", status_code=202)
+async def enroll_bulk(
+    archive: UploadFile = File(...),
+    key_by: str = Form("auto"),
+    section_id: Optional[str] = Form(None),
+    dry_run: bool = Form(False)
+):
+    """
+    Enroll many students from a zip of photos named (or foldered) by student id
+    or roll number. Runs in the background; poll /api/face/enroll/bulk/{job_id}.
+    Embeddings are written to students.face_embedding and the index directly,
+    so no /api/face/sync is needed. dry_run=true only runs the quality checks.
+    """
+    if key_by not in ("auto", "id", "roll"):
+        raise HTTPException(status_code=400, detail="key_by must be auto, id or roll.")
+    limit = settings.BULK_MAX_ARCHIVE_MB * 2**20
+    with metrics.span("read"):
+        archive_bytes = await archive.read(limit + 1)
+    if len(archive_bytes) > limit:
+        raise HTTPException(status_code=413, detail=f"Archive larger than {settings.BULK_MAX_ARCHIVE_MB} MB.")
+    if not zipfile.is_zipfile(io.BytesIO(archive_bytes)):
+        raise HTTPException(status_code=400, detail="Upload a .zip archive of photos.")
+
+    job_id = bulk_enrollment.start(archive_bytes, key_by=key_by, section_id=section_id, dry_run=dry_run)
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/api/face/enroll/bulk/{job_id}")
+async def enroll_bulk_status(job_id: str):
+    """
+    Progress and per-photo failures of a bulk enrollment.
+    """
+    job = bulk_enrollment.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Enrollment job {job_id} not found")
+    return job
+
+@app.post("/api/face/detect", response_model=DetectionResponse)
+async def detect_faces(image: UploadFile = File(...)):
+    """
+    Detection only (no embeddings): face boxes for framing checks and head counts.
+    """
+    try:
+        image_bytes = await _read_upload(image)
+        faces = await result_cache.get_or_compute(
+            "boxes", image_bytes, lambda: _infer(extract_face_boxes, image_bytes)
+        )
+        metrics.FACES_PER_IMAGE.observe(len(faces))
+        return {
+            "success": len(faces) > 0,
+            "detected_faces": len(faces),
+            "faces": faces
+        }
+    except InferenceQueueFull as e:
+        raise _queue_full_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/face/recognize", response_model=RecognitionResponse)
-async def recognize_face(image: UploadFile = File(...)):
+async def recognize_face(
+    background_tasks: BackgroundTasks,
+    image: UploadFile = File(...),
+    section_id: Optional[str] = Form(None),
+    routine_id: Optional[str] = Form(None),
+    record: bool = Form(False),
+    date: Optional[str] = Form(None),
+    one_to_one: Optional[bool] = Form(None)
+):
     """
     Recognize ALL faces in the image against the server-side FAISS index.
     Optimized for group photos.
+    Pass section_id or routine_id to search only that class's roster.
+    With one_to_one (default: settings.RECOGNIZE_ONE_TO_ONE), each student is
+    matched to at most one face.
+    With record=true (and routine_id), present/absent rows are written to
+    attendance_logs in the background after the response.
     """
     try:
-        image_bytes = await image.read()
+        if record and not routine_id:
+            raise HTTPException(status_code=400, detail="routine_id is required to record attendance.")
+        _require_ready()
+        scope = _resolve_section(section_id, routine_id)
+        image_bytes = await _read_upload(image)
         
-        # 1. Get ALL embeddings from image
-        embeddings = face_service.get_embeddings_batch(image_bytes)
+        # 1. Get ALL embeddings from image (cached for retries of the same photo)
+        embeddings = await result_cache.get_or_compute(
+            "embeddings", image_bytes, lambda: _infer(extract_embeddings_batch, image_bytes)
+        )
         detected_count = len(embeddings)
+        metrics.FACES_PER_IMAGE.observe(detected_count)
         
         if detected_count == 0:
              return {
                 "success": False,
                 "detected_faces": 0,
                 "matches": [],
-                "message": "No faces detected"
+                "message": "No faces detected",
+                "attendance_queued": _queue_attendance(background_tasks, record, routine_id, [], date)
             }
 
-        THRESHOLD = 1.6 
+        THRESHOLD = settings.MATCH_THRESHOLD
         matches = []
         
-        # 2. Search each face in FAISS
-        for emb in embeddings:
-            student_id, distance = face_service.recognize_face(emb)
-            
-            if student_id and distance < THRESHOLD:
-                confidence = max(0, (THRESHOLD - distance) / THRESHOLD)
-                matches.append({
-                    "student_id": student_id,
-                    "distance": float(distance),
-                    "confidence": float(confidence)
-                })
+        # 2. Search all faces in FAISS with a single batched query.
+        # Top-k candidates feed the one-to-one assignment; the runner-up also
+        # tells whether a face is safe to learn from.
+        one_to_one = settings.RECOGNIZE_ONE_TO_ONE if one_to_one is None else one_to_one
+        k = settings.RECOGNIZE_TOP_K if one_to_one else 1
+        if settings.GALLERY_LEARN:
+            k = max(k, 2)
+        queries = np.stack(embeddings)
+        # Off the event loop: a search may wait for a sync or save to release the index
+        distances, student_ids = await asyncio.get_running_loop().run_in_executor(
+            None, vector_search.search_batch, queries, k, scope
+        )
+        top_ids = [row[0] for row in student_ids]
+
+        if one_to_one:
+            # No student is given to two faces in the same photo
+            assigned, best = assign_faces(distances, student_ids, THRESHOLD)
+        else:
+            assigned, best = top_ids, distances[:, 0]
+        accepted = np.flatnonzero(best < THRESHOLD)
+        confidences = np.maximum(0, (THRESHOLD - best) / THRESHOLD)
+
+        if settings.GALLERY_LEARN:
+            learn = (distances[:, 0] < settings.GALLERY_LEARN_DISTANCE) & \
+                    (distances[:, 1] - distances[:, 0] >= settings.GALLERY_LEARN_MARGIN)
+            # A student who is the nearest match of two faces in one photo is ambiguous; learn neither
+            learn &= np.array([assigned[i] == sid and top_ids.count(sid) == 1 for i, sid in enumerate(top_ids)])
+            if learn.any():
+                rows = np.flatnonzero(learn)
+                background_tasks.add_task(_learn_templates, [top_ids[i] for i in rows], queries[rows])
+        
+        for i in accepted:
+            matches.append({
+                "student_id": assigned[i],
+                "distance": float(best[i]),
+                "confidence": float(confidences[i])
+            })
         
         return {
             "success": len(matches) > 0,
             "detected_faces": detected_count,
             "matches": matches,
-            "message": f"Found {len(matches)} matches from {detected_count} faces" if matches else "No matches found"
+            "message": f"Found {len(matches)} matches from {detected_count} faces" if matches else "No matches found",
+            "attendance_queued": _queue_attendance(background_tasks, record, routine_id, matches, date)
         }
             
+    except InferenceQueueFull as e:
+        raise _queue_full_error(e)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Recognition Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/face/session", response_model=SessionResponse)
+async def recognize_session(
+    background_tasks: BackgroundTasks,
+    images: List[UploadFile] = File(None),
+    video: Optional[UploadFile] = File(None),
+    section_id: Optional[str] = Form(None),
+    routine_id: Optional[str] = Form(None),
+    record: bool = Form(False),
+    date: Optional[str] = Form(None)
+):
+    """
+    Recognize a whole class from several photos (or one short video) in one call.
+    Frames run in parallel; each student is reported once with their best match.
+    With a section, processing stops as soon as the full roster has been found.
+    record=true writes the roster to attendance_logs like /api/face/recognize.
+    """
+    try:
+        if record and not routine_id:
+            raise HTTPException(status_code=400, detail="routine_id is required to record attendance.")
+        _require_ready()
+        scope = _resolve_section(section_id, routine_id)
+
+        if video is not None:
+            video_bytes = await _read_upload(video)
+            loop = asyncio.get_running_loop()
+            with metrics.span("video_decode"):
+                frames = await loop.run_in_executor(None, sample_video_frames, video_bytes)
+        else:
+            frames = [await _read_upload(image) for image in (images or [])[:settings.SESSION_MAX_FRAMES]]
+
+        if not frames:
+            raise HTTPException(status_code=400, detail="Upload at least one image or a readable video.")
+
+        session = AttendanceSession(section_id=scope)
+        # Consecutive video frames show the same faces in the same place, so track them
+        await session.process(frames, track=video is not None)
+        matches = session.roster()
+
+        return {
+            "success": len(matches) > 0,
+            "frames_processed": session.frames_processed,
+            "frames_skipped": session.frames_skipped,
+            "detected_faces": session.detected_faces,
+            "faces_embedded": session.faces_embedded,
+            "faces_tracked": session.faces_tracked,
+            "matches": matches,
+            "message": f"Found {len(matches)} students across {session.frames_processed} frames" if matches else "No matches found",
+            "attendance_queued": _queue_attendance(background_tasks, record, routine_id, matches, date)
+        }
+
+    except InferenceQueueFull as e:
+        raise _queue_full_error(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Session Recognition Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.websocket("/ws/face/stream")
+async def recognize_stream(
+    websocket: WebSocket,
+    section_id: Optional[str] = None,
+    routine_id: Optional[str] = None,
+    record: bool = False,
+    date: Optional[str] = None
+):
+    """
+    Live recognition from a camera. Send encoded frames (JPEG/PNG) as binary
+    messages and "end" as text to finish. Every frame gets a "frame" message:
+    detection frames with tracks and new "present" events, the frames between
+    them ("detected": false) with the tracks' predicted boxes. "end" returns
+    the summary, and with record=true the roster is written to attendance_logs.
+    Each student is embedded only until they are recognized.
+    """
+    await websocket.accept()
+    if record and not routine_id:
+        await websocket.close(code=1008, reason="routine_id is required to record attendance.")
+        return
+    try:
+        scope = _resolve_section(section_id, routine_id)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+
+    session = StreamingSession(section_id=scope, send=websocket.send_json)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                await session.submit(message["bytes"])
+            elif message.get("text") == "end":
+                summary = await session.finish()
+                if record:
+                    loop = asyncio.get_running_loop()
+                    summary["attendance"] = await loop.run_in_executor(
+                        None, attendance_writer.write, routine_id, summary["matches"], date
+                    )
+                await websocket.send_json(summary)
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session.close()
+        print(f"📹 Stream closed: {session.frames_received} frames, {len(session.present)} students")
+
+@app.get("/api/analytics/attendance")
+async def attendance_analytics_page(
+    group_by: str = "student",
+    section_id: Optional[str] = None,
+    student_id: Optional[str] = None,
+    course_catalog_id: Optional[str] = None,
+    routine_id: Optional[str] = None,
+    order: str = "-percentage",
+    page: int = 1,
+    page_size: Optional[int] = None
+):
+    """
+    Attendance percentages per student, per student and subject, or per routine,
+    from the incrementally maintained summary (add_attendance_summary.sql).
+    Paginated and cached; cost does not grow with the attendance history.
+    """
+    if not supabase():
+        raise HTTPException(status_code=503, detail="Database not configured.")
+    filters = {
+        "section_id": section_id,
+        "student_id": student_id,
+        "course_catalog_id": course_catalog_id,
+        "routine_id": routine_id,
+    }
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, attendance_analytics.query, group_by, filters, order, page, page_size
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"❌ Analytics Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/face/{student_id}")
+async def remove_face(student_id: str):
+    """
+    Drop a student's embedding from the FAISS index.
+    """
+    loop = asyncio.get_running_loop()
+    removed = await loop.run_in_executor(None, _remove_face, student_id)
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Student {student_id} not in index")
+    return {"success": True, "vectors": vector_search.size}
+
 @app.post("/api/face/sync")
-async def sync_index(background_tasks: BackgroundTasks):
+async def sync_index(background_tasks: BackgroundTasks, full: bool = False):
     """
-    Force re-sync of FAISS index from Supabase.
+    Re-sync FAISS index from Supabase.
+    Only changed students are fetched unless full=true.
     Call this after bulk importing students.
     """
-    background_tasks.add_task(startup_event)
-    return {"status": "Sync started in background"}
+    background_tasks.add_task(index_sync.sync, full)
+    return {"status": "Sync started in background", "mode": "full" if full else "delta"}
 
@@ -0,0 +1,50 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from .metrics import span
+
+def assign_faces(distances, student_ids, threshold):
+    """
+    One-to-one matching of the faces in one photo.
+    `distances` (n, k) and `student_ids` (n lists of k) are the top-k results of a
+    batched search. Solves a minimum-cost assignment (Hungarian / Jonker-Volgenant)
+    over the candidates, where leaving a face unmatched costs `threshold`, so no
+    student is given to two faces and weak pairs are never forced.
+    Returns (assigned, assigned_distances): per face a student_id or None, and
+    its distance (inf when unmatched).
+    """
+    with span("assign"):
+        return _assign_faces(distances, student_ids, threshold)
+
+def _assign_faces(distances, student_ids, threshold):
+    distances = np.asarray(distances, dtype=np.float64)
+    n, k = distances.shape
+    assigned = [None] * n
+    assigned_distances = np.full(n, np.inf, dtype=np.float32)
+    if n == 0:
+        return assigned, assigned_distances
+
+    # Column per distinct candidate student
+    columns = {}
+    candidates = np.array(
+        [[columns.setdefault(sid, len(columns)) if sid is not None else -1 for sid in row] for row in student_ids],
+        dtype=np.int64
+    ).reshape(n, k)
+    m = len(columns)
+
+    # Forbidden pairs cost more than going unmatched; n "unmatched" columns keep it feasible
+    cost = np.full((n, m + n), threshold, dtype=np.float64)
+    cost[:, :m] = 4.0 * threshold + 1.0
+    rows, slots = np.nonzero((candidates >= 0) & (distances < threshold))
+    cost[rows, candidates[rows, slots]] = distances[rows, slots]
+
+    face_rows, cols = linear_sum_assignment(cost)
+    matched = cols < m
+    face_rows, cols = face_rows[matched], cols[matched]
+    matched = cost[face_rows, cols] < threshold
+    face_rows, cols = face_rows[matched], cols[matched]
+
+    owners = list(columns)
+    for row, col in zip(face_rows.tolist(), cols.tolist()):
+        assigned[row] = owners[col]
+    assigned_distances[face_rows] = cost[face_rows, cols]
+    return assigned, assigned_distances
@@ -0,0 +1,95 @@
+import time
+import threading
+from collections import OrderedDict
+from core.config import settings
+from core.database import supabase
+
+# group_by -> (view, columns that can be filtered on)
+VIEWS = {
+    "student": ("attendance_by_student", ("section_id", "student_id")),
+    "subject": ("attendance_by_subject", ("section_id", "student_id", "course_catalog_id")),
+    "routine": ("attendance_by_routine", ("section_id", "course_catalog_id", "routine_id")),
+}
+ORDERS = ("percentage", "present", "total", "last_date")
+# Columns identifying one row of each view
+KEYS = {
+    "student": ("student_id", "section_id"),
+    "subject": ("student_id", "section_id", "course_catalog_id"),
+    "routine": ("routine_id", "section_id", "course_catalog_id"),
+}
+
+class AttendanceAnalytics:
+    def __init__(self, ttl=60, max_entries=256):
+        """
+        Attendance percentages and standings read from the counters kept by
+        add_attendance_summary.sql, one page at a time. Pages are cached for `ttl`
+        seconds and dropped as soon as this process records new attendance.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._pages = OrderedDict()  # key -> (expires_at, page)
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def query(self, group_by="student", filters=None, order="-percentage", page=1, page_size=None):
+        """
+        One page of aggregates: {"items", "total", "page", "page_size", "cached"}.
+        `order` is a column of ORDERS, prefixed with "-" for descending.
+        """
+        if group_by not in VIEWS:
+            raise ValueError(f"group_by must be one of {', '.join(VIEWS)}")
+        if order.lstrip("-") not in ORDERS:
+            raise ValueError(f"order must be one of {', '.join(ORDERS)} (prefix - for descending)")
+        view, columns = VIEWS[group_by]
+        filters = {k: str(v) for k, v in (filters or {}).items() if v is not None and k in columns}
+        page = max(1, page)
+        page_size = min(max(1, page_size or settings.ANALYTICS_PAGE_SIZE), settings.ANALYTICS_MAX_PAGE_SIZE)
+
+        key = (group_by, tuple(sorted(filters.items())), order, page, page_size)
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return {**entry[1], "cached": True}
+            self.misses += 1
+
+        query = supabase().table(view).select("*", count="exact")
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        # Ties broken by the full row key so pages neither overlap nor skip rows
+        query = query.order(order.lstrip("-"), desc=order.startswith("-"), nullsfirst=False)
+        for column in KEYS[group_by]:
+            query = query.order(column)
+        offset = (page - 1) * page_size
+        response = query.range(offset, offset + page_size - 1).execute()
+
+        result = {
+            "group_by": group_by,
+            "items": response.data or [],
+            "total": response.count or 0,
+            "page": page,
+            "page_size": page_size,
+        }
+        with self._lock:
+            self._pages[key] = (time.monotonic() + self.ttl, result)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return {**result, "cached": False}
+
+    def invalidate(self):
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._pages), "hits": self.hits, "misses": self.misses}
+
+# Global instance
+attendance_analytics = AttendanceAnalytics(
+    ttl=settings.ANALYTICS_CACHE_TTL,
+    max_entries=settings.ANALYTICS_CACHE_ENTRIES,
+)
@@ -0,0 +1,357 @@
+import asyncio
+import os
+import tempfile
+import cv2
+import numpy as np
+from core.config import settings
+from .assignment import assign_faces
+from .face_logic import extract_faces
+from .face_tracker import FaceTracker
+from .inference_pool import inference_pool, InferenceQueueFull
+from .metrics import run_timed, record_spans, FACES_PER_IMAGE
+from .vector_search import vector_search
+
+def sample_video_frames(video_bytes, fps=None, max_frames=None):
+    """
+    Decode an uploaded clip into BGR frames, keeping about `fps` frames per second
+    (at most `max_frames`). Frames in between are grabbed but never converted.
+    """
+    fps = fps or settings.SESSION_VIDEO_FPS
+    max_frames = max_frames or settings.SESSION_MAX_FRAMES
+
+    # OpenCV only reads videos from a path
+    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+        f.write(video_bytes)
+        path = f.name
+
+    frames = []
+    try:
+        capture = cv2.VideoCapture(path)
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        step = max(1, int(round(source_fps / fps)))
+        position = 0
+        while len(frames) < max_frames and capture.grab():
+            if position % step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    frames.append(frame)
+            position += 1
+        capture.release()
+    finally:
+        os.remove(path)
+    return frames
+
+class AttendanceSession:
+    def __init__(self, section_id=None, threshold=None, confident_distance=None):
+        """
+        Merge recognitions from several photos (or video frames) of one class into a
+        single roster: every student appears once, with their best match.
+        """
+        self.section_id = section_id
+        self.threshold = threshold or settings.MATCH_THRESHOLD
+        self.confident_distance = confident_distance or settings.SESSION_CONFIDENT_DISTANCE
+        # Known roster size lets the session stop once everyone has been found
+        self.roster_size = vector_search.section_size(section_id) if section_id else 0
+
+        self.matches = {}
+        self.confident = set()
+
+        # Metrics
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.detected_faces = 0
+        self.faces_embedded = 0
+        self.faces_tracked = 0
+
+    @property
+    def complete(self):
+        return self.roster_size > 0 and len(self.confident) >= self.roster_size
+
+    def add_frame(self, frame_index, faces, tracked_ids=()):
+        """
+        Score one frame's faces and merge them into the roster.
+        `tracked_ids[j]` is the student behind the j-th skip box the frame was
+        extracted with. Returns the confident (boxes, student_ids) of this frame,
+        to be skipped in the next one.
+        """
+        self.frames_processed += 1
+        self.detected_faces += len(faces)
+
+        boxes, student_ids = [], []
+        for face in faces:
+            if face["track"] is not None:
+                student_id = tracked_ids[face["track"]]
+                self.faces_tracked += 1
+                self.matches[student_id]["frames"].add(frame_index)
+                boxes.append(face["bbox"])
+                student_ids.append(student_id)
+
+        embedded = [face for face in faces if face["embedding"] is not None]
+        self.faces_embedded += len(embedded)
+        if not embedded:
+            return boxes, student_ids
+
+        queries = np.stack([face["embedding"] for face in embedded])
+        if settings.RECOGNIZE_ONE_TO_ONE:
+            # Within one frame, a student can only be one of the faces
+            distances, found = vector_search.search_batch(queries, k=settings.RECOGNIZE_TOP_K, section_id=self.section_id)
+            assigned, best = assign_faces(distances, found, self.threshold)
+        else:
+            distances, found = vector_search.search_batch(queries, k=1, section_id=self.section_id)
+            assigned, best = [row[0] for row in found], distances[:, 0]
+
+        for i in np.flatnonzero(best < self.threshold):
+            student_id = assigned[i]
+            self._merge(student_id, float(best[i]), frame_index)
+            if best[i] < self.confident_distance:
+                self.confident.add(student_id)
+                boxes.append(embedded[i]["bbox"])
+                student_ids.append(student_id)
+        return boxes, student_ids
+
+    def _merge(self, student_id, distance, frame_index):
+        match = self.matches.get(student_id)
+        if match is None:
+            match = self.matches[student_id] = {"student_id": student_id, "distance": distance, "frames": set()}
+        match["distance"] = min(match["distance"], distance)
+        match["frames"].add(frame_index)
+
+    async def process(self, frames, track=False):
+        """
+        Run every frame through the inference pool, `workers` frames at a time.
+        Frames are split into contiguous segments processed in parallel; with
+        `track` on (video), each segment carries confident faces forward so they
+        are matched by box overlap instead of being embedded again.
+        """
+        segments = [s for s in np.array_split(np.arange(len(frames)), max(1, inference_pool.workers)) if len(s)]
+
+        async def run_segment(indices):
+            skip_boxes, skip_ids = [], []
+            for frame_index in indices:
+                if self.complete:
+                    self.frames_skipped += 1
+                    continue
+                faces, spans = await inference_pool.run(run_timed, extract_faces, frames[frame_index], skip_boxes or None)
+                record_spans(spans)
+                FACES_PER_IMAGE.observe(len(faces))
+                boxes, student_ids = self.add_frame(int(frame_index), faces, skip_ids)
+                if track:
+                    skip_boxes, skip_ids = boxes, student_ids
+
+        await asyncio.gather(*(run_segment(indices) for indices in segments))
+
+    def roster(self):
+        """
+        One entry per student, best confidence first.
+        """
+        entries = []
+        for match in self.matches.values():
+            entries.append({
+                "student_id": match["student_id"],
+                "distance": match["distance"],
+                "confidence": max(0.0, (self.threshold - match["distance"]) / self.threshold),
+                "frames": sorted(match["frames"]),
+            })
+        return sorted(entries, key=lambda m: m["distance"])
+
+class StreamingSession:
+    def __init__(self, section_id=None, send=None, detect_every=None):
+        """
+        Live recognition over a stream of camera frames (see /ws/face/stream).
+        Detection runs on every `detect_every`-th frame and ArcFace only for new or
+        unconfirmed tracks. Frames in between are not decoded: their result is the
+        tracks moved forward by their velocity. `send` is an async callable
+        receiving the per-frame results and attendance events.
+        """
+        self.section_id = section_id
+        self.send = send
+        self.detect_every = max(1, detect_every or settings.STREAM_DETECT_EVERY)
+        self.threshold = settings.MATCH_THRESHOLD
+        self.confident_distance = settings.SESSION_CONFIDENT_DISTANCE
+        self.tracker = FaceTracker(
+            iou_threshold=settings.STREAM_TRACK_IOU,
+            max_misses=settings.STREAM_MAX_MISSES,
+            max_attempts=settings.STREAM_MAX_ATTEMPTS,
+            retry_frames=settings.STREAM_RETRY_FRAMES,
+        )
+
+        self.present = {}
+        self._last_detect = None
+        self._task = None
+
+        # Metrics
+        self.frames_received = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.frames_predicted = 0
+        self.faces_embedded = 0
+        self.faces_tracked = 0
+
+    async def submit(self, frame_bytes):
+        """
+        Accept one encoded frame. Detection frames start processing in the
+        background. Frames between detections, and detection frames arriving
+        while the previous one is still being processed, get predicted tracks.
+        """
+        frame_index = self.frames_received
+        self.frames_received += 1
+        if frame_index % self.detect_every == 0:
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._run(frame_index, frame_bytes))
+                return
+            self.frames_dropped += 1
+        await self._send_predicted(frame_index)
+
+    async def _send_predicted(self, frame_index):
+        self.frames_predicted += 1
+        if self.send is None:
+            return
+        steps = frame_index - self._last_detect if self._last_detect is not None else 0
+        tracks = self._track_boxes(steps)
+        await self.send({
+            "type": "frame",
+            "frame": frame_index,
+            "detected": False,
+            "faces": len(tracks),
+            "embedded": 0,
+            "tracked": len(tracks),
+            "tracks": tracks,
+            "events": [],
+        })
+
+    def _track_boxes(self, steps=0):
+        # Extrapolated without touching the tracks; the next detection corrects them
+        return [
+            {
+                "track_id": track.id,
+                "bbox": [float(v) for v in track.bbox + track.velocity * steps],
+                "student_id": track.student_id,
+            }
+            for track in self.tracker.tracks
+        ]
+
+    async def _run(self, frame_index, frame_bytes):
+        try:
+            message = await self._process(frame_index, frame_bytes)
+        except InferenceQueueFull:
+            self.frames_dropped += 1
+            message = {"type": "busy", "frame": frame_index, "retry_after": inference_pool.retry_after}
+        except Exception as e:
+            print(f"❌ Stream frame {frame_index} failed: {e}")
+            message = {"type": "error", "frame": frame_index, "detail": str(e)}
+        if self.send is not None:
+            await self.send(message)
+
+    async def _process(self, frame_index, frame_bytes):
+        steps = frame_index - self._last_detect if self._last_detect is not None else 1
+        self._last_detect = frame_index
+        self.tracker.predict(steps)
+
+        # Confirmed faces are located by box overlap only
+        skip = self.tracker.skip_tracks(frame_index)
+        faces, spans = await inference_pool.run(
+            run_timed, extract_faces, frame_bytes, [track.bbox.tolist() for track in skip] or None
+        )
+        record_spans(spans)
+        FACES_PER_IMAGE.observe(len(faces))
+        self.frames_processed += 1
+
+        matched = {i: skip[face["track"]] for i, face in enumerate(faces) if face["track"] is not None}
+        tracks = self.tracker.update([face["bbox"] for face in faces], matched, frame_index, steps)
+        embedded = [i for i, face in enumerate(faces) if face["embedding"] is not None]
+        self.faces_tracked += len(matched)
+        self.faces_embedded += len(embedded)
+
+        events = self._identify(frame_index, [faces[i] for i in embedded], [tracks[i] for i in embedded])
+        return {
+            "type": "frame",
+            "frame": frame_index,
+            "detected": True,
+            "faces": len(faces),
+            "embedded": len(embedded),
+            "tracked": len(matched),
+            "tracks": [
+                {"track_id": track.id, "bbox": [float(v) for v in track.bbox], "student_id": track.student_id}
+                for track in tracks
+            ],
+            "events": events,
+        }
+
+    def _identify(self, frame_index, faces, tracks):
+        """
+        Match freshly embedded faces and confirm their tracks: at once when the
+        match is confident, otherwise after STREAM_CONFIRM_HITS agreeing frames.
+        Returns a "present" event for every student seen for the first time.
+        """
+        if not faces:
+            return []
+
+        queries = np.stack([face["embedding"] for face in faces])
+        distances, found = vector_search.search_batch(queries, k=settings.RECOGNIZE_TOP_K, section_id=self.section_id)
+        assigned, best = assign_faces(distances, found, self.threshold)
+
+        # A student already followed by another confirmed track is not handed out twice
+        owners = {t.student_id: t for t in self.tracker.tracks if t.confirmed}
+        events = []
+        for track, student_id, distance in zip(tracks, assigned, best.tolist()):
+            track.attempts += 1
+            track.last_embedded = frame_index
+            if student_id is None or owners.get(student_id, track) is not track:
+                continue
+
+            track.votes[student_id] = track.votes.get(student_id, 0) + 1
+            if distance >= self.confident_distance and track.votes[student_id] < settings.STREAM_CONFIRM_HITS:
+                continue
+
+            track.confirmed = True
+            track.student_id = student_id
+            track.distance = min(track.distance, distance)
+            owners[student_id] = track
+
+            match = self.present.get(student_id)
+            if match is None:
+                self.present[student_id] = {"student_id": student_id, "distance": distance, "frame": frame_index}
+                events.append({
+                    "type": "present",
+                    "student_id": student_id,
+                    "confidence": max(0.0, (self.threshold - distance) / self.threshold),
+                    "track_id": track.id,
+                })
+            else:
+                match["distance"] = min(match["distance"], distance)
+        return events
+
+    def roster(self):
+        return sorted(
+            (
+                {
+                    "student_id": m["student_id"],
+                    "distance": m["distance"],
+                    "confidence": max(0.0, (self.threshold - m["distance"]) / self.threshold),
+                    "first_frame": m["frame"],
+                }
+                for m in self.present.values()
+            ),
+            key=lambda m: m["distance"]
+        )
+
+    async def finish(self):
+        """
+        Wait for the frame in flight and summarize the stream.
+        """
+        if self._task is not None:
+            await self._task
+        return {
+            "type": "summary",
+            "frames_received": self.frames_received,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self.frames_dropped,
+            "frames_predicted": self.frames_predicted,
+            "faces_embedded": self.faces_embedded,
+            "faces_tracked": self.faces_tracked,
+            "matches": self.roster(),
+        }
+
+    def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
@@ -0,0 +1,131 @@
+import time
+import threading
+from datetime import date as date_type
+from core.config import settings
+from core.database import supabase
+from .attendance_analytics import attendance_analytics
+
+class AttendanceWriter:
+    def __init__(self):
+        """
+        Writes a class's recognition result to attendance_logs server-side:
+        every student in the routine's section gets one present/absent row
+        (see add_attendance_logs_unique.sql).
+        """
+        # Routines and section rosters rarely change; cache them per process
+        self._routines = {}
+        self._rosters = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.last_write = None
+        self.written = 0
+        self.failed = 0
+
+    def get_routine(self, routine_id):
+        """
+        Routine row (section, teacher, course) or None if it does not exist.
+        """
+        routine_id = str(routine_id)
+        if routine_id in self._routines:
+            return self._routines[routine_id]
+
+        response = supabase().table("routines") \
+            .select("id, section_id, teacher_id, course_catalog_id") \
+            .eq("id", routine_id).limit(1).execute()
+        routine = response.data[0] if response.data else None
+        if routine is not None:
+            with self._lock:
+                self._routines[routine_id] = routine
+        return routine
+
+    def section_roster(self, section_id):
+        """
+        Ids of every student enrolled in a section, cached for ATTENDANCE_ROSTER_TTL seconds.
+        """
+        section_id = str(section_id)
+        cached = self._rosters.get(section_id)
+        if cached is not None and time.monotonic() - cached[0] < settings.ATTENDANCE_ROSTER_TTL:
+            return cached[1]
+
+        response = supabase().table("students").select("id").eq("section_id", section_id).execute()
+        roster = [str(row["id"]) for row in response.data or []]
+        with self._lock:
+            self._rosters[section_id] = (time.monotonic(), roster)
+        return roster
+
+    def build_rows(self, routine, matches, date):
+        """
+        One row per rostered student: present with the best match confidence,
+        absent otherwise. Matches outside the section are ignored.
+        """
+        present = {}
+        for match in matches:
+            student_id = str(match["student_id"])
+            present[student_id] = max(present.get(student_id, 0.0), float(match["confidence"]))
+
+        roster = self.section_roster(routine["section_id"]) if routine.get("section_id") else list(present)
+        return [
+            {
+                "student_id": student_id,
+                "routine_id": routine["id"],
+                "section_id": routine.get("section_id"),
+                "teacher_id": routine.get("teacher_id"),
+                "course_catalog_id": routine.get("course_catalog_id"),
+                "date": date,
+                "status": "present" if student_id in present else "absent",
+                "confidence": present.get(student_id, 0.0),
+            }
+            for student_id in roster
+        ]
+
+    def write(self, routine_id, matches, date=None):
+        """
+        Record the attendance of one class session: present rows are upserted,
+        absent rows only inserted where the student has no row yet. Several photos
+        of the same class (same routine and date) therefore add up, and a later
+        photo never turns a student who was already present into absent.
+        Meant to run as a background task after the response has been sent.
+        """
+        if not supabase():
+            print("⚠️ Supabase not configured, attendance not recorded.")
+            return None
+
+        start = time.perf_counter()
+        try:
+            routine = self.get_routine(routine_id)
+            if routine is None:
+                print(f"⚠️ Routine {routine_id} not found, attendance not recorded.")
+                return None
+
+            rows = self.build_rows(routine, matches, date or date_type.today().isoformat())
+            present_rows = [row for row in rows if row["status"] == "present"]
+            absent_rows = [row for row in rows if row["status"] != "present"]
+            if present_rows:
+                supabase().table("attendance_logs") \
+                    .upsert(present_rows, on_conflict="student_id,routine_id,date") \
+                    .execute()
+            if absent_rows:
+                supabase().table("attendance_logs") \
+                    .upsert(absent_rows, on_conflict="student_id,routine_id,date", ignore_duplicates=True) \
+                    .execute()
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ Attendance write failed for routine {routine_id}: {e}")
+            return None
+
+        # The summary counters changed with these rows
+        attendance_analytics.invalidate()
+        present = len(present_rows)
+        self.written += len(rows)
+        self.last_write = {
+            "routine_id": str(routine_id),
+            "rows": len(rows),
+            "present": present,
+            "duration_ms": (time.perf_counter() - start) * 1000
+        }
+        print(f"✅ Recorded attendance for routine {routine_id}: {present}/{len(rows)} present.")
+        return self.last_write
+
+# Global instance
+attendance_writer = AttendanceWriter()
@@ -0,0 +1,340 @@
+import asyncio
+import io
+import os
+import time
+import uuid
+import zipfile
+import numpy as np
+from core.config import settings
+from core.database import supabase
+from .face_logic import extract_faces
+from .inference_pool import inference_pool, InferenceQueueFull
+from .metrics import run_timed, record_spans
+from .vector_search import vector_search
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+def read_archive(archive_bytes, max_photos=None, max_photo_bytes=None, max_members=None, max_uncompressed_bytes=None):
+    """
+    List the photos of a zip archive as (file_name, key, ZipInfo) without
+    decompressing them; read each with archive.read(info) when it is needed.
+    The key is the photo's folder ("2021-CSE-042/front.jpg") or, for photos at
+    the top level, its file name ("2021-CSE-042.jpg"). A student may have
+    several photos. Returns (archive, photos, failures); the caller closes the
+    archive. Raises ValueError for archives with too many entries or photos
+    that would decompress past max_uncompressed_bytes.
+    """
+    max_photos = max_photos or settings.BULK_MAX_PHOTOS
+    max_photo_bytes = max_photo_bytes or settings.BULK_MAX_PHOTO_MB * 2**20
+    max_members = max_members or settings.BULK_MAX_MEMBERS
+    max_uncompressed_bytes = max_uncompressed_bytes or settings.BULK_MAX_UNCOMPRESSED_MB * 2**20
+
+    archive = zipfile.ZipFile(io.BytesIO(archive_bytes))
+    try:
+        infos = archive.infolist()
+        if len(infos) > max_members:
+            raise ValueError(f"Archive has {len(infos)} entries (limit {max_members}).")
+
+        photos, failures = [], []
+        uncompressed = 0
+        for info in infos:
+            name = info.filename
+            parts = [p for p in name.split("/") if p]
+            if info.is_dir() or not parts or parts[0] == "__MACOSX" or parts[-1].startswith("."):
+                continue
+            stem, extension = os.path.splitext(parts[-1])
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+
+            key = parts[-2] if len(parts) > 1 else stem
+            if len(photos) >= max_photos:
+                failures.append({"file": name, "key": key, "reason": "too_many_photos"})
+            elif info.file_size > max_photo_bytes:
+                failures.append({"file": name, "key": key, "reason": "photo_too_large"})
+            else:
+                # file_size is enforced by zipfile on read, so this bounds decompression
+                uncompressed += info.file_size
+                photos.append((name, key.strip(), info))
+        if uncompressed > max_uncompressed_bytes:
+            raise ValueError(
+                f"Photos decompress to {uncompressed / 2**20:.0f} MB "
+                f"(limit {max_uncompressed_bytes / 2**20:.0f} MB)."
+            )
+    except Exception:
+        archive.close()
+        raise
+    return archive, photos, failures
+
+def check_quality(faces, min_score=None, min_face_px=None):
+    """
+    Pick the enrollment face of a portrait.
+    Returns (face, None) or (None, reason) when the photo is unusable.
+    """
+    min_score = settings.BULK_MIN_DET_SCORE if min_score is None else min_score
+    min_face_px = settings.BULK_MIN_FACE_PX if min_face_px is None else min_face_px
+
+    if not faces:
+        return None, "no_face"
+
+    def area(face):
+        x1, y1, x2, y2 = face["bbox"]
+        return (x2 - x1) * (y2 - y1)
+
+    faces = sorted(faces, key=area, reverse=True)
+    face = faces[0]
+    # Small faces in the background are fine; a second face of similar size is not
+    if len(faces) > 1 and area(faces[1]) > 0.3 * area(face):
+        return None, "multiple_faces"
+    if face["score"] < min_score:
+        return None, "low_detection_score"
+    if min(face["bbox"][2] - face["bbox"][0], face["bbox"][3] - face["bbox"][1]) < min_face_px:
+        return None, "face_too_small"
+    if face["embedding"] is None:
+        return None, "no_embedding"
+    return face, None
+
+class BulkEnrollment:
+    def __init__(self):
+        """
+        Enrolls a whole intake from one photo archive: photos are embedded across
+        the inference pool, embeddings are written to students.face_embedding in
+        batches (see add_bulk_enrollment.sql) and the index is updated once.
+        Runs as a background job; progress is polled by job id.
+        """
+        self.jobs = {}
+        # Running jobs, referenced so they are not garbage collected mid-run
+        self._tasks = set()
+        # One enrollment at a time; each already saturates the pool
+        self._lock = asyncio.Lock()
+
+    def start(self, archive_bytes, key_by="auto", section_id=None, dry_run=False):
+        """
+        Queue an enrollment job and return its id.
+        """
+        self._prune()
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "photos": 0,
+            "processed": 0,
+            "students": 0,
+            "enrolled": 0,
+            "templates": 0,
+            "written": 0,
+            "dry_run": dry_run,
+            "failures": [],
+            "duration_ms": None,
+            "finished_at": None,
+        }
+        task = asyncio.create_task(self.run(job_id, archive_bytes, key_by, section_id, dry_run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job_id
+
+    def status(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _prune(self, ttl=None, max_jobs=None):
+        """
+        Forget finished jobs older than `ttl` seconds, then the oldest finished
+        ones beyond `max_jobs`. Queued and running jobs are always kept.
+        """
+        ttl = settings.BULK_JOB_TTL if ttl is None else ttl
+        max_jobs = settings.BULK_MAX_JOBS if max_jobs is None else max_jobs
+        now = time.time()
+        finished = sorted(
+            (job["finished_at"], job_id) for job_id, job in self.jobs.items() if job["finished_at"] is not None
+        )
+        excess = len(self.jobs) - max_jobs
+        for finished_at, job_id in finished:
+            if now - finished_at > ttl or excess > 0:
+                del self.jobs[job_id]
+                excess -= 1
+
+    async def run(self, job_id, archive_bytes, key_by="auto", section_id=None, dry_run=False):
+        job = self.jobs[job_id]
+        async with self._lock:
+            start = time.perf_counter()
+            job["status"] = "running"
+            try:
+                await self._enroll(job, archive_bytes, key_by, section_id, dry_run)
+                job["status"] = "done"
+            except Exception as e:
+                print(f"❌ Bulk enrollment {job_id} failed: {e}")
+                job["status"] = "failed"
+                job["error"] = str(e)
+            job["duration_ms"] = (time.perf_counter() - start) * 1000
+            job["finished_at"] = time.time()
+
+        print(f"✅ Bulk enrollment {job_id}: {job['enrolled']} students enrolled, "
+              f"{len(job['failures'])} photos rejected in {job['duration_ms'] / 1000:.1f}s.")
+
+    async def _enroll(self, job, archive_bytes, key_by, section_id, dry_run):
+        loop = asyncio.get_running_loop()
+        archive, photos, failures = await loop.run_in_executor(None, read_archive, archive_bytes)
+        with archive:
+            await self._enroll_photos(job, archive, photos, failures, key_by, section_id, dry_run)
+
+    async def _enroll_photos(self, job, archive, photos, failures, key_by, section_id, dry_run):
+        loop = asyncio.get_running_loop()
+        job["photos"] = len(photos) + len(failures)
+        job["failures"] = failures
+
+        students = await loop.run_in_executor(None, self.resolve_students, {key for _, key, _ in photos}, key_by, section_id)
+        known = []
+        for name, key, info in photos:
+            student = students.get(key)
+            if student is None:
+                failures.append({"file": name, "key": key, "reason": "unknown_student"})
+            elif student.get("ambiguous"):
+                failures.append({"file": name, "key": key, "reason": "ambiguous_roll_no"})
+            else:
+                known.append((name, key, info))
+        job["processed"] = len(photos) - len(known)
+
+        # Embed across the pool, keeping a bounded number of photos in flight
+        semaphore = asyncio.Semaphore(max(1, settings.BULK_CONCURRENCY))
+        galleries = {}
+
+        async def process(name, key, info):
+            async with semaphore:
+                # Decompressed only while in flight
+                image_bytes = await loop.run_in_executor(None, archive.read, info)
+                faces = await self._extract(image_bytes)
+            job["processed"] += 1
+            face, reason = check_quality(faces)
+            if face is None:
+                failures.append({"file": name, "key": key, "reason": reason})
+                return
+            student_id = str(students[key]["id"])
+            galleries.setdefault(student_id, []).append((face["score"], face["embedding"]))
+
+        await asyncio.gather(*(process(*photo) for photo in known))
+        job["students"] = len(galleries)
+        if not galleries:
+            return
+
+        # The best-detected photo is the enrolled template, the others extend the gallery
+        student_ids = list(galleries)
+        enrolled = np.empty((len(student_ids), vector_search.dimension), dtype=np.float32)
+        extra_ids, extra = [], []
+        for row, student_id in enumerate(student_ids):
+            gallery = sorted(galleries[student_id], key=lambda g: g[0], reverse=True)
+            enrolled[row] = gallery[0][1]
+            for _, embedding in gallery[1:]:
+                extra_ids.append(student_id)
+                extra.append(embedding)
+
+        if dry_run:
+            job["enrolled"] = len(student_ids)
+            return
+
+        job["written"] = await loop.run_in_executor(None, self.write_embeddings, student_ids, enrolled)
+        sections = {
+            str(student["id"]): student.get("section_id")
+            for student in students.values() if not student.get("ambiguous")
+        }
+        job["enrolled"], job["templates"] = await loop.run_in_executor(
+            None, self.update_index, student_ids, enrolled, extra_ids, extra, sections
+        )
+
+    async def _extract(self, image_bytes):
+        while True:
+            try:
+                faces, spans = await inference_pool.run(run_timed, extract_faces, image_bytes)
+                record_spans(spans)
+                return faces
+            except InferenceQueueFull:
+                # Live traffic has filled the queue; give it room and retry
+                await asyncio.sleep(0.5)
+
+    def resolve_students(self, keys, key_by="auto", section_id=None):
+        """
+        Map archive keys to student rows {key: {id, section_id}}.
+        key_by is "id" (students.id), "roll" (students.student_id, the university
+        roll) or "auto" (ids first, roll numbers for the rest). Roll numbers shared
+        by several students are marked ambiguous unless section_id narrows them down.
+        """
+        keys = sorted(keys)
+        if not supabase():
+            # Index-only enrollment: keys must already be student ids
+            if key_by == "roll":
+                raise ValueError("Supabase not configured; roll numbers cannot be resolved.")
+            return {key: {"id": key, "section_id": section_id} for key in keys}
+
+        students = {}
+        batch = settings.BULK_WRITE_BATCH
+        if key_by in ("id", "auto"):
+            ids = [key for key in keys if _is_uuid(key)]
+            for i in range(0, len(ids), batch):
+                query = supabase().table("students").select("id, section_id").in_("id", ids[i:i + batch])
+                if section_id:
+                    query = query.eq("section_id", section_id)
+                for row in query.execute().data or []:
+                    students[str(row["id"])] = row
+
+        if key_by in ("roll", "auto"):
+            rolls = [key for key in keys if key not in students]
+            for i in range(0, len(rolls), batch):
+                query = supabase().table("students").select("id, section_id, student_id").in_("student_id", rolls[i:i + batch])
+                if section_id:
+                    query = query.eq("section_id", section_id)
+                for row in query.execute().data or []:
+                    roll = str(row["student_id"])
+                    students[roll] = {"ambiguous": True} if roll in students else row
+        return students
+
+    def write_embeddings(self, student_ids, embeddings):
+        """
+        Store the enrolled embeddings in students.face_embedding, BULK_WRITE_BATCH
+        students per request. Falls back to one update per student when the
+        set_face_embeddings function is missing. Returns the rows written.
+        """
+        if not supabase():
+            print("⚠️ Supabase not configured, embeddings only added to the index.")
+            return 0
+
+        written = 0
+        batch = settings.BULK_WRITE_BATCH
+        for i in range(0, len(student_ids), batch):
+            payload = [
+                {"id": student_id, "embedding": _vector_text(embedding)}
+                for student_id, embedding in zip(student_ids[i:i + batch], embeddings[i:i + batch])
+            ]
+            try:
+                response = supabase().rpc("set_face_embeddings", {"payload": payload}).execute()
+                written += response.data or 0
+            except Exception as e:
+                print(f"⚠️ set_face_embeddings unavailable ({e}). Writing students one by one.")
+                for row in payload:
+                    supabase().table("students") \
+                        .update({"face_embedding": row["embedding"], "face_registered": True}) \
+                        .eq("id", row["id"]).execute()
+                written += len(payload)
+        return written
+
+    def update_index(self, student_ids, enrolled, extra_ids, extra, sections=None):
+        """
+        Add every enrolled student (and their extra photos as templates) to the
+        index in one bulk update, persisted once.
+        """
+        vector_search.ensure_loaded()
+        vector_search.add_vectors(student_ids, enrolled, save=False, sections=sections)
+        templates = vector_search.add_templates(extra_ids, np.stack(extra), save=False) if extra else 0
+        vector_search.save_index()
+        return len(student_ids), templates
+
+def _is_uuid(value):
+    try:
+        uuid.UUID(value)
+        return True
+    except ValueError:
+        return False
+
+def _vector_text(embedding):
+    # pgvector literal, same format the frontend stores
+    return "[" + ",".join(f"{v:.7g}" for v in np.asarray(embedding, dtype=np.float32).tolist()) + "]"
+
+# Global instance
+bulk_enrollment = BulkEnrollment()
@@ -2,51 +2,217 @@ import numpy as np
 import cv2
 import insightface
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align
 from PIL import Image
 import io
 import os
 import time
+import queue
+import threading
+from concurrent.futures import Future
+from core.config import settings
 from .image_enhancement import enhancer
+from .metrics import span
 from .vector_search import vector_search
 
+_REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def _round32(value):
+    return max(32, int(round(value / 32.0)) * 32)
+
+def choose_det_size(width, height, expected_faces=1):
+    """
+    SCRFD input size for an image: portraits are fine at 640, group photos
+    need more pixels per face. Never upsamples past the decoded image.
+    Returns (width, height), multiples of 32.
+    """
+    if expected_faces <= 1:
+        long_side = 640
+    elif expected_faces <= 10:
+        long_side = 960
+    else:
+        long_side = 1280
+    long_side = min(long_side, settings.DETECT_MAX_SIZE, _round32(max(width, height)))
+    scale = long_side / max(width, height)
+    return _round32(width * scale), _round32(height * scale)
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Pairwise IoU of two sets of [x1, y1, x2, y2] boxes, shape (len(a), len(b)).
+    """
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+def match_boxes(boxes_a, boxes_b, min_iou=0.5):
+    """
+    Greedy one-to-one pairing by IoU. Returns {index in a: index in b}.
+    """
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return {}
+    iou = box_iou(boxes_a, boxes_b)
+    pairs = {}
+    used = set()
+    for i, j in sorted(np.argwhere(iou >= min_iou).tolist(), key=lambda p: -iou[p[0], p[1]]):
+        if i not in pairs and j not in used:
+            pairs[i] = j
+            used.add(j)
+    return pairs
+
+class RecognitionBatcher:
+    def __init__(self, model, window_ms=15.0, max_batch=64):
+        """
+        Collects aligned face crops from concurrent requests and runs the
+        ArcFace session once per batch. A batch closes after `window_ms`
+        or once `max_batch` faces are waiting, whichever comes first.
+        """
+        self.model = model
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="arcface-batcher", daemon=True)
+        self._thread.start()
+
+    def embed(self, crops):
+        """
+        Return raw (n, 512) ArcFace embeddings for a list of aligned crops.
+        Blocks the calling thread until its batch has run.
+        """
+        if len(crops) == 0:
+            return np.empty((0, 512), dtype=np.float32)
+
+        future = Future()
+        self._queue.put((crops, future))
+        return future.result()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            count = len(batch[0][0])
+            deadline = time.monotonic() + self.window
+
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                count += len(item[0])
+
+            self._run(batch)
+
+    def _run(self, batch):
+        crops = [crop for request_crops, _ in batch for crop in request_crops]
+        try:
+            feats = self.model.get_feat(crops)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for request_crops, future in batch:
+            future.set_result(feats[offset:offset + len(request_crops)])
+            offset += len(request_crops)
+
 class FaceLogic:
     def __init__(self, tolerance=0.5):
         """
-        Initialize InsightFace pipeline.
+        Set up the InsightFace pipeline. Models are loaded lazily by load(),
+        either in the background at startup or on the first request.
         Model Pack: buffalo_l (ResNet-50/100 ArcFace + SCRFD)
         """
         self.tolerance = tolerance # Not used for ArcFace directly usually, but 1.22 is roughly 0.5 cos
         # ArcFace thresholds: 
         # L2 Distance: 1.24 (approx 99% accuracy suitable) / Cosine: 0.3-0.4
-        
-        print("⏳ Initializing InsightFace (buffalo_l)... This may take a moment to download models.")
+
+        self.app = None
+        self.batcher = None
+        # not_loaded -> loading -> warming_up -> ready (or failed)
+        self.status = "not_loaded"
+        self._load_lock = threading.Lock()
+        # Extra modules (landmarks, genderage) need FaceAnalysis.get to populate them
+        self._full_pipeline = bool(set(settings.FACE_MODULES) - {'detection', 'recognition'})
+
+    def load(self, warm_up=True):
+        """
+        Load the model pack once; concurrent callers wait for the first one.
+        By default only detection (SCRFD) and recognition (ArcFace) are loaded
+        (settings.FACE_MODULES); the landmark and gender/age models are never
+        used for attendance.
+        """
+        with self._load_lock:
+            if self.status in ("ready", "failed"):
+                return self.app is not None
+
+            self.status = "loading"
+            print(f"⏳ Initializing InsightFace ({settings.FACE_MODEL})... This may take a moment to download models.")
+            try:
+                # providers=['CUDAExecutionProvider', 'CPUExecutionProvider'] if GPU available
+                app = FaceAnalysis(
+                    name=settings.FACE_MODEL,
+                    allowed_modules=settings.FACE_MODULES,
+                    providers=['CPUExecutionProvider']
+                )
+                app.prepare(ctx_id=0, det_size=(640, 640))
+                print("✅ InsightFace model loaded successfully.")
+            except Exception as e:
+                print(f"❌ Failed to initialize InsightFace: {e}")
+                self.status = "failed"
+                return False
+
+            # Share ArcFace batches across concurrent requests
+            if settings.FACE_MICROBATCH:
+                self.batcher = RecognitionBatcher(
+                    app.models['recognition'],
+                    window_ms=settings.FACE_BATCH_WINDOW_MS,
+                    max_batch=settings.FACE_BATCH_MAX
+                )
+
+            if warm_up:
+                self.status = "warming_up"
+                self._warm_up(app)
+
+            self.app = app
+            self.status = "ready"
+            return True
+
+    def _warm_up(self, app):
+        # First ONNX runs allocate buffers and pick kernels; pay that before real traffic
         try:
-            # providers=['CUDAExecutionProvider', 'CPUExecutionProvider'] if GPU available
-            self.app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-            self.app.prepare(ctx_id=0, det_size=(640, 640))
-            print("✅ InsightFace model loaded successfully.")
+            start = time.perf_counter()
+            app.det_model.detect(np.zeros((640, 640, 3), dtype=np.uint8), max_num=0, metric='default')
+            app.models['recognition'].get_feat([np.zeros((112, 112, 3), dtype=np.uint8)])
+            print(f"🔥 InsightFace warm-up done in {(time.perf_counter() - start) * 1000:.0f} ms.")
         except Exception as e:
-            print(f"❌ Failed to initialize InsightFace: {e}")
-            self.app = None
+            print(f"⚠️ InsightFace warm-up failed: {e}")
 
     def get_embedding(self, image_bytes):
         """
         Extract high-accuracy face embedding (512-d).
         """
-        if self.app is None:
+        if self.app is None and not self.load():
             print("❌ InsightFace not initialized.")
             return None
 
         try:
-            # Decode and Enhance
-            img_np = self._decode_image(image_bytes)
-            if img_np is None: return None
-            
-            # Low-light enhancement
-            img_enhanced = enhancer.enhance_if_needed(img_np)
+            # Decode (reduced for large photos) and low-light enhancement
+            img_enhanced, factor, full_loader = self._load_image(image_bytes)
+            if img_enhanced is None: return None
             
             # Detect and align
-            faces = self.app.get(img_enhanced)
+            faces = self._analyze(img_enhanced, expected_faces=1, factor=factor, full_loader=full_loader)
             
             if len(faces) == 0:
                 print("⚠️ No faces detected by InsightFace.")
@@ -66,18 +232,18 @@ class FaceLogic:
             print(f"❌ Error in get_embedding: {e}")
             return None
 
-    def get_embeddings_batch(self, image_bytes):
+    def get_embeddings_batch(self, image_bytes, expected_faces=30):
         """
         Extract multiple normalized embeddings.
+        `expected_faces` sizes the detector input for the crowd in the photo.
         """
-        if self.app is None: return []
+        if self.app is None and not self.load(): return []
 
         try:
-            img_np = self._decode_image(image_bytes)
-            if img_np is None: return []
+            img_enhanced, factor, full_loader = self._load_image(image_bytes)
+            if img_enhanced is None: return []
 
-            img_enhanced = enhancer.enhance_if_needed(img_np)
-            faces = self.app.get(img_enhanced)
+            faces = self._analyze(img_enhanced, expected_faces=expected_faces, factor=factor, full_loader=full_loader)
             
             embeddings = [np.array(face.normed_embedding, dtype=np.float32) for face in faces]
             return embeddings
@@ -86,6 +252,46 @@ class FaceLogic:
             print(f"❌ Error in batch extraction: {e}")
             return []
 
+    def get_faces(self, image, expected_faces=30, skip_boxes=None):
+        """
+        Detect and embed faces, keeping their boxes (original image coordinates).
+        `image` is upload bytes or a decoded BGR frame. Faces overlapping one of
+        `skip_boxes` (already identified in an earlier frame) are not embedded;
+        they come back with embedding None and `track` set to that box's index.
+        """
+        if self.app is None and not self.load(): return []
+
+        try:
+            img_enhanced, factor, full_loader = self._load_image(image)
+            if img_enhanced is None: return []
+
+            tracks = {}
+            if self._full_pipeline:
+                faces = self.app.get(img_enhanced)
+            else:
+                h, w = img_enhanced.shape[:2]
+                faces = self._detect(img_enhanced, choose_det_size(w, h, expected_faces))
+                if faces and skip_boxes:
+                    boxes = np.stack([face.bbox for face in faces]) * factor
+                    tracks = match_boxes(boxes, skip_boxes, settings.SESSION_TRACK_IOU)
+                pending = [face for i, face in enumerate(faces) if i not in tracks]
+                if pending:
+                    self._embed(img_enhanced, pending, factor=factor, full_loader=full_loader)
+
+            return [
+                {
+                    "bbox": [float(v) * factor for v in face.bbox],
+                    "score": float(face.det_score),
+                    "embedding": None if i in tracks else np.array(face.normed_embedding, dtype=np.float32),
+                    "track": tracks.get(i)
+                }
+                for i, face in enumerate(faces)
+            ]
+
+        except Exception as e:
+            print(f"❌ Error in face extraction: {e}")
+            return []
+
     def recognize_face(self, detected_embedding):
         """
         Search for the face in the vector database.
@@ -103,6 +309,175 @@ class FaceLogic:
         student_id, distance = matches[0]
         return student_id, distance
 
+    def detect_faces(self, image_bytes):
+        """
+        Detection-only fast path: SCRFD boxes and scores, no embeddings.
+        Useful for framing checks and head counts.
+        """
+        if self.app is None and not self.load(): return []
+
+        try:
+            img_enhanced, factor, _ = self._load_image(image_bytes)
+            if img_enhanced is None: return []
+
+            h, w = img_enhanced.shape[:2]
+            faces = self._detect(img_enhanced, choose_det_size(w, h, expected_faces=30))
+            # Report boxes in original image coordinates
+            return [
+                {"bbox": [float(v) * factor for v in face.bbox], "score": float(face.det_score)}
+                for face in faces
+            ]
+
+        except Exception as e:
+            print(f"❌ Error in face detection: {e}")
+            return []
+
+    def _detect(self, img, det_size=None):
+        with span("detect"):
+            bboxes, kpss = self.app.det_model.detect(img, input_size=det_size, max_num=0, metric='default')
+        return [Face(bbox=bboxes[i, 0:4], kps=kpss[i], det_score=bboxes[i, 4]) for i in range(bboxes.shape[0])]
+
+    def _align(self, img, faces, factor=1, full_loader=None):
+        """
+        Aligned 112x112 crops for ArcFace. Faces that are too small in the reduced
+        image are re-cropped from a finer decode: the coarsest DCT scale at which
+        the narrowest of them reaches RECOG_MIN_FACE_PX, within RECOG_MAX_DECODE_MP.
+        Only the region around each box is kept.
+        """
+        size = self.app.models['recognition'].input_size[0]
+        small = [face.bbox[2] - face.bbox[0] < settings.RECOG_MIN_FACE_PX for face in faces]
+        finer, scale = None, factor
+        if factor > 1 and full_loader is not None and any(small):
+            narrowest = min(face.bbox[2] - face.bbox[0] for face, is_small in zip(faces, small) if is_small)
+            wanted = next(
+                (s for s in (4, 2) if s < factor and narrowest * factor / s >= settings.RECOG_MIN_FACE_PX), 1
+            )
+            finer, scale = full_loader(wanted)
+
+        crops = []
+        for face, is_small in zip(faces, small):
+            if not is_small or finer is None:
+                crops.append(face_align.norm_crop(img, landmark=face.kps, image_size=size))
+                continue
+
+            # Box with a generous margin, in the finer image's coordinates
+            ratio = factor / scale
+            x1, y1, x2, y2 = face.bbox * ratio
+            margin = 0.5 * max(x2 - x1, y2 - y1)
+            h, w = finer.shape[:2]
+            left, top = int(max(0, x1 - margin)), int(max(0, y1 - margin))
+            right, bottom = int(min(w, x2 + margin)), int(min(h, y2 + margin))
+            region = finer[top:bottom, left:right]
+            kps = face.kps * ratio - np.array([left, top], dtype=np.float32)
+            crops.append(face_align.norm_crop(region, landmark=kps, image_size=size))
+        return crops
+
+    def _embed(self, img, faces, factor=1, full_loader=None):
+        """
+        Align every face and run ArcFace once on the stacked crops.
+        With micro-batching on, that pass is shared with other in-flight requests.
+        """
+        with span("align"):
+            crops = self._align(img, faces, factor=factor, full_loader=full_loader)
+            if settings.ENHANCE_FACE_ROI:
+                crops = enhancer.enhance_crops(crops)
+        # Includes the wait for a shared micro-batch
+        with span("embed"):
+            if self.batcher is not None:
+                embeddings = self.batcher.embed(crops)
+            else:
+                embeddings = self.app.models['recognition'].get_feat(crops)
+
+        for face, embedding in zip(faces, embeddings):
+            face.embedding = embedding
+        return faces
+
+    def _analyze(self, img, expected_faces=1, factor=1, full_loader=None):
+        """
+        Detect faces and attach embeddings, running only SCRFD and ArcFace.
+        """
+        if self._full_pipeline:
+            return self.app.get(img)
+
+        h, w = img.shape[:2]
+        faces = self._detect(img, choose_det_size(w, h, expected_faces))
+        if not faces:
+            return []
+        return self._embed(img, faces, factor=factor, full_loader=full_loader)
+
+    def _load_image(self, image_bytes):
+        """
+        Decode and enhance an upload.
+        Returns (image, factor, full_loader): `factor` is how much the image was
+        downscaled at decode time, and full_loader(scale) decodes a finer 1/scale
+        version on demand, enhanced the same way. It returns (image, scale), or
+        (None, factor) when the pixel budget allows nothing finer than `factor`.
+        """
+        if isinstance(image_bytes, np.ndarray):
+            # Already decoded (e.g. a video frame)
+            with span("enhance"):
+                img_enhanced = enhancer.enhance_if_needed(image_bytes)
+            return img_enhanced, 1, None
+
+        with span("decode"):
+            img_np, factor = self._decode_reduced(image_bytes)
+        if img_np is None:
+            return None, 1, None
+
+        with span("enhance"):
+            img_enhanced = enhancer.enhance_if_needed(img_np)
+        dark = img_enhanced is not img_np
+
+        pixels = img_np.shape[0] * img_np.shape[1] * factor ** 2
+
+        def full_loader(scale=1):
+            # Cost stays bounded however many megapixels the camera has
+            while scale < factor and pixels / scale ** 2 > settings.RECOG_MAX_DECODE_MP * 1e6:
+                scale *= 2
+            if scale >= factor:
+                return None, factor
+            with span("decode"):
+                finer = self._decode_scaled(image_bytes, scale)
+            if finer is None:
+                return None, factor
+            if dark:
+                # Same enhancement as the image the faces were detected on
+                finer = enhancer.enhance(finer, settings.ENHANCE_MODE)
+            return finer, scale
+
+        return img_enhanced, factor, full_loader
+
+    def _decode_reduced(self, image_bytes):
+        """
+        Decode at 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling) when the photo is much
+        larger than detection needs, so cost stops growing with camera megapixels.
+        Returns (image, factor).
+        """
+        if not isinstance(image_bytes, bytes):
+            return self._decode_image(image_bytes), 1
+
+        try:
+            # Reads the header only
+            width, height = Image.open(io.BytesIO(image_bytes)).size
+        except Exception:
+            return self._decode_image(image_bytes), 1
+
+        buffer = np.frombuffer(image_bytes, np.uint8)
+        for factor, flag in _REDUCED_DECODE:
+            if max(width, height) / factor >= settings.DECODE_MIN_SIDE:
+                img_np = cv2.imdecode(buffer, flag)
+                if img_np is not None:
+                    return img_np, factor
+        return self._decode_image(image_bytes), 1
+
+    def _decode_scaled(self, image_bytes, scale):
+        """
+        Decode at 1/scale (1, 2, 4 or 8), using libjpeg DCT scaling below full size.
+        """
+        if scale == 1:
+            return self._decode_image(image_bytes)
+        return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), dict(_REDUCED_DECODE)[scale])
+
     def _decode_image(self, image_bytes):
         try:
             if isinstance(image_bytes, bytes):
@@ -118,3 +493,19 @@ class FaceLogic:
 
 # Global instance
 face_service = FaceLogic()
+
+# Module-level entry points so the inference pool can pickle calls in process mode
+def load_models():
+    return face_service.load()
+
+def extract_embedding(image_bytes):
+    return face_service.get_embedding(image_bytes)
+
+def extract_embeddings_batch(image_bytes):
+    return face_service.get_embeddings_batch(image_bytes)
+
+def extract_face_boxes(image_bytes):
+    return face_service.detect_faces(image_bytes)
+
+def extract_faces(image, skip_boxes=None):
+    return face_service.get_faces(image, skip_boxes=skip_boxes)
@@ -0,0 +1,97 @@
+import numpy as np
+from .face_logic import match_boxes
+
+class Track:
+    def __init__(self, track_id, bbox, frame_index):
+        """
+        One face followed across frames. The box moves with a constant-velocity
+        (alpha-beta) filter between detections.
+        """
+        self.id = track_id
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.misses = 0
+
+        # Identity
+        self.student_id = None
+        self.distance = float("inf")
+        self.confirmed = False
+        self.votes = {}
+        self.attempts = 0
+        self.last_embedded = frame_index
+
+    def predict(self, steps):
+        self.bbox = self.bbox + self.velocity * steps
+
+    def correct(self, bbox, steps, alpha=0.7, beta=0.3):
+        residual = np.asarray(bbox, dtype=np.float32) - self.bbox
+        self.bbox = self.bbox + alpha * residual
+        self.velocity = self.velocity + beta * residual / max(steps, 1)
+        self.misses = 0
+
+class FaceTracker:
+    def __init__(self, iou_threshold=0.3, max_misses=3, max_attempts=3, retry_frames=30):
+        """
+        IoU tracker for a camera stream. Confirmed tracks, and unknown faces that
+        already failed `max_attempts` times, are followed by box overlap alone and
+        not re-embedded (unknown faces are retried every `retry_frames` frames).
+        """
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.max_attempts = max_attempts
+        self.retry_frames = retry_frames
+        self.tracks = []
+        self._next_id = 1
+
+    def predict(self, steps=1):
+        for track in self.tracks:
+            track.predict(steps)
+
+    def skip_tracks(self, frame_index):
+        """
+        Tracks whose faces do not need an embedding on this frame.
+        """
+        return [
+            track for track in self.tracks
+            if track.confirmed or (
+                track.attempts >= self.max_attempts and frame_index - track.last_embedded < self.retry_frames
+            )
+        ]
+
+    def update(self, boxes, matched, frame_index, steps=1):
+        """
+        Fold one frame's detections into the tracks.
+        `matched` maps detection index -> track for detections already paired
+        (e.g. by the detector's skip boxes). The other detections are paired with
+        the remaining tracks by IoU or start new tracks; tracks missed for more
+        than `max_misses` detection frames are dropped.
+        Returns the track of every detection.
+        """
+        assigned = dict(matched)
+        taken = {id(track) for track in assigned.values()}
+        free_tracks = [track for track in self.tracks if id(track) not in taken]
+        free_faces = [i for i in range(len(boxes)) if i not in assigned]
+
+        pairs = match_boxes(
+            [boxes[i] for i in free_faces], [track.bbox for track in free_tracks], self.iou_threshold
+        )
+        for face, track in pairs.items():
+            assigned[free_faces[face]] = free_tracks[track]
+
+        for i in range(len(boxes)):
+            track = assigned.get(i)
+            if track is None:
+                track = Track(self._next_id, boxes[i], frame_index)
+                self._next_id += 1
+                self.tracks.append(track)
+                assigned[i] = track
+            else:
+                track.correct(boxes[i], steps)
+
+        seen = {id(track) for track in assigned.values()}
+        for track in self.tracks:
+            if id(track) not in seen:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        return [assigned[i] for i in range(len(boxes))]
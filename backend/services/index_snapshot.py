@@ -0,0 +1,230 @@
+import faiss
+import json
+import numpy as np
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized, cleanup still spares newer versions
+    fcntl = None
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+# Zero-copy flat codes need a newer FAISS; IVF lists are mmapped with IO_FLAG_MMAP alone
+_HAS_MMAP_IFC = hasattr(faiss, "IO_FLAG_MMAP_IFC")
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+LOCK_FILE = ".lock"
+# Millisecond timestamp of the version a data file belongs to
+_VERSION_RE = re.compile(r"-(\d+)-[0-9a-f]{8}\.(?:faiss|json|npy)$")
+
+class SnapshotMismatch(Exception):
+    """
+    Raised when a snapshot was written for a different model or dimension.
+    """
+    pass
+
+def _fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _atomic_write_text(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _write_index(index, path):
+    if isinstance(index, np.ndarray):
+        # Already serialized by faiss.serialize_index
+        with open(path + ".tmp", "wb") as f:
+            index.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+    else:
+        faiss.write_index(index, path + ".tmp")
+        _fsync_file(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+@contextmanager
+def _writer_lock(snapshot_dir):
+    """
+    Exclusive lock on the snapshot dir, so workers publish (and clean up) one at a time.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(snapshot_dir, LOCK_FILE), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _version_time(version):
+    try:
+        return int(str(version).split("-")[0])
+    except ValueError:
+        return None
+
+def write_snapshot(snapshot_dir, index, header, meta, arrays=None, indexes=None):
+    """
+    Write a new snapshot version and publish it atomically.
+
+    Layout of `snapshot_dir`:
+      manifest.json      header (format, model, dimension, count, engine, ...) naming the live version
+      index-<v>.faiss    FAISS index: float32 vector block + int64 id block (IDMap2) or IVF lists
+      meta-<v>.json      label -> student id and section maps
+      array-<name>-<v>.npy  optional extra float32 matrices (e.g. gallery templates)
+      index-<name>-<v>.faiss  optional side indexes (e.g. exact vectors for reranking)
+
+    Data files are written under fresh names first; the manifest is swapped in with
+    os.replace last, so a crash at any point leaves the previous version intact.
+    Writers from several processes are serialized with a lock file.
+    Indexes may be passed as faiss.serialize_index bytes; header must then hold "count".
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    with _writer_lock(snapshot_dir):
+        return _write_snapshot(snapshot_dir, index, header, meta, arrays, indexes)
+
+def _write_snapshot(snapshot_dir, index, header, meta, arrays, indexes):
+    version = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    index_file = f"index-{version}.faiss"
+    meta_file = f"meta-{version}.json"
+
+    _write_index(index, os.path.join(snapshot_dir, index_file))
+
+    index_files = {}
+    for name, extra in (indexes or {}).items():
+        index_files[name] = f"index-{name}-{version}.faiss"
+        _write_index(extra, os.path.join(snapshot_dir, index_files[name]))
+
+    _atomic_write_text(os.path.join(snapshot_dir, meta_file), json.dumps(meta))
+
+    array_files = {}
+    for name, array in (arrays or {}).items():
+        array_file = f"array-{name}-{version}.npy"
+        array_path = os.path.join(snapshot_dir, array_file)
+        with open(array_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(array_path + ".tmp", array_path)
+        array_files[name] = array_file
+
+    manifest = dict(header)
+    manifest.update({
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "count": int(header["count"]) if "count" in header else int(index.ntotal),
+        "index_file": index_file,
+        "meta_file": meta_file,
+        "array_files": array_files,
+        "index_files": index_files,
+    })
+    previous = read_manifest(snapshot_dir)
+    _atomic_write_text(os.path.join(snapshot_dir, MANIFEST), json.dumps(manifest, indent=2))
+
+    # Keep the previous version for readers that opened it just before the swap.
+    # Only versions older than it are deleted, and never in-progress .tmp files.
+    keep = {index_file, meta_file, *array_files.values(), *index_files.values()}
+    cutoff = _version_time(version)
+    if previous:
+        keep.update({previous.get("index_file"), previous.get("meta_file"),
+                     *previous.get("array_files", {}).values(), *previous.get("index_files", {}).values()})
+        cutoff = _version_time(previous.get("version")) or cutoff
+    for name in os.listdir(snapshot_dir):
+        match = _VERSION_RE.search(name)
+        if name in keep or match is None or int(match.group(1)) >= cutoff:
+            continue
+        try:
+            os.remove(os.path.join(snapshot_dir, name))
+        except OSError:
+            pass
+
+    return manifest
+
+def read_manifest(snapshot_dir):
+    path = os.path.join(snapshot_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _read_index(path, mmap):
+    """
+    Returns (index, mmapped): mmapped only if the index data really is mapped.
+    """
+    if mmap:
+        try:
+            index = faiss.read_index(path, MMAP_FLAGS)
+            return index, _is_mapped(index)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path), False
+
+def _is_mapped(index):
+    # IVF lists come back as OnDiskInvertedLists; flat codes (also HNSW storage) only with IO_FLAG_MMAP_IFC
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+    if not _HAS_MMAP_IFC:
+        return False
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return isinstance(index, faiss.IndexFlatCodes)
+
+def read_snapshot(snapshot_dir, model, dimension, mmap=True):
+    """
+    Open the live snapshot. Returns (manifest, index, meta, mmapped) or None if there is none.
+    With mmap, the index data stays in the page cache shared by every worker process.
+    """
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None:
+        return None
+
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise SnapshotMismatch(f"Unsupported snapshot format {manifest.get('format_version')}")
+    if manifest.get("model") != model or manifest.get("dimension") != dimension:
+        raise SnapshotMismatch(
+            f"Snapshot is for {manifest.get('model')} ({manifest.get('dimension')}-D), expected {model} ({dimension}-D)"
+        )
+
+    index, mmapped = _read_index(os.path.join(snapshot_dir, manifest["index_file"]), mmap)
+
+    with open(os.path.join(snapshot_dir, manifest["meta_file"])) as f:
+        meta = json.load(f)
+
+    if index.ntotal != manifest["count"]:
+        raise SnapshotMismatch(f"Snapshot count mismatch: manifest {manifest['count']}, index {index.ntotal}")
+
+    return manifest, index, meta, mmapped
+
+def read_snapshot_array(snapshot_dir, manifest, name, mmap=True):
+    """
+    Load one of the snapshot's extra arrays, or None if it was not written.
+    """
+    array_file = manifest.get("array_files", {}).get(name)
+    if array_file is None:
+        return None
+    return np.load(os.path.join(snapshot_dir, array_file), mmap_mode="r" if mmap else None)
+
+def read_snapshot_index(snapshot_dir, manifest, name, mmap=True):
+    """
+    Open one of the snapshot's side indexes, or None if it was not written.
+    """
+    index_file = manifest.get("index_files", {}).get(name)
+    if index_file is None:
+        return None
+    return _read_index(os.path.join(snapshot_dir, index_file), mmap)[0]
@@ -0,0 +1,193 @@
+import time
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from core.config import settings
+from core.database import supabase
+from .metrics import SYNC_SECONDS, SYNC_ROWS
+from .vector_search import vector_search
+
+class IndexSync:
+    def __init__(self):
+        """
+        Keeps the FAISS index in step with students.face_embedding.
+        A full sync reloads every embedding; a delta sync only fetches rows whose
+        updated_at is past the watermark stored with the on-disk index
+        (see add_students_sync_tracking.sql), minus SYNC_OVERLAP_SECONDS.
+        """
+        self.last_sync = None
+        # One sync at a time (startup vs. /api/face/sync)
+        self._lock = threading.Lock()
+
+    def sync(self, full=False):
+        """
+        Run a delta sync when the loaded index carries a watermark, otherwise a full one.
+        """
+        # Never sync into an index that the on-disk snapshot would later overwrite
+        vector_search.ensure_loaded()
+        if not supabase():
+            print("⚠️ Supabase not configured, skipping sync.")
+            return None
+
+        with self._lock:
+            start = time.perf_counter()
+            if full or vector_search.sync_watermark is None:
+                result = self.full_sync()
+            else:
+                result = self.delta_sync()
+
+        elapsed = time.perf_counter() - start
+        result["duration_ms"] = elapsed * 1000
+        SYNC_SECONDS.labels(result["mode"]).observe(elapsed)
+        SYNC_ROWS.labels("upserted").inc(result.get("upserted", 0))
+        SYNC_ROWS.labels("removed").inc(result.get("removed", 0))
+        self.last_sync = result
+        return result
+
+    def full_sync(self):
+        """
+        Stream every stored embedding into a fresh index, one keyset page at a time,
+        so peak memory is bounded by the page size rather than the student count.
+        """
+        self._watermark = None
+        self._tracking = True
+        try:
+            total = self._count_embeddings()
+            first_page = self._fetch_page(None)
+        except Exception as e:
+            # Change tracking migration not applied yet: fall back to a plain reload every time
+            print(f"ℹ️ students.updated_at unavailable ({e}). Delta sync disabled.")
+            self._tracking = False
+            total = 0
+            first_page = self._fetch_page(None)
+
+        self._loaded = 0
+        vector_search.rebuild_from_chunks(self._stream_chunks(first_page), expected_total=total, save=False)
+        vector_search.sync_watermark = self._watermark if self._tracking else None
+        vector_search.save_index()
+
+        if self._loaded:
+            print(f"✅ Synced {self._loaded} students from DB to FAISS.")
+        else:
+            print("⚠️ No students found in DB to sync.")
+        return {"mode": "full", "upserted": self._loaded, "removed": 0}
+
+    def _count_embeddings(self):
+        response = supabase().table("students").select("id", count="exact").not_.is_("face_embedding", "null").limit(1).execute()
+        return response.count or 0
+
+    def _fetch_page(self, after_id):
+        columns = "id, section_id, face_embedding, updated_at" if self._tracking else "id, section_id, face_embedding"
+        query = supabase().table("students").select(columns).not_.is_("face_embedding", "null")
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        return query.order("id").limit(settings.SYNC_PAGE_SIZE).execute().data
+
+    def _stream_chunks(self, page):
+        """
+        Yield (student_ids, matrix, sections) per page, following id order (keyset pagination).
+        """
+        while page:
+            student_ids, matrix, sections = self._parse_records(page)
+            self._loaded += len(student_ids)
+            stamps = [r['updated_at'] for r in page if r.get('updated_at')]
+            if self._tracking and stamps:
+                self._watermark = max(stamps + ([self._watermark] if self._watermark else []))
+            yield student_ids, matrix, sections
+
+            if len(page) < settings.SYNC_PAGE_SIZE:
+                break
+            page = self._fetch_page(page[-1]['id'])
+
+    @staticmethod
+    def _parse_records(records):
+        """
+        Decode a page of rows into a preallocated float32 matrix.
+        pgvector text ("[0.1,0.2,...]") is parsed in C, without building Python floats.
+        """
+        dimension = vector_search.dimension
+        matrix = np.empty((len(records), dimension), dtype=np.float32)
+        student_ids = []
+        sections = {}
+
+        for record in records:
+            emb = record['face_embedding']
+            try:
+                if isinstance(emb, str):
+                    row = np.fromstring(emb.strip('[]'), sep=',', dtype=np.float32)
+                else:
+                    row = np.asarray(emb, dtype=np.float32)
+                matrix[len(student_ids)] = row
+            except ValueError:
+                print(f"⚠️ Skipping student {record['id']}: embedding is not {dimension}-D.")
+                continue
+
+            s_id = str(record['id'])
+            student_ids.append(s_id)
+            sections[s_id] = record.get('section_id')
+
+        return student_ids, matrix[:len(student_ids)], sections
+
+    def delta_sync(self):
+        watermark = vector_search.sync_watermark
+        # updated_at is the writer's now(), not its commit time: a transaction that
+        # commits after the last sync can carry an older stamp, so re-read a margin
+        since = _before(watermark, settings.SYNC_OVERLAP_SECONDS)
+
+        # Includes rows whose embedding was cleared, so they can be dropped
+        changed = []
+        cursor = None
+        while True:
+            query = supabase().table("students").select("id, section_id, face_embedding, updated_at")
+            if cursor is None:
+                query = query.gte("updated_at", since)
+            else:
+                # Keyset on (updated_at, id): a bulk update stamps many rows with the same time
+                stamp, last_id = cursor
+                query = query.or_(f'updated_at.gt."{stamp}",and(updated_at.eq."{stamp}",id.gt.{last_id})')
+            page = query.order("updated_at").order("id").limit(settings.SYNC_PAGE_SIZE).execute().data
+            changed.extend(page)
+            if len(page) < settings.SYNC_PAGE_SIZE:
+                break
+            cursor = (page[-1]['updated_at'], page[-1]['id'])
+
+        deleted = supabase().table("student_deletions").select("student_id, deleted_at").gte("deleted_at", since).execute().data
+
+        removals = set()
+        for record in changed:
+            watermark = max(watermark, record['updated_at'])
+            if record.get('face_embedding') is None:
+                removals.add(str(record['id']))
+
+        student_ids, matrix, sections = self._parse_records([r for r in changed if r.get('face_embedding') is not None])
+        upserts = dict(zip(student_ids, matrix))
+
+        for record in deleted:
+            watermark = max(watermark, record['deleted_at'])
+            removals.add(str(record['student_id']))
+
+        # A student re-registered after deletion is an upsert, not a removal
+        removals -= set(upserts)
+
+        if upserts or removals:
+            vector_search.sync_watermark = watermark
+            upserted, removed = vector_search.apply_delta(upserts, removals, sections=sections)
+            print(f"✅ Delta sync: {upserted} upserted, {removed} removed (watermark {watermark}).")
+        else:
+            upserted, removed = 0, 0
+            print("✅ Delta sync: index already up to date.")
+
+        return {"mode": "delta", "upserted": upserted, "removed": removed}
+
+def _before(stamp, seconds):
+    """
+    ISO timestamp `seconds` earlier than `stamp` (unchanged if it cannot be parsed).
+    """
+    try:
+        parsed = datetime.fromisoformat(stamp.replace("Z", "+00:00"))
+    except ValueError:
+        return stamp
+    return (parsed - timedelta(seconds=seconds)).isoformat()
+
+# Global instance
+index_sync = IndexSync()
@@ -0,0 +1,142 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from core.config import settings
+
+class InferenceQueueFull(Exception):
+    """
+    Raised when every worker is busy and the admission queue is full.
+    """
+    pass
+
+def _load_worker_models():
+    # Process-pool initializer: every worker loads its models before taking a job.
+    # Imported here so the pool does not depend on face_logic at import time.
+    from .face_logic import load_models
+    load_models()
+
+def _timed_call(fn, *args):
+    # Runs inside the worker; monotonic time is comparable across processes on the same host
+    started = time.monotonic()
+    return started, fn(*args)
+
+class InferencePool:
+    def __init__(self, workers=2, queue_size=16, executor="thread", retry_after=5, initializer=None):
+        """
+        Bounded pool that runs blocking model inference off the event loop.
+        At most `workers` jobs run at once and `queue_size` more may wait;
+        anything beyond that is rejected with InferenceQueueFull.
+        In process mode `initializer` runs once in every worker process,
+        including ones respawned later.
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor_kind = executor
+        self.retry_after = retry_after
+
+        if executor == "process":
+            # Spawn so each worker loads its own ONNX sessions instead of inheriting forked ones
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=initializer,
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        # Metrics
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent_waits = deque(maxlen=256)
+
+    async def run(self, fn, *args):
+        """
+        Run fn(*args) on the pool and await its result.
+        In process mode fn must be a picklable module-level function.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise InferenceQueueFull(f"Inference queue full ({self._pending} pending)")
+            self._pending += 1
+
+        submitted = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            started, result = await loop.run_in_executor(self.executor, _timed_call, fn, *args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+        wait = max(0.0, started - submitted)
+        with self._lock:
+            self.completed += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._recent_waits.append(wait)
+
+        return result
+
+    def warm_up(self, fn):
+        """
+        Run fn ahead of traffic (e.g. to load models). Blocks until done.
+        Bypasses admission control; returns the list of results.
+        In process mode there is no guarantee each call lands on a different
+        worker; every worker has already run the pool initializer before its
+        first call, so `workers` calls start the processes and report whether
+        they loaded.
+        """
+        # Threads share one process, so a single call is enough there
+        count = self.workers if self.executor_kind == "process" else 1
+        futures = [self.executor.submit(fn) for _ in range(count)]
+        return [f.result() for f in futures]
+
+    @property
+    def queue_depth(self):
+        return max(0, self._pending - self.workers)
+
+    def stats(self):
+        """
+        Snapshot of queue depth and wait-time metrics (milliseconds).
+        """
+        with self._lock:
+            recent = sorted(self._recent_waits)
+            p95 = recent[int(0.95 * (len(recent) - 1))] if recent else 0.0
+            return {
+                "executor": self.executor_kind,
+                "workers": self.workers,
+                "queue_capacity": self.queue_size,
+                "in_flight": self._pending,
+                "queue_depth": self.queue_depth,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "avg_wait_ms": (self.total_wait / self.completed * 1000) if self.completed else 0.0,
+                "p95_wait_ms": p95 * 1000,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Global instance
+inference_pool = InferencePool(
+    workers=settings.INFERENCE_WORKERS,
+    queue_size=settings.INFERENCE_QUEUE_SIZE,
+    executor=settings.INFERENCE_EXECUTOR,
+    retry_after=settings.INFERENCE_RETRY_AFTER,
+    initializer=_load_worker_models,
+)
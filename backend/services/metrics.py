@@ -0,0 +1,97 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# Stage timings of the request (or pool job) running in this context; None outside one
+_spans: ContextVar = ContextVar("spans", default=None)
+
+STAGE_SECONDS = Histogram(
+    "attendu_stage_seconds", "Time spent per pipeline stage", ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+REQUEST_SECONDS = Histogram(
+    "attendu_request_seconds", "End-to-end request latency", ["route", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+FACES_PER_IMAGE = Histogram(
+    "attendu_faces_per_image", "Faces detected per uploaded image",
+    buckets=(0, 1, 2, 5, 10, 20, 40, 60, 100, 200)
+)
+SYNC_SECONDS = Histogram(
+    "attendu_sync_seconds", "Duration of index syncs from Supabase", ["mode"],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+SYNC_ROWS = Counter("attendu_sync_rows_total", "Students upserted or removed by syncs", ["change"])
+CACHE_REQUESTS = Counter("attendu_result_cache_requests_total", "Result cache lookups", ["kind", "result"])
+INDEX_VECTORS = Gauge("attendu_index_vectors", "Vectors in the FAISS index")
+INFERENCE_IN_FLIGHT = Gauge("attendu_inference_in_flight", "Inference jobs running or queued")
+INFERENCE_QUEUE_DEPTH = Gauge("attendu_inference_queue_depth", "Inference jobs waiting for a worker")
+
+@contextmanager
+def span(stage):
+    """
+    Time a pipeline stage. Inside a request (or run_timed job) the duration is
+    added to that request's spans; otherwise it is observed right away.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        spans = _spans.get()
+        if spans is None:
+            STAGE_SECONDS.labels(stage).observe(elapsed)
+        else:
+            spans[stage] = spans.get(stage, 0.0) + elapsed
+
+@contextmanager
+def collect_spans():
+    """
+    Gather the spans of everything run inside the block into a fresh dict.
+    """
+    spans = {}
+    token = _spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _spans.reset(token)
+
+def run_timed(fn, *args):
+    """
+    Run fn(*args) and return (result, spans). Module-level so the inference pool
+    can ship it to worker processes; the spans travel back with the result.
+    """
+    with collect_spans() as spans:
+        result = fn(*args)
+    return result, spans
+
+def record_spans(spans):
+    """
+    Merge spans measured elsewhere (e.g. in a pool worker) into the current request.
+    """
+    current = _spans.get()
+    for stage, elapsed in spans.items():
+        if current is None:
+            STAGE_SECONDS.labels(stage).observe(elapsed)
+        else:
+            current[stage] = current.get(stage, 0.0) + elapsed
+
+def observe_request(spans, route, status, elapsed):
+    for stage, seconds in spans.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+    REQUEST_SECONDS.labels(route, str(status)).observe(elapsed)
+
+def server_timing(spans, total):
+    """
+    Server-Timing header value (milliseconds), e.g. "decode;dur=12.3, total;dur=80.1".
+    """
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in spans.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def render():
+    """
+    Prometheus text exposition of every metric. Returns (body, content_type).
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from core.config import settings
+from .metrics import span, CACHE_REQUESTS
+
+def pipeline_version():
+    """
+    Everything that changes the embeddings extracted from a given image.
+    Embeddings do not depend on the gallery, so index changes keep entries valid.
+    """
+    return "|".join(str(v) for v in (
+        settings.FACE_MODEL, ",".join(settings.FACE_MODULES), settings.DECODE_MIN_SIDE,
+        settings.DETECT_MAX_SIZE, settings.RECOG_MIN_FACE_PX, settings.ENHANCE_MODE,
+        settings.ENHANCE_GAMMA, settings.ENHANCE_FACE_ROI,
+    ))
+
+def _size_of(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(_size_of(v) for v in value) + 8 * len(value)
+    if isinstance(value, dict):
+        return sum(_size_of(v) for v in value.values()) + 64
+    return 64
+
+class ResultCache:
+    def __init__(self, max_entries=512, max_bytes=64 * 2**20, ttl=600):
+        """
+        LRU + TTL cache of extraction results (per-face embeddings, boxes), keyed by
+        a hash of the uploaded bytes plus the pipeline version. Retried and
+        re-submitted photos skip decode, detection and embedding entirely.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = pipeline_version()
+
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Identical uploads already being processed: key -> Future
+        self._inflight = {}
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def key(self, kind, image_bytes):
+        with span("hash"):
+            digest = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+        return f"{kind}:{self.version}:{digest}"
+
+    def get(self, key):
+        """
+        Cached value or None (also for expired entries).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, value):
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_compute(self, kind, image_bytes, compute):
+        """
+        Return the cached result for these bytes, or await compute() once and cache it.
+        Concurrent requests with the same bytes share one computation.
+        Empty results (no face, or a failed extraction) are not cached.
+        """
+        if self.max_entries <= 0:
+            return await compute()
+
+        key = self.key(kind, image_bytes)
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            CACHE_REQUESTS.labels(kind, "hit").inc()
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            CACHE_REQUESTS.labels(kind, "coalesced").inc()
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        CACHE_REQUESTS.labels(kind, "miss").inc()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        if value is not None and (not isinstance(value, list) or len(value) > 0):
+            self.put(key, value)
+        future.set_result(value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+# Global instance
+result_cache = ResultCache(
+    max_entries=settings.RESULT_CACHE_ENTRIES,
+    max_bytes=settings.RESULT_CACHE_MB * 2**20,
+    ttl=settings.RESULT_CACHE_TTL,
+)
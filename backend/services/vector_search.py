@@ -1,111 +1,988 @@
+import functools
 import faiss
 import numpy as np
 import pickle
 import os
+import uuid
+import hashlib
+import threading
+import time
+from core.config import settings
+from .metrics import span
+from .index_snapshot import write_snapshot, read_snapshot, read_snapshot_array, read_snapshot_index
+
+ENGINES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# Vector codes kept in the index; anything but float32 is reranked on exact vectors
+STORAGES = ("float32", "fp16", "int8", "pq")
+_SQ_TYPES = {"fp16": "QT_fp16", "int8": "QT_8bit"}
+
+def select_engine(ntotal):
+    """
+    Default policy: exact search while a linear scan is cheap,
+    graph search for mid-sized galleries, inverted lists beyond that.
+    """
+    if ntotal < 20_000:
+        return "flat"
+    if ntotal < 200_000:
+        return "hnsw"
+    if ntotal < 1_000_000:
+        return "ivf_flat"
+    return "ivf_pq"
+
+_LABEL_MASK = (1 << 63) - 1
+
+def student_label(student_id) -> int:
+    """
+    Stable non-negative int64 FAISS label for a student.
+    Numeric ids are used as-is; UUIDs (the live schema) and other strings
+    are folded to 63 bits so the label is the same in every process.
+    """
+    sid = str(student_id)
+    if sid.isdigit() and int(sid) <= _LABEL_MASK:
+        return int(sid)
+    try:
+        return uuid.UUID(sid).int & _LABEL_MASK
+    except ValueError:
+        return int.from_bytes(hashlib.blake2b(sid.encode(), digest_size=8).digest(), 'little') & _LABEL_MASK
+
+def _locked(method):
+    """
+    Run a VectorSearch method under the instance lock. Syncs and template
+    learning write from worker threads while requests search. Snapshots are
+    written after the lock is released (see save_index).
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def gallery_centroid(templates):
+    """
+    Unit-length mean of a student's templates; what the main index stores for them.
+    """
+    centroid = np.asarray(templates, dtype='float32').mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    return centroid / norm if norm > 0 else centroid
 
 class VectorSearch:
-    def __init__(self, dimension=512, index_path="faiss_index.bin", mapping_path="id_mapping.pkl"):
+    def __init__(self, dimension=512, snapshot_dir=None, engine=None, nprobe=None, ef_search=None,
+                 legacy_index_path=None, legacy_mapping_path=None, autoload=True, storage=None):
         self.dimension = dimension
-        self.index_path = index_path
-        self.mapping_path = mapping_path
+        self.snapshot_dir = snapshot_dir or settings.INDEX_SNAPSHOT_DIR
+        # Pre-snapshot cache files, migrated on first load
+        self.legacy_index_path = legacy_index_path
+        self.legacy_mapping_path = legacy_mapping_path
+
+        # "auto" picks an engine from the gallery size on every rebuild
+        self.engine_setting = engine or settings.INDEX_ENGINE
+        if self.engine_setting != "auto" and self.engine_setting not in ENGINES:
+            raise ValueError(f"Unknown index engine '{self.engine_setting}'. Use auto or one of {ENGINES}")
+        self.nprobe = nprobe or settings.INDEX_NPROBE
+        self.ef_search = ef_search or settings.INDEX_EF_SEARCH
+        self.storage = storage or settings.INDEX_STORAGE
+        if self.storage not in STORAGES:
+            raise ValueError(f"Unknown index storage '{self.storage}'. Use one of {STORAGES}")
         
-        # Initialize FAISS index (L2 Distance)
-        self.index = faiss.IndexFlatL2(dimension)
+        # Initialize FAISS index (L2 Distance). Trained engines need data, so start flat.
+        self.engine = "flat"
+        self.index = faiss.IndexIDMap2(self._flat_codes(0))
+        # Exact float32 copies of compressed vectors, used to rerank candidates
+        self.exact = self._new_exact(self.index)
+        # True while self.index is a read-only mmap of the snapshot
+        self._mmapped = False
+        # HNSW graphs cannot delete: removed vectors stay in the graph as tombstones
+        # (graph positions) that search skips, until _maybe_compact rebuilds it
+        self._dead = set()
+        self._dead_selector = None
+        self._graph_ids = None
         
-        # Mapping from FAISS integer ID to Student string ID
-        # FAISS uses incremental integers 0, 1, 2...
+        # Mapping from FAISS label to Student string ID.
+        # Labels are stable per student (see student_label), one vector per student.
         self.id_mapping = {} 
-        
-        self.load_index()
 
-    def add_vector(self, student_id: str, embedding: np.array):
+        # Students with more than one template: student_id -> (t, d) matrix, enrolled
+        # template first. The index holds their centroid; search reranks on the templates.
+        self.templates = {}
+        # Unsaved template changes (or a migrated legacy cache), saved by flush()
+        self._dirty = False
+        self._last_save = 0.0
+        # Templates learned from recognitions, applied in batches by flush()
+        self._pending_templates = []
+        self._pending_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        # Student string ID -> section ID, used for roster-scoped search
+        self.student_sections = {}
+        # Lazily built per-section sub-indexes: section_id -> (IndexFlatL2, [student_id, ...])
+        self._section_indexes = {}
+        self._section_members = None
+
+        # High-water mark (students.updated_at) of the last DB sync baked into this index
+        self.sync_watermark = None
+
+        # Set once load_index() has run; the app loads the global instance in the background
+        self.loaded = False
+        self._load_lock = threading.Lock()
+        # Guards the index, mappings and caches between writers and searches
+        self._lock = threading.RLock()
+        # Serializes snapshot writes; taken before self._lock, never while holding it
+        self._save_lock = threading.Lock()
+        if autoload:
+            self.load_index()
+
+    def add_vector(self, student_id: str, embedding: np.array, section_id=None):
         """
-        Add a new vector to the index.
+        Add a vector to the index, replacing the student's previous one.
+        Kept for existing callers; same as upsert_vector.
+        """
+        return self.upsert_vector(student_id, embedding, section_id=section_id)
+
+    def upsert_vector(self, student_id: str, embedding: np.array, section_id=None, save=True):
+        """
+        Insert or replace a student's vector (their enrolled template).
         """
         if embedding.shape[0] != self.dimension:
             raise ValueError(f"Embedding dimension mismatch. Expected {self.dimension}, got {embedding.shape[0]}")
-        
-        # Reshape for FAISS (1, d)
-        vector = embedding.reshape(1, -1).astype('float32')
-        
-        # FAISS ID is the current number of vectors
-        faiss_id = self.index.ntotal
-        
-        # Add to index
-        self.index.add(vector)
-        
-        # Update mapping
-        self.id_mapping[faiss_id] = student_id
-        
-        # Auto-save
-        self.save_index()
-        
-        return faiss_id
 
-    def search(self, embedding: np.array, k=1):
+        sections = {student_id: section_id} if section_id is not None else None
+        labels = self.add_vectors([student_id], embedding.reshape(1, -1), save=save, sections=sections)
+        return int(labels[0])
+
+    def remove_vector(self, student_id: str, save=True):
+        """
+        Remove a student's vector. Returns True if it was present.
+        """
+        return self.remove_vectors([student_id], save=save) > 0
+
+    def remove_vectors(self, student_ids, save=True):
+        """
+        Remove several students in one call. Returns how many were present.
+        """
+        with self._lock:
+            labels = [label for label in map(student_label, student_ids) if label in self.id_mapping]
+            if labels:
+                self._remove_labels(labels)
+                changes = {}
+                for label in labels:
+                    student_id = self.id_mapping.pop(label)
+                    changes[label] = (self.student_sections.pop(student_id, None), None)
+                    self.templates.pop(student_id, None)
+                self._maybe_compact()
+                self._invalidate_sections(changes)
+        if save and labels:
+            self.save_index()
+        return len(labels)
+
+    def add_vectors(self, student_ids, embeddings: np.array, save=True, sections=None):
+        """
+        Upsert many vectors in a single call.
+        `embeddings` is an (n, d) matrix whose rows line up with `student_ids`.
+        `sections` optionally maps student_id -> section_id.
+        Persists once at the end instead of once per vector.
+        Each vector is the student's enrolled template: learned templates are kept
+        only if it is unchanged (see _merge_enrolled).
+        """
+        vectors = np.ascontiguousarray(embeddings, dtype='float32')
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimension:
+            raise ValueError(f"Embedding matrix must be (n, {self.dimension}), got {vectors.shape}")
+        if vectors.shape[0] != len(student_ids):
+            raise ValueError(f"Got {vectors.shape[0]} embeddings for {len(student_ids)} student ids")
+
+        with self._lock:
+            vectors = self._merge_enrolled(student_ids, vectors)
+            labels = self._write_vectors(student_ids, vectors, sections)
+
+        if save:
+            self.save_index()
+
+        return labels
+
+    def _write_vectors(self, student_ids, vectors, sections=None):
+        """
+        Replace the indexed vectors of the given students.
+        """
+        # Last row wins if a student appears twice in the batch
+        rows = {student_label(sid): (row, sid) for row, sid in enumerate(student_ids)}
+        labels = np.fromiter(rows.keys(), dtype=np.int64, count=len(rows))
+        touched = {label: sid for label, (_, sid) in rows.items()}
+        touched.update({student_label(sid): sid for sid in (sections or {})})
+        before = {label: self.student_sections.get(sid) if label in self.id_mapping else None for label, sid in touched.items()}
+
+        if len(labels) > 0:
+            self._ensure_writable()
+            stale = [label for label in rows if label in self.id_mapping]
+            if stale:
+                self._remove_labels(stale)
+            picks = [row for row, _ in rows.values()]
+            self.index.add_with_ids(np.ascontiguousarray(vectors[picks]), labels)
+            self._graph_ids = None
+            if self.exact is not None:
+                self.exact.add_with_ids(np.ascontiguousarray(vectors[picks]), labels)
+            self.id_mapping.update({label: sid for label, (_, sid) in rows.items()})
+            self._maybe_compact()
+        if sections:
+            self.student_sections.update({sid: str(sec) for sid, sec in sections.items() if sec is not None})
+        self._invalidate_sections({
+            label: (before[label], self.student_sections.get(sid))
+            for label, sid in touched.items() if label in self.id_mapping
+        })
+        return labels
+
+    def _merge_enrolled(self, student_ids, vectors):
+        """
+        Re-enrolling a student with the same embedding (e.g. a sync of an unrelated
+        column) keeps their learned templates and indexes the centroid; a new
+        embedding starts their gallery over.
+        """
+        if not self.templates:
+            return vectors
+        vectors = vectors.copy()
+        for row, student_id in enumerate(student_ids):
+            gallery = self.templates.get(student_id)
+            if gallery is None:
+                continue
+            if float(((gallery[0] - vectors[row]) ** 2).sum()) < 1e-4:
+                vectors[row] = gallery_centroid(gallery)
+            else:
+                del self.templates[student_id]
+        return vectors
+
+    def add_templates(self, student_ids, embeddings, save=True):
+        """
+        Grow existing students' galleries with extra templates (e.g. faces recognized
+        with high confidence) and re-index their centroids. Unknown students and
+        near-duplicates of a stored template are skipped. Past GALLERY_MAX_TEMPLATES
+        the oldest learned template is dropped; the enrolled one is always kept.
+        Returns how many templates were added.
+        """
+        vectors = np.ascontiguousarray(embeddings, dtype='float32').reshape(-1, self.dimension)
+        cap = max(1, settings.GALLERY_MAX_TEMPLATES)
+        changed = {}
+        with self._lock:
+            for student_id, vector in zip(student_ids, vectors):
+                label = student_label(student_id)
+                if label not in self.id_mapping or cap == 1:
+                    continue
+                gallery = changed.get(student_id)
+                if gallery is None:
+                    gallery = self.templates.get(student_id)
+                if gallery is None:
+                    gallery = self._vectors([label])
+                if float(((gallery - vector) ** 2).sum(axis=1).min()) < settings.GALLERY_MIN_NOVELTY:
+                    continue
+                gallery = np.vstack([gallery, vector])
+                if len(gallery) > cap:
+                    gallery = np.vstack([gallery[:1], gallery[len(gallery) - cap + 1:]])
+                changed[student_id] = gallery
+
+            if changed:
+                student_ids = list(changed)
+                self._write_vectors(student_ids, np.stack([gallery_centroid(changed[sid]) for sid in student_ids]))
+                self.templates.update(changed)
+                self._dirty = True
+        if save and changed:
+            self.save_index()
+        return len(changed)
+
+    @property
+    def size(self):
+        # Indexed students; index.ntotal also counts HNSW tombstones
+        return len(self.id_mapping)
+
+    @property
+    def template_count(self):
+        # Students without an entry have their single enrolled template in the index
+        with self._lock:
+            return len(self.id_mapping) - len(self.templates) + sum(len(g) for g in self.templates.values())
+
+    def _remove_labels(self, labels):
+        """
+        Drop labels from the index. HNSW graphs cannot delete, so for that engine
+        every graph position holding one of the labels is tombstoned instead.
+        """
+        self._ensure_writable()
+        labels = np.array(labels, dtype=np.int64)
+        if self.exact is not None:
+            self.exact.remove_ids(faiss.IDSelectorBatch(labels))
+        if faiss.try_extract_index_ivf(self.index) is not None:
+            # The hashtable direct map (see _apply_search_params) only removes by IDSelectorArray
+            self.index.remove_ids(faiss.IDSelectorArray(len(labels), faiss.swig_ptr(labels)))
+            return
+        if self.engine != "hnsw":
+            self.index.remove_ids(faiss.IDSelectorBatch(labels))
+            return
+
+        positions = np.flatnonzero(np.isin(self._graph_labels(), labels))
+        self._set_tombstones(self._dead.union(positions.tolist()))
+
+    def _graph_labels(self):
+        """
+        Label of every HNSW graph position (the IDMap2 id block), cached until the next add.
+        """
+        if self._graph_ids is None:
+            self._graph_ids = faiss.vector_to_array(self.index.id_map)
+        return self._graph_ids
+
+    def _set_tombstones(self, positions):
+        self._dead = set(positions)
+        if self._dead:
+            # Keep the inner selector alive: IDSelectorNot only holds a pointer to it
+            self._dead_batch = faiss.IDSelectorBatch(np.fromiter(self._dead, dtype=np.int64, count=len(self._dead)))
+            self._dead_selector = faiss.IDSelectorNot(self._dead_batch)
+        else:
+            self._dead_batch = self._dead_selector = None
+
+    def _maybe_compact(self):
+        """
+        Rebuild the HNSW graph without its tombstones once they make up
+        INDEX_COMPACT_RATIO of it, so removals and re-enrollments cost O(1) each
+        and the O(N) rebuild is paid once per batch of them.
+        """
+        if self.engine != "hnsw" or not self._dead:
+            return
+        if len(self._dead) < settings.INDEX_COMPACT_RATIO * self.index.ntotal:
+            return
+
+        keep = np.fromiter(self.id_mapping.keys(), dtype=np.int64, count=len(self.id_mapping))
+        vectors = self._vectors(keep)
+        # An emptied copy keeps the trained quantizer of SQ / PQ graphs
+        base = faiss.clone_index(self._base_index(self.index))
+        base.reset()
+        base.hnsw.efSearch = self.ef_search
+        index = faiss.IndexIDMap2(base)
+        if len(keep):
+            index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), keep)
+
+        # Swap in only once fully populated
+        dropped = len(self._dead)
+        self.index = index
+        self._graph_ids = None
+        self._set_tombstones(())
+        print(f"🧹 HNSW graph compacted: {dropped} tombstones dropped, {self.index.ntotal} vectors.")
+
+    def _ensure_writable(self):
+        """
+        Copy a mmapped snapshot index into private memory before the first write.
+        """
+        if self._mmapped:
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            if self.exact is not None:
+                self.exact = faiss.deserialize_index(faiss.serialize_index(self.exact))
+            self._mmapped = False
+            self._apply_search_params()
+
+    def apply_delta(self, upserts, removals=(), sections=None, save=True):
+        """
+        Apply a batch of changes from the database.
+        `upserts` maps {student_id: embedding}; `removals` lists student_ids to drop.
+        Work is proportional to the size of the change, not the gallery.
+        """
+        removals = set(removals) - set(upserts)
+        with self._lock:
+            removed = self.remove_vectors(removals, save=False)
+
+            # Syncs re-read an overlap window; rows already indexed as-is are skipped
+            student_ids = [sid for sid in upserts if not self._is_current(sid, upserts[sid], (sections or {}).get(sid))]
+            if student_ids:
+                matrix = np.empty((len(student_ids), self.dimension), dtype='float32')
+                for row, student_id in enumerate(student_ids):
+                    matrix[row] = np.asarray(upserts[student_id], dtype='float32')
+                self.add_vectors(student_ids, matrix, save=False, sections=sections)
+
+        if save and (student_ids or removed):
+            self.save_index()
+
+        return len(student_ids), removed
+
+    def _is_current(self, student_id, embedding, section_id=None):
+        """
+        True if the student is indexed with this enrolled embedding and section.
+        """
+        label = student_label(student_id)
+        if label not in self.id_mapping:
+            return False
+        if section_id is not None and self.student_sections.get(student_id) != str(section_id):
+            return False
+        gallery = self.templates.get(student_id)
+        enrolled = gallery[0] if gallery is not None else self._vectors([label])[0]
+        return float(((enrolled - np.asarray(embedding, dtype='float32')) ** 2).sum()) < 1e-6
+
+    def search(self, embedding: np.array, k=1, section_id=None):
         """
         Search for the k nearest neighbors.
         Returns list of (student_id, distance).
         """
-        if self.index.ntotal == 0:
-            return []
-            
-        vector = embedding.reshape(1, -1).astype('float32')
-        distances, indices = self.index.search(vector, k)
-        
+        distances, student_ids = self.search_batch(embedding.reshape(1, -1), k, section_id=section_id)
+
         results = []
-        for i in range(k):
-            idx = indices[0][i]
-            dist = distances[0][i]
-            
-            if idx != -1 and idx in self.id_mapping:
-                results.append((self.id_mapping[idx], float(dist)))
-                
+        for student_id, dist in zip(student_ids[0], distances[0]):
+            if student_id is not None:
+                results.append((student_id, float(dist)))
+
         return results
 
-    def save_index(self):
+    @_locked
+    def search_batch(self, embeddings: np.array, k=1, section_id=None):
         """
-        Save index and mapping to disk.
+        Search the k nearest neighbors for every row of an (n, d) matrix in one call.
+        With `section_id`, only that section's roster is searched.
+        Returns (distances, student_ids): an (n, k) float32 array and n lists of k ids.
+        Empty slots have distance inf and student_id None.
         """
-        try:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.mapping_path, 'wb') as f:
-                pickle.dump(self.id_mapping, f)
-            print(f"✅ FAISS index saved locally ({self.index.ntotal} vectors).")
-        except Exception as e:
-            # On some cloud platforms (like Hugging Face), the root directory is read-only.
-            # This is OK because we sync from Supabase database on startup anyway.
-            print(f"ℹ️ Local FAISS cache not saved: {e}")
-            print("💡 This is normal on some servers. The system will sync from Supabase on restart.")
+        queries = np.ascontiguousarray(embeddings, dtype='float32').reshape(-1, self.dimension)
+        n = queries.shape[0]
 
-    def load_index(self):
+        if section_id is not None:
+            index, labels = self._section_index(str(section_id))
+        else:
+            index, labels = self.index, self.id_mapping
+
+        if index.ntotal == 0 or n == 0:
+            return np.full((n, k), np.inf, dtype='float32'), [[None] * k for _ in range(n)]
+
+        # Compressed codes: over-fetch and rescore on exact vectors.
+        # Multi-template galleries: shortlist on centroids, then score the candidates' templates.
+        exact = self.exact if section_id is None else None
+        candidates = k
+        if exact is not None:
+            candidates = max(candidates, k * settings.INDEX_RERANK)
+        if self.templates:
+            candidates = max(candidates, settings.GALLERY_SHORTLIST)
+        with span("search"):
+            if section_id is None and self._dead_selector is not None:
+                distances, indices = self._search_live(queries, candidates)
+            else:
+                distances, indices = index.search(queries, candidates)
+
+        if section_id is not None:
+            student_ids = [[labels[idx] if idx != -1 else None for idx in row] for row in indices]
+        else:
+            student_ids = [[labels.get(int(idx)) if idx != -1 else None for idx in row] for row in indices]
+        missing = np.array([[sid is None for sid in row] for row in student_ids], dtype=bool).reshape(n, -1)
+        distances[missing] = np.inf
+
+        if candidates == k:
+            return distances, student_ids
+
+        with span("rerank"):
+            if exact is not None:
+                found = ~missing
+                vectors = exact.reconstruct_batch(np.ascontiguousarray(indices[found], dtype=np.int64))
+                distances[found] = ((vectors - np.repeat(queries, found.sum(axis=1), axis=0)) ** 2).sum(axis=1)
+            return self._rerank(queries, distances, student_ids, k)
+
+    def _search_live(self, queries, candidates):
+        """
+        Search the HNSW graph directly, skipping tombstoned positions, and map the
+        positions back to labels.
+        """
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = self.ef_search
+        params.sel = self._dead_selector
+        distances, positions = self._base_index(self.index).search(queries, candidates, params=params)
+        graph_labels = self._graph_labels()
+        indices = np.where(positions >= 0, graph_labels[np.maximum(positions, 0)], -1)
+        return distances, indices
+
+    def _rerank(self, queries, distances, student_ids, k):
+        """
+        Replace each candidate's centroid distance with the distance to its
+        closest template (if it has several), then keep the best k per query.
+        """
+        out_distances = np.empty((len(queries), k), dtype='float32')
+        out_ids = []
+        for i, query in enumerate(queries):
+            row = distances[i].copy()
+            blocks, owners = [], []
+            for j, student_id in enumerate(student_ids[i]):
+                gallery = self.templates.get(student_id) if student_id is not None else None
+                if gallery is not None:
+                    blocks.append(gallery)
+                    owners.append(j)
+            if blocks:
+                starts = np.cumsum([0] + [len(b) for b in blocks[:-1]])
+                template_distances = ((np.concatenate(blocks) - query) ** 2).sum(axis=1)
+                row[owners] = np.minimum.reduceat(template_distances, starts)
+
+            order = np.argsort(row, kind='stable')[:k]
+            out_distances[i] = row[order]
+            out_ids.append([student_ids[i][j] for j in order])
+        return out_distances, out_ids
+
+    def _create_index(self, train_vectors, ntotal=None):
+        """
+        Build an empty index for the configured engine, trained on `train_vectors` if it needs it.
+        `ntotal` is the expected gallery size (defaults to the training set size).
+        Falls back to flat when there is too little data to train inverted lists.
+        Returns (engine, index).
+        """
+        n = train_vectors.shape[0]
+        ntotal = max(ntotal or 0, n)
+        engine = select_engine(ntotal) if self.engine_setting == "auto" else self.engine_setting
+
+        if engine in ("ivf_flat", "ivf_pq"):
+            nlist = settings.INDEX_IVF_NLIST or int(4 * np.sqrt(ntotal))
+            # FAISS wants ~39 training points per list; PQ codebooks need 256 per sub-quantizer
+            nlist = max(1, min(nlist, n // 39))
+            if n < 1000:
+                print(f"⚠️ Only {n} vectors; too few to train {engine}. Using flat index.")
+                engine = "flat"
+
+        storage = self._trainable_storage(n)
+
+        # IVF indexes take external ids natively; flat and HNSW need an IDMap2 wrapper
+        if engine == "hnsw":
+            M = settings.INDEX_HNSW_M
+            if storage == "pq":
+                base = faiss.IndexHNSWPQ(self.dimension, settings.INDEX_PQ_M, M)
+            elif storage in _SQ_TYPES:
+                base = faiss.IndexHNSWSQ(self.dimension, getattr(faiss.ScalarQuantizer, _SQ_TYPES[storage]), M)
+            else:
+                base = faiss.IndexHNSWFlat(self.dimension, M)
+            index = faiss.IndexIDMap2(base)
+        elif engine == "ivf_flat":
+            index = faiss.index_factory(self.dimension, f"IVF{nlist},{self._code_spec(storage)}")
+        elif engine == "ivf_pq":
+            index = faiss.index_factory(self.dimension, f"IVF{nlist},PQ{settings.INDEX_PQ_M}")
+        else:
+            index = faiss.IndexIDMap2(self._flat_codes(n))
+
+        if not index.is_trained:
+            print(f"⏳ Training {engine} index on {n} vectors...")
+            index.train(train_vectors)
+
+        return engine, index
+
+    def _training_size(self, ntotal):
+        """
+        How many leading vectors to buffer before creating the index during a chunked rebuild.
+        """
+        engine = select_engine(ntotal) if self.engine_setting == "auto" else self.engine_setting
+        if engine in ("ivf_flat", "ivf_pq"):
+            return max(10_000, 39 * (settings.INDEX_IVF_NLIST or int(4 * np.sqrt(max(ntotal, 1)))))
+        if self.storage == "pq":
+            return 10_000
+        if self.storage == "int8":
+            return 1000
+        return 1
+
+    def _trainable_storage(self, n):
+        """
+        The configured storage, or float32 when `n` vectors are too few to train it.
+        """
+        if self.storage == "pq" and n < 256:
+            print(f"⚠️ Only {n} vectors; too few to train PQ codes. Storing float32.")
+            return "float32"
+        if self.storage == "int8" and n == 0:
+            return "float32"
+        return self.storage
+
+    @staticmethod
+    def _code_spec(storage):
+        return {"float32": "Flat", "fp16": "SQfp16", "int8": "SQ8"}.get(storage, f"PQ{settings.INDEX_PQ_M}")
+
+    def _flat_codes(self, n):
+        """
+        Brute-force index over the configured vector codes (untrained).
+        """
+        storage = self._trainable_storage(n) if n else ("fp16" if self.storage == "fp16" else "float32")
+        if storage == "float32":
+            return faiss.IndexFlatL2(self.dimension)
+        return faiss.index_factory(self.dimension, self._code_spec(storage))
+
+    def _new_exact(self, index):
+        """
+        Exact float32 side store for a compressed index, or None if the index is exact.
+        """
+        if self.storage == "float32" or not self._is_compressed(index):
+            return None
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+
+    @classmethod
+    def _is_compressed(cls, index):
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            return not isinstance(ivf, faiss.IndexIVFFlat)
+        base = cls._base_index(index)
+        if isinstance(base, faiss.IndexHNSW):
+            base = faiss.downcast_index(base.storage)
+        return not isinstance(base, faiss.IndexFlat)
+
+    def _vectors(self, labels):
+        """
+        Stored vectors for the given labels, exact when an exact store is kept.
+        """
+        labels = np.ascontiguousarray(labels, dtype=np.int64)
+        if len(labels) == 0:
+            return np.empty((0, self.dimension), dtype='float32')
+        source = self.exact if self.exact is not None else self.index
+        return np.ascontiguousarray(source.reconstruct_batch(labels), dtype='float32')
+
+    def _apply_search_params(self):
+        """
+        Push nprobe / efSearch onto the current index, whichever applies.
+        """
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.nprobe = self.nprobe
+            # Reconstruct-by-label for section sub-indexes and HNSW-free removals
+            if ivf.direct_map.type != faiss.DirectMap.Hashtable:
+                ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        base = self._base_index(self.index)
+        if isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch = self.ef_search
+
+    @staticmethod
+    def _base_index(index):
+        # Unwrap IndexIDMap2 to reach the underlying engine
+        if isinstance(index, faiss.IndexIDMap):
+            return faiss.downcast_index(index.index)
+        return index
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """
+        Tune the recall/latency trade-off at runtime.
+        """
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        self._apply_search_params()
+
+    def _invalidate_sections(self, changes=None):
+        """
+        Drop cached section sub-indexes. `changes` maps label -> (old_section,
+        new_section) for the students just written or removed; only their
+        sections are rebuilt. Without it every section is dropped.
+        """
+        if changes is None:
+            self._section_indexes = {}
+            self._section_members = None
+            return
+        for label, (old, new) in changes.items():
+            for section in (old, new):
+                if section is not None:
+                    self._section_indexes.pop(section, None)
+            if self._section_members is not None and old != new:
+                if old is not None and label in self._section_members.get(old, ()):
+                    self._section_members[old].remove(label)
+                if new is not None:
+                    self._section_members.setdefault(new, []).append(label)
+
+    def _section_index(self, section_id):
+        """
+        Return (sub_index, student_ids) holding only the given section's students.
+        Built on first use from the global index and cached until the index changes.
+        """
+        cached = self._section_indexes.get(section_id)
+        if cached is not None:
+            return cached
+
+        if self._section_members is None:
+            # One pass over the mapping groups every section at once
+            members = {}
+            for label, student_id in self.id_mapping.items():
+                sec = self.student_sections.get(student_id)
+                if sec is not None:
+                    members.setdefault(sec, []).append(label)
+            self._section_members = members
+
+        labels = self._section_members.get(section_id, [])
+        sub_index = faiss.IndexFlatL2(self.dimension)
+        if labels:
+            sub_index.add(self._vectors(labels))
+
+        entry = (sub_index, [self.id_mapping[label] for label in labels])
+        self._section_indexes[section_id] = entry
+        return entry
+
+    @_locked
+    def section_size(self, section_id):
+        """
+        Number of indexed students in a section.
+        """
+        return len(self._section_index(section_id)[1])
+
+    def ensure_loaded(self):
         """
-        Load index and mapping from disk if they exist.
+        Load from disk once, no matter how many callers race here.
         """
-        if os.path.exists(self.index_path) and os.path.exists(self.mapping_path):
+        with self._load_lock:
+            if not self.loaded:
+                self.load_index()
+
+    def learn_templates(self, student_ids, embeddings):
+        """
+        Queue templates learned from recognitions. They reach the index (and the
+        snapshot) with the next flush(), so the index is written once per batch
+        rather than once per request.
+        """
+        vectors = np.asarray(embeddings, dtype='float32').reshape(-1, self.dimension)
+        with self._pending_lock:
+            self._pending_templates.append((list(student_ids), vectors))
+
+    def flush(self, min_interval=0):
+        """
+        Apply queued templates and save pending changes, at most once every `min_interval` seconds.
+        """
+        with self._lock:
+            if time.monotonic() - self._last_flush < min_interval:
+                return
+            self._last_flush = time.monotonic()
+            with self._pending_lock:
+                pending, self._pending_templates = self._pending_templates, []
+            if pending:
+                self.add_templates(
+                    [sid for ids, _ in pending for sid in ids], np.concatenate([v for _, v in pending]), save=False
+                )
+        if self._dirty:
+            self.save_index()
+
+    def save_index(self):
+        """
+        Publish the index as a new snapshot version (see index_snapshot).
+        The state is copied under the lock; searches only wait for that copy,
+        not for the snapshot to be written and fsynced.
+        """
+        # One save at a time, so an older copy is never published over a newer one
+        with self._save_lock:
+            dirty = self._dirty
             try:
-                self.index = faiss.read_index(self.index_path)
-                with open(self.mapping_path, 'rb') as f:
-                    self.id_mapping = pickle.load(f)
-                print(f"✅ FAISS index loaded. Total vectors: {self.index.ntotal}")
+                with self._lock:
+                    state = self._snapshot_state()
+                    dirty, self._dirty = self._dirty, False
+                manifest = write_snapshot(self.snapshot_dir, *state)
+                self._last_save = time.monotonic()
+                print(f"✅ FAISS snapshot {manifest['version']} saved locally ({manifest['count']} vectors).")
             except Exception as e:
-                print(f"❌ Failed to load FAISS index: {e}. Starting fresh.")
+                self._dirty = self._dirty or dirty
+                # On some cloud platforms (like Hugging Face), the root directory is read-only.
+                # This is OK because we sync from Supabase database on startup anyway.
+                print(f"ℹ️ Local FAISS cache not saved: {e}")
+                print("💡 This is normal on some servers. The system will sync from Supabase on restart.")
+
+    def _snapshot_state(self):
+        """
+        Copy of everything a snapshot holds, as write_snapshot arguments. Indexes
+        are serialized, so the copy stays consistent once the lock is released.
+        """
+        template_owners = list(self.templates)
+        header = {
+            "model": settings.FACE_MODEL,
+            "dimension": self.dimension,
+            "engine": self.engine,
+            "storage": self.storage if self.exact is not None else "float32",
+            "sync_watermark": self.sync_watermark,
+            "count": int(self.index.ntotal),
+        }
+        meta = {
+            "id_mapping": [[label, student_id] for label, student_id in self.id_mapping.items()],
+            "student_sections": dict(self.student_sections),
+            "templates": [[student_id, len(self.templates[student_id])] for student_id in template_owners],
+        }
+        arrays = {}
+        if self._dead:
+            arrays["tombstones"] = np.array(sorted(self._dead), dtype=np.int64)
+        if template_owners:
+            arrays["templates"] = np.concatenate([self.templates[sid] for sid in template_owners]).astype('float32')
+        indexes = {"exact": faiss.serialize_index(self.exact)} if self.exact is not None else None
+        return faiss.serialize_index(self.index), header, meta, arrays, indexes
+
+    def load_index(self):
+        """
+        Open the latest snapshot (mmapped when possible), or migrate a legacy cache.
+        """
+        with self._lock:
+            self._open_snapshot()
+        # A migrated legacy cache is rewritten as a snapshot
+        if self._dirty:
+            self.save_index()
+
+    def _open_snapshot(self):
+        self.loaded = True
+        try:
+            snapshot = read_snapshot(self.snapshot_dir, settings.FACE_MODEL, self.dimension, mmap=settings.INDEX_MMAP)
+        except Exception as e:
+            print(f"❌ Failed to load FAISS snapshot: {e}. Starting fresh.")
+            return
+
+        if snapshot is not None:
+            manifest, index, meta, mmapped = snapshot
+            self.index = index
+            self.exact = read_snapshot_index(self.snapshot_dir, manifest, "exact", mmap=settings.INDEX_MMAP)
+            self._mmapped = mmapped
+            self.engine = self._detect_engine(index)
+            self.id_mapping = {int(label): student_id for label, student_id in meta["id_mapping"]}
+            self.student_sections = meta.get("student_sections", {})
+            self.sync_watermark = manifest.get("sync_watermark")
+            self.templates = self._split_templates(
+                read_snapshot_array(self.snapshot_dir, manifest, "templates", mmap=settings.INDEX_MMAP),
+                meta.get("templates", [])
+            )
+            tombstones = read_snapshot_array(self.snapshot_dir, manifest, "tombstones", mmap=False)
+            self._graph_ids = None
+            self._set_tombstones(tombstones.tolist() if tombstones is not None else ())
+            self._apply_search_params()
+            self._invalidate_sections()
+            print(f"✅ FAISS snapshot {manifest['version']} loaded{' (mmap)' if mmapped else ''}. Total vectors: {self.index.ntotal}")
+        elif self.legacy_index_path and os.path.exists(self.legacy_index_path) and os.path.exists(self.legacy_mapping_path):
+            self._load_legacy()
         else:
             print("🆕 No existing FAISS index found. Starting fresh.")
 
-    def rebuild_index(self, embeddings_dict):
+    @staticmethod
+    def _split_templates(matrix, owners):
+        # Views into the (mmapped) matrix; galleries are copied when they next change
+        templates = {}
+        offset = 0
+        for student_id, count in owners:
+            templates[student_id] = matrix[offset:offset + count]
+            offset += count
+        return templates
+
+    def _load_legacy(self):
+        """
+        Load the old faiss_index.bin + id_mapping.pkl pair once and rewrite it as a snapshot.
+        """
+        try:
+            self.index = faiss.read_index(self.legacy_index_path)
+            self.exact = None
+            self._graph_ids = None
+            self._set_tombstones(())
+            self.engine = self._detect_engine(self.index)
+            with open(self.legacy_mapping_path, 'rb') as f:
+                mapping = pickle.load(f)
+            # Older caches pickled the bare {faiss_id: student_id} dict
+            if "id_mapping" in mapping:
+                self.id_mapping = mapping["id_mapping"]
+                self.student_sections = mapping.get("student_sections", {})
+                self.sync_watermark = mapping.get("sync_watermark")
+            else:
+                self.id_mapping = mapping
+            if self._uses_positional_ids():
+                self._migrate_positional_index()
+            self._apply_search_params()
+            self._invalidate_sections()
+            print(f"✅ Legacy FAISS index loaded. Total vectors: {self.index.ntotal}")
+            self._dirty = True
+        except Exception as e:
+            print(f"❌ Failed to load FAISS index: {e}. Starting fresh.")
+
+    def _uses_positional_ids(self):
+        # Caches written before stable labels used a bare flat/HNSW index keyed by position
+        return not isinstance(self.index, faiss.IndexIDMap) and faiss.try_extract_index_ivf(self.index) is None
+
+    def _migrate_positional_index(self):
+        """
+        Convert a positional-ID cache to stable labels, dropping duplicate
+        vectors left behind by re-registrations (the newest one wins).
+        """
+        positions = sorted(self.id_mapping)
+        vectors = self.index.reconstruct_n(0, self.index.ntotal) if self.index.ntotal else np.empty((0, self.dimension), dtype='float32')
+        student_ids = [self.id_mapping[pos] for pos in positions]
+        matrix = vectors[positions] if positions else vectors
+
+        base = faiss.IndexHNSWFlat(self.dimension, settings.INDEX_HNSW_M) if self.engine == "hnsw" else faiss.IndexFlatL2(self.dimension)
+        self.index = faiss.IndexIDMap2(base)
+        self._graph_ids = None
+        self._set_tombstones(())
+        self.id_mapping = {}
+        self.add_vectors(student_ids, matrix, save=False)
+        print(f"🔁 Migrated FAISS cache to stable student labels ({self.index.ntotal} vectors).")
+
+    @classmethod
+    def _detect_engine(cls, index):
+        if isinstance(cls._base_index(index), faiss.IndexHNSW):
+            return "hnsw"
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            return "ivf_pq" if isinstance(ivf, faiss.IndexIVFPQ) else "ivf_flat"
+        return "flat"
+
+    def rebuild_index(self, embeddings_dict, sections=None, save=True):
         """
         Rebuild index from a dictionary of {student_id: embedding_list}.
+        `sections` optionally maps {student_id: section_id} for scoped search.
         Useful for migration or restore.
         """
-        self.index.reset()
-        self.id_mapping = {}
-        
-        for student_id, emb_list in embeddings_dict.items():
-            emb_np = np.array(emb_list).astype('float32')
-            self.add_vector(student_id, emb_np)
-            
-        print(f"✅ FAISS index rebuilt with {len(embeddings_dict)} entries.")
+        # Build one contiguous (n, d) matrix and add it in a single call,
+        # so the index is written to disk once instead of once per student.
+        student_ids = list(embeddings_dict.keys())
+        matrix = np.empty((len(student_ids), self.dimension), dtype='float32')
+        for row, student_id in enumerate(student_ids):
+            matrix[row] = np.asarray(embeddings_dict[student_id], dtype='float32')
+
+        self.rebuild_from_chunks([(student_ids, matrix, sections or {})], expected_total=len(student_ids), save=save)
+
+    def rebuild_from_chunks(self, chunks, expected_total=0, save=True):
+        """
+        Rebuild from an iterable of (student_ids, matrix, sections) chunks without
+        holding the whole gallery in memory. Engines that need training are trained
+        on a bounded sample of leading chunks. The live index keeps serving searches
+        until the new one is complete and swapped in.
+        """
+        train_size = self._training_size(expected_total)
+        pending = []
+        buffered = 0
+        engine, index, exact = None, None, None
+        id_mapping = {}
+        student_sections = {}
+
+        def add_chunk(student_ids, matrix):
+            labels = np.fromiter((student_label(sid) for sid in student_ids), dtype=np.int64, count=len(student_ids))
+            vectors = np.ascontiguousarray(matrix, dtype='float32')
+            index.add_with_ids(vectors, labels)
+            if exact is not None:
+                exact.add_with_ids(vectors, labels)
+            id_mapping.update(zip(labels.tolist(), student_ids))
+
+        for student_ids, matrix, sections in chunks:
+            student_sections.update({sid: str(sec) for sid, sec in sections.items() if sec is not None})
+            if index is None:
+                pending.append((student_ids, matrix))
+                buffered += len(student_ids)
+                if buffered < train_size:
+                    continue
+                engine, index = self._create_index(np.concatenate([m for _, m in pending]), ntotal=expected_total)
+                exact = self._new_exact(index)
+                for ids, m in pending:
+                    add_chunk(ids, m)
+                pending = []
+            elif len(student_ids):
+                add_chunk(student_ids, matrix)
+
+        if index is None:
+            train = np.concatenate([m for _, m in pending]) if pending else np.empty((0, self.dimension), dtype='float32')
+            engine, index = self._create_index(train, ntotal=expected_total)
+            exact = self._new_exact(index)
+            for ids, m in pending:
+                add_chunk(ids, m)
+
+        # Swap in the finished index; searches keep using the old one until here
+        with self._lock:
+            self.engine, self.index, self.exact = engine, index, exact
+            self._mmapped = False
+            self._graph_ids = None
+            self._set_tombstones(())
+            self.id_mapping = id_mapping
+            self.student_sections = student_sections
+            self._apply_search_params()
+            self._invalidate_sections()
+
+            # Learned templates survive for students whose enrolled embedding did not change
+            carried = [sid for sid in self.templates if student_label(sid) in id_mapping]
+            self.templates = {sid: self.templates[sid] for sid in carried}
+            if carried:
+                labels = np.array([student_label(sid) for sid in carried], dtype=np.int64)
+                vectors = self._merge_enrolled(carried, self._vectors(labels))
+                rows = [row for row, sid in enumerate(carried) if sid in self.templates]
+                if rows:
+                    self._write_vectors([carried[row] for row in rows], vectors[rows])
+        if save:
+            self.save_index()
+
+        print(f"✅ FAISS index rebuilt with {self.index.ntotal} entries ({self.engine}).")
 
 # Global instance
-vector_search = VectorSearch()
+vector_search = VectorSearch(legacy_index_path="faiss_index.bin", legacy_mapping_path="id_mapping.pkl", autoload=False)
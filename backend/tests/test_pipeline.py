@@ -2,13 +2,24 @@ import sys
 import os
 import cv2
 import numpy as np
+import tempfile
+import time
+import asyncio
+import io
+import zipfile
 
 # Adjust path to find backend modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 try:
     from services.face_logic import face_service
-    from services.vector_search import vector_search
+    from services.vector_search import vector_search, VectorSearch
+    from services.assignment import assign_faces
+    from services.result_cache import ResultCache
+    from services.face_tracker import FaceTracker, Track
+    from services.attendance_session import StreamingSession
+    from services.bulk_enrollment import read_archive, check_quality
+    from services.attendance_analytics import AttendanceAnalytics
     print("✅ Successfully imported services.")
 except ImportError as e:
     print(f"❌ Import failed: {e}")
@@ -16,6 +27,8 @@ except ImportError as e:
 
 def test_initialization():
     print("--- Testing Initialization ---")
+    face_service.load()
+    vector_search.ensure_loaded()
     if face_service.app:
         print("✅ InsightFace (buffalo_l) initialized.")
     else:
@@ -46,6 +59,367 @@ def test_vector_search():
     else:
         print("❌ Vector search verification FAILED.")
 
+def test_bulk_rebuild():
+    print("\n--- Testing Bulk Rebuild ---")
+    vectors = np.random.rand(100, 512).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    embeddings = {f"bulk_student_{i}": vectors[i].tolist() for i in range(len(vectors))}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir)
+        vs.rebuild_index(embeddings)
+        results = vs.search(vectors[42], k=1)
+
+    if vs.index.ntotal == 100 and results and results[0][0] == "bulk_student_42":
+        print("✅ Bulk rebuild verification PASSED.")
+    else:
+        print("❌ Bulk rebuild verification FAILED.")
+
+def test_section_scoped_search():
+    print("\n--- Testing Section-Scoped Search ---")
+    vectors = np.random.rand(20, 512).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    embeddings = {f"student_{i}": vectors[i].tolist() for i in range(20)}
+    sections = {f"student_{i}": "A" if i < 10 else "B" for i in range(20)}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir)
+        vs.rebuild_index(embeddings, sections=sections)
+        # student_15 is in section B, so a section A search must not return it
+        in_section = vs.search(vectors[15], k=1, section_id="B")
+        out_of_section = vs.search(vectors[15], k=1, section_id="A")
+
+    if in_section[0][0] == "student_15" and out_of_section and out_of_section[0][0] != "student_15":
+        print("✅ Section-scoped search verification PASSED.")
+    else:
+        print("❌ Section-scoped search verification FAILED.")
+
+def test_upsert_remove():
+    print("\n--- Testing Upsert / Remove ---")
+    first, second = np.random.rand(2, 512).astype('float32')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir)
+        vs.upsert_vector("re_registered", first)
+        vs.upsert_vector("re_registered", second)
+        count_after_upsert = vs.index.ntotal
+        removed = vs.remove_vector("re_registered")
+
+    if count_after_upsert == 1 and removed and vs.index.ntotal == 0:
+        print("✅ Upsert / remove verification PASSED.")
+    else:
+        print("❌ Upsert / remove verification FAILED.")
+
+def test_upsert_remove_engines():
+    print("\n--- Testing Upsert / Remove On Every Engine ---")
+    rng = np.random.default_rng(13)
+    # Enough vectors to train inverted lists and PQ codes
+    gallery = rng.standard_normal((1201, 512)).astype('float32')
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    n = len(gallery) - 1
+
+    failed = []
+    for engine in ("flat", "hnsw", "ivf_flat", "ivf_pq"):
+        for storage in ("float32", "fp16", "int8", "pq"):
+            try:
+                with tempfile.TemporaryDirectory() as workdir:
+                    vs = VectorSearch(snapshot_dir=workdir, engine=engine, storage=storage, nprobe=64)
+                    vs.rebuild_index({f"s{i}": gallery[i] for i in range(n)}, save=False)
+                    vs.upsert_vector("s1", gallery[n], save=False)
+                    removed = vs.remove_vector("s0", save=False)
+                    gone = "s0" not in [sid for sid, _ in vs.search(gallery[0], k=10)]
+                    moved = [sid for sid, _ in vs.search(gallery[n], k=10)].count("s1") == 1
+                if not (removed and gone and moved and vs.size == n - 1):
+                    failed.append(f"{engine}/{storage}")
+            except Exception as e:
+                failed.append(f"{engine}/{storage}: {e}")
+
+    if not failed:
+        print("✅ Upsert / remove on every engine verification PASSED.")
+    else:
+        print(f"❌ Upsert / remove on every engine verification FAILED. {failed}")
+
+def test_snapshot_cleanup():
+    print("\n--- Testing Snapshot Cleanup ---")
+    vector = np.ones((1, 512), dtype='float32')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir)
+        vs.add_vectors(["a"], vector)
+        first = set(os.listdir(workdir))
+        # Another worker's half-written and not-yet-published files
+        future = f"index-{int(time.time() * 1000) + 60_000}-0123abcd.faiss"
+        for name in (future, future + ".tmp"):
+            open(os.path.join(workdir, name), "w").close()
+        vs.add_vectors(["b"], vector)
+        vs.add_vectors(["c"], vector)
+        remaining = set(os.listdir(workdir))
+
+    oldest = {name for name in first if name.startswith(("index-", "meta-"))}
+    if future in remaining and future + ".tmp" in remaining and not (oldest & remaining):
+        print("✅ Snapshot cleanup verification PASSED.")
+    else:
+        print(f"❌ Snapshot cleanup verification FAILED. Files: {sorted(remaining)}")
+
+def test_delta_overlap():
+    print("\n--- Testing Delta Sync Overlap ---")
+    rng = np.random.default_rng(5)
+    vectors = rng.standard_normal((2, 512)).astype('float32')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir)
+        first = vs.apply_delta({"a": vectors[0], "b": vectors[1]}, sections={"a": "s1", "b": "s1"})
+        # The next sync re-reads the same rows from its overlap window
+        again = vs.apply_delta({"a": vectors[0], "b": vectors[1]}, sections={"a": "s1", "b": "s1"})
+        moved = vs.apply_delta({"a": vectors[0]}, sections={"a": "s2"})
+
+    if first == (2, 0) and again == (0, 0) and moved == (1, 0) and vs.section_size("s2") == 1:
+        print("✅ Delta sync overlap verification PASSED.")
+    else:
+        print(f"❌ Delta sync overlap verification FAILED. Results: {first}, {again}, {moved}")
+
+def test_hnsw_tombstones():
+    print("\n--- Testing HNSW Tombstones ---")
+    rng = np.random.default_rng(11)
+    gallery = rng.standard_normal((21, 512)).astype('float32')
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir, engine="hnsw")
+        vs.rebuild_index({f"s{i}": gallery[i] for i in range(20)})
+        # A removal and a re-enrollment leave two dead graph positions, no rebuild
+        vs.remove_vector("s0")
+        vs.upsert_vector("s1", gallery[20])
+        dead = len(vs._dead)
+        removed = vs.search(gallery[0], k=1)
+        moved = vs.search(gallery[20], k=1)
+        stale = vs.search(gallery[1], k=20)
+
+        reloaded = VectorSearch(snapshot_dir=workdir, engine="hnsw")
+        reloaded_removed = reloaded.search(gallery[0], k=1)
+
+    if (dead == 2 and vs.size == 19 and removed[0][0] != "s0" and moved[0] == ("s1", moved[0][1])
+            and moved[0][1] < 1e-4 and [sid for sid, _ in stale].count("s1") == 1
+            and len(reloaded._dead) == 2 and reloaded_removed[0][0] != "s0"):
+        print("✅ HNSW tombstone verification PASSED.")
+    else:
+        print(f"❌ HNSW tombstone verification FAILED. Dead: {dead}, results: {removed}, {moved}")
+
+def test_multi_template_gallery():
+    print("\n--- Testing Multi-Template Gallery ---")
+    rng = np.random.default_rng(7)
+    enrolled, lit, other = rng.standard_normal((3, 512)).astype('float32')
+    enrolled, lit, other = [v / np.linalg.norm(v) for v in (enrolled, lit, other)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir)
+        vs.add_vectors(["multi", "single"], np.stack([enrolled, other]))
+        added = vs.add_templates(["multi"], lit.reshape(1, -1))
+        # A query equal to the learned template should match it exactly after reranking
+        results = vs.search(lit, k=1)
+        count_after_learning = vs.index.ntotal
+
+        reloaded = VectorSearch(snapshot_dir=workdir)
+        templates_after_reload = len(reloaded.templates.get("multi", []))
+
+    if (added == 1 and count_after_learning == 2 and results[0][0] == "multi"
+            and results[0][1] < 1e-4 and templates_after_reload == 2):
+        print("✅ Multi-template gallery verification PASSED.")
+    else:
+        print(f"❌ Multi-template gallery verification FAILED. Results: {results}")
+
+def test_buffered_template_learning():
+    print("\n--- Testing Buffered Template Learning ---")
+    rng = np.random.default_rng(9)
+    vectors = rng.standard_normal((3, 512)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir)
+        vs.add_vectors(["a", "b"], vectors[:2], sections={"a": "s1", "b": "s2"})
+        vs.section_size("s1"), vs.section_size("s2")
+        vs.learn_templates(["a"], vectors[2:])
+        queued = len(vs.templates)
+        vs.flush(min_interval=3600)  # too soon: still queued
+        held = len(vs.templates)
+        vs.flush()
+        # Only the learning student's section is rebuilt
+        cached = sorted(vs._section_indexes)
+
+    if queued == 0 and held == 0 and len(vs.templates.get("a", [])) == 2 and cached == ["s2"]:
+        print("✅ Buffered template learning verification PASSED.")
+    else:
+        print(f"❌ Buffered template learning verification FAILED. Cached sections: {cached}")
+
+def test_one_to_one_assignment():
+    print("\n--- Testing One-to-One Assignment ---")
+    # Both faces are closest to "a"; the second one should fall back to "b"
+    distances = np.array([[0.40, 0.90], [0.50, 0.60], [1.70, np.inf]], dtype='float32')
+    student_ids = [["a", "b"], ["a", "b"], ["c", None]]
+    assigned, best = assign_faces(distances, student_ids, threshold=1.6)
+
+    if assigned == ["a", "b", None] and np.isclose(best[1], 0.60) and np.isinf(best[2]):
+        print("✅ One-to-one assignment verification PASSED.")
+    else:
+        print(f"❌ One-to-one assignment verification FAILED. Assigned: {assigned}")
+
+def test_compressed_storage():
+    print("\n--- Testing Compressed Storage ---")
+    rng = np.random.default_rng(3)
+    gallery = rng.standard_normal((50, 512)).astype('float32')
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        vs = VectorSearch(snapshot_dir=workdir, storage="fp16")
+        vs.rebuild_index({f"s{i}": gallery[i] for i in range(len(gallery))})
+        results = vs.search(gallery[7], k=1)
+        # Reranked distances come from the exact float32 copies
+        reloaded = VectorSearch(snapshot_dir=workdir, storage="fp16")
+        reloaded_results = reloaded.search(gallery[7], k=1)
+
+    if (vs.exact is not None and results[0][0] == "s7" and results[0][1] < 1e-6
+            and reloaded.exact is not None and reloaded_results[0][0] == "s7"):
+        print("✅ Compressed storage verification PASSED.")
+    else:
+        print(f"❌ Compressed storage verification FAILED. Results: {results}")
+
+def test_result_cache():
+    print("\n--- Testing Result Cache ---")
+    cache = ResultCache(max_entries=2, ttl=60)
+    calls = []
+
+    async def extract():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [np.ones(512, dtype='float32')]
+
+    async def scenario():
+        # Two concurrent uploads of the same bytes, then a retry, then other photos
+        await asyncio.gather(
+            cache.get_or_compute("embeddings", b"photo-a", extract),
+            cache.get_or_compute("embeddings", b"photo-a", extract),
+        )
+        await cache.get_or_compute("embeddings", b"photo-a", extract)
+        await cache.get_or_compute("embeddings", b"photo-b", extract)
+        await cache.get_or_compute("embeddings", b"photo-c", extract)
+
+    asyncio.run(scenario())
+    stats = cache.stats()
+
+    if len(calls) == 3 and stats["hits"] == 1 and stats["coalesced"] == 1 and stats["evictions"] == 1:
+        print("✅ Result cache verification PASSED.")
+    else:
+        print(f"❌ Result cache verification FAILED. Stats: {stats}, computations: {len(calls)}")
+
+def test_face_tracker():
+    print("\n--- Testing Face Tracker ---")
+    tracker = FaceTracker(iou_threshold=0.3, max_misses=1)
+    # A face drifting right by 10px per detection, and one that disappears
+    first = tracker.update([[100, 100, 200, 200], [400, 100, 500, 200]], {}, frame_index=0)
+    first[0].confirmed = True
+    tracker.predict()
+    skip = tracker.skip_tracks(frame_index=1)
+    second = tracker.update([[110, 100, 210, 200]], {0: skip[0]}, frame_index=1)
+    tracker.predict()
+    third = tracker.update([[121, 100, 221, 200]], {}, frame_index=2)
+
+    if (len(skip) == 1 and second[0] is first[0] and third[0] is first[0]
+            and len(tracker.tracks) == 1 and third[0].velocity[0] > 0):
+        print("✅ Face tracker verification PASSED.")
+    else:
+        print(f"❌ Face tracker verification FAILED. Tracks: {[t.id for t in tracker.tracks]}")
+
+def test_stream_predicted_frames():
+    print("\n--- Testing Stream Predicted Frames ---")
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    session = StreamingSession(send=send, detect_every=3)
+    # State after a detection on frame 0: one face moving 2 px right per frame
+    track = Track(1, [100, 100, 140, 140], 0)
+    track.velocity[:] = [2, 0, 2, 0]
+    session.tracker.tracks = [track]
+    session._last_detect = 0
+    session.frames_received = 1
+
+    async def run():
+        await session.submit(b"frame 1")
+        await session.submit(b"frame 2")
+    asyncio.run(run())
+
+    boxes = [message["tracks"][0]["bbox"] for message in sent]
+    if ([message["frame"] for message in sent] == [1, 2] and not any(m["detected"] for m in sent)
+            and boxes == [[102, 100, 142, 140], [104, 100, 144, 140]] and list(track.bbox) == [100, 100, 140, 140]):
+        print("✅ Stream predicted frames verification PASSED.")
+    else:
+        print(f"❌ Stream predicted frames verification FAILED. Messages: {sent}")
+
+def test_bulk_enrollment_archive():
+    print("\n--- Testing Bulk Enrollment Archive ---")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("2021-042.jpg", b"photo")
+        archive.writestr("2021-043/front.jpg", b"photo")
+        archive.writestr("2021-043/side.png", b"photo")
+        archive.writestr("__MACOSX/._2021-042.jpg", b"junk")
+        archive.writestr("notes.txt", b"not a photo")
+    opened, photos, failures = read_archive(buffer.getvalue())
+    with opened:
+        keys = sorted(key for _, key, _ in photos)
+        contents = {opened.read(info) for _, _, info in photos}
+    # Three 5-byte photos are over a 12-byte decompression budget
+    try:
+        read_archive(buffer.getvalue(), max_uncompressed_bytes=12)
+        bomb_rejected = False
+    except ValueError:
+        bomb_rejected = True
+
+    embedding = np.ones(512, dtype='float32')
+    portrait = {"bbox": [0, 0, 200, 240], "score": 0.9, "embedding": embedding}
+    group = [portrait, {"bbox": [300, 0, 480, 220], "score": 0.9, "embedding": embedding}]
+    tiny = {"bbox": [0, 0, 40, 40], "score": 0.9, "embedding": embedding}
+    checks = [check_quality([portrait])[1], check_quality(group)[1], check_quality([tiny])[1], check_quality([])[1]]
+
+    if keys == ["2021-042", "2021-043", "2021-043"] and contents == {b"photo"} and not failures and bomb_rejected and \
+            checks == [None, "multiple_faces", "face_too_small", "no_face"]:
+        print("✅ Bulk enrollment archive verification PASSED.")
+    else:
+        print(f"❌ Bulk enrollment archive verification FAILED. Keys: {keys}, checks: {checks}")
+
+def test_analytics_validation():
+    print("\n--- Testing Analytics Validation ---")
+    analytics = AttendanceAnalytics()
+    rejected = 0
+    # Bad arguments are refused before any database round trip
+    for kwargs in ({"group_by": "teacher"}, {"order": "name"}, {"order": "-created_at"}):
+        try:
+            analytics.query(**kwargs)
+        except ValueError:
+            rejected += 1
+
+    if rejected == 3 and analytics.stats()["misses"] == 0:
+        print("✅ Analytics validation verification PASSED.")
+    else:
+        print(f"❌ Analytics validation verification FAILED. Rejected {rejected} of 3.")
+
 if __name__ == "__main__":
     test_initialization()
     test_vector_search()
+    test_bulk_rebuild()
+    test_section_scoped_search()
+    test_upsert_remove()
+    test_upsert_remove_engines()
+    test_snapshot_cleanup()
+    test_delta_overlap()
+    test_hnsw_tombstones()
+    test_multi_template_gallery()
+    test_buffered_template_learning()
+    test_one_to_one_assignment()
+    test_compressed_storage()
+    test_result_cache()
+    test_face_tracker()
+    test_stream_predicted_frames()
+    test_bulk_enrollment_archive()
+    test_analytics_validation()